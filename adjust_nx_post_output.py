@@ -0,0 +1,68 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+from pathlib import Path
+import sys
+from .cnc_program import CncProgram
+from .instrumentation import Instrumentation
+from .machine_model import MachineModel
+
+def adjust_nx_post_output(fpath, out_fpath=None, instrumentation=None, pattern_count=3,
+                          split_max_bytes=None, split_max_blocks=None, extcall=False, machine_model=None,
+                          parallel=False):
+    '''Applies the DMU65 adjustments to the NX post output MPF file at fpath, writing the result to out_fpath (or
+    overwriting fpath if out_fpath is None).  Every stage is reported through instrumentation.  If split_max_bytes or
+    split_max_blocks is specified, the result is written as a main program calling a sequence of subprograms, each
+    within that budget (see CncProgram.export_mpf_split).  machine_model gives the rotary axis conventions (the default
+    MachineModel describes our DMU65).  If parallel is True, the program is transformed across a process pool (see
+    CncProgram.transform_for_dmu65ul_parallel) rather than serially.  That has not been measured to be faster than the
+    serial transform, and should not be used where adjust_nx_post_output is itself run in a pool worker.'''
+    fpath = Path(fpath)
+    if out_fpath is None:
+        out_fpath = fpath.parent / fpath.name
+    cnc_program = CncProgram(instrumentation, machine_model)
+    cnc_program.import_mpf(fpath)
+    transform = cnc_program.transform_for_dmu65ul_parallel if parallel else cnc_program.transform_for_dmu65ul
+    for _ in transform():
+        pass
+    cnc_program.apply_tool_preloading()
+    cnc_program.pattern_ops_across_homes(pattern_count)
+    if split_max_bytes is None and split_max_blocks is None:
+        cnc_program.export_mpf(out_fpath)
+    else:
+        cnc_program.export_mpf_split(out_fpath, split_max_bytes, split_max_blocks, extcall)
+    return cnc_program
+
+def _print_stage_event(event, record):
+    if event == 'finished':
+        print('{}: {:.3f}s wall, {:.3f}s cpu, {} -> {} blocks'.format(
+            record.name, record.wall_time, record.cpu_time, record.blocks_in, record.blocks_out), file=sys.stderr)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('DMU65 NX post output adjuster batch commandline interface.')
+    parser.add_argument('inputs', type=str, nargs='+')
+    parser.add_argument('--output-dir', type=str, default=None, help='write outputs here rather than overwriting the inputs')
+    parser.add_argument('--report-dir', type=str, default=None, help='write a JSON instrumentation report per input file here')
+    parser.add_argument('--profile-stage', type=str, default=None, help='run the named stage under cProfile')
+    parser.add_argument('--profile-dir', type=str, default=None, help='write cProfile stats per input file here')
+    parser.add_argument('--trace-memory', action='store_true', help='measure per-stage peak memory with tracemalloc')
+    parser.add_argument('--pattern-count', type=int, default=3)
+    parser.add_argument('--split-bytes', type=int, default=None, help='split output into subprograms of at most this many bytes')
+    parser.add_argument('--split-blocks', type=int, default=None, help='split output into subprograms of at most this many blocks')
+    parser.add_argument('--extcall', action='store_true', help='call split subprograms with EXTCALL')
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile')
+    parser.add_argument('--parallel', action='store_true', help='transform each program across a process pool')
+    args = parser.parse_args()
+    machine_model = None if args.machine_profile is None else MachineModel.load(args.machine_profile)
+    for input in args.inputs:
+        fpath = Path(input)
+        out_fpath = None if args.output_dir is None else Path(args.output_dir) / fpath.name
+        profile_fpath = None if args.profile_dir is None else Path(args.profile_dir) / (fpath.name + '.pstats')
+        instrumentation = Instrumentation(args.profile_stage, profile_fpath, args.trace_memory)
+        instrumentation.listeners.append(_print_stage_event)
+        print(fpath, file=sys.stderr)
+        adjust_nx_post_output(
+            fpath, out_fpath, instrumentation, args.pattern_count, args.split_bytes, args.split_blocks, args.extcall,
+            machine_model, args.parallel)
+        if args.report_dir is not None:
+            instrumentation.write_report(Path(args.report_dir) / (fpath.name + '.report.json'), fpath)
@@ -0,0 +1,329 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import math
+import numpy
+import re
+import sys
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
+
+_N_WORD_RE = re.compile(r'N\d+', flags=re.IGNORECASE)
+_G_WORD_RE = re.compile(r'G0*(\d+)', flags=re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+_VECTOR_NAMES = ('A3=', 'B3=', 'C3=')
+# Plane G-code -> (abscissa, ordinate, perpendicular) axis indexes.  A counterclockwise arc in (abscissa, ordinate) is
+# a G3 in every plane.
+_PLANES = {17: (0, 1, 2), 18: (2, 0, 1), 19: (1, 2, 0)}
+_AXIS_NAMES = 'XYZ'
+_CENTER_NAMES = 'IJK'
+
+@attr.s
+class ArcFitReport:
+    '''Blocks read and written by ArcFitter for each operation, as a list of [operation name, blocks in, blocks out] in
+    program order, and the number of arcs written.'''
+    operations = attr.ib(factory=list)
+    arcs = attr.ib(default=0)
+
+    def as_dict(self):
+        return {
+            'arcs': self.arcs,
+            'operations': [
+                {'operation': name, 'blocks_in': blocks_in, 'blocks_out': blocks_out,
+                 'compression_ratio': blocks_in / blocks_out if blocks_out else None}
+                for name, blocks_in, blocks_out in self.operations]}
+
+class ArcFitter:
+    '''Replaces each run of G1 moves lying on a circular arc in the active plane (G17, G18, or G19) with a single G2 or
+    G3 block.  The arc passes through the start and end points of the moves it replaces, and is used only if every
+    replaced point is within tolerance of it and the arc is within tolerance of every replaced move (ie, no chord's
+    sagitta exceeds tolerance).  The arc center is written as incremental I, J, and K words, or as a CR= radius if
+    use_cr is True.
+
+    Moves are considered for fitting if they are absolute G1 moves, possibly with the G1 modal, with X, Y, and Z words
+    not leaving the plane and no other words apart from A3=, B3=, and C3= tool vector words leaving the tool vector
+    unchanged.  Any other block ends the run.  Where moves following an arc rely on modal G1, G1 is restored.
+
+    Blocks are counted for ArcFitReport per operation, operations being named by ';Operation : NAME' comments.'''
+
+    def __init__(self, tolerance=0.0005, use_cr=False, min_blocks=3, instrumentation=None):
+        self.tolerance = tolerance
+        self.use_cr = use_cr
+        self.min_blocks = min_blocks
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.report = None
+
+    def run(self, inputf, outputf):
+        with self.instrumentation.stage('ArcFitter.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+        return self.report
+
+    def _run(self, inputf, outputf, stage):
+        self.report = report = ArcFitReport()
+        operation = ['(program start)', 0, 0]
+        report.operations.append(operation)
+        # Modal state; positions are NaN where not known, and position_texts holds the text of the word that set each
+        position = numpy.full(3, numpy.nan)
+        position_texts = [None, None, None]
+        vector = [0.0, 0.0, 1.0]
+        motion = None
+        plane = 17
+        absolute = True
+        # The moves of the current run, as (N word or None, words other than G1, whether G1 is explicit, end point in
+        # the plane, text of the end point in the plane, input line), and the point the run starts from
+        run = []
+        run_start = None
+
+        def emit(out_line):
+            print(out_line, file=outputf)
+            stage.blocks_out += 1
+            stage.bytes_written += text_bytes(out_line, outputf) + 1
+            operation[2] += 1
+
+        def flush(motion_follows):
+            nonlocal run, run_start
+            if run:
+                self._write_run(run, run_start, plane, motion_follows, emit)
+                run = []
+                run_start = None
+
+        for line in inputf:
+            stage.blocks_in += 1
+            if stage.blocks_in % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            stage.bytes_read += text_bytes(line, inputf)
+            line = line.rstrip('\r\n')
+            n_word, words, comment = _split_block(line)
+            block = _parse_words(words)
+            g_motion, g_plane, g_distance, updates, vector_updates, other = block
+            block_motion = motion if g_motion is None else g_motion
+            if (
+                    not other and comment is None and g_plane is None and g_distance is None and absolute
+                    and block_motion == 1 and updates and not numpy.isnan(position).any()
+                    and all(vector[idx] == value for idx, value in vector_updates)):
+                end = position.copy()
+                for idx, value, text in updates:
+                    end[idx] = value
+                u, v, w = _PLANES[plane]
+                if end[w] == position[w]:
+                    if not run:
+                        run_start = position[[u, v]]
+                    for idx, value, text in updates:
+                        position_texts[idx] = text
+                    run.append((
+                        n_word, [word for word in words if not _is_g1(word)], g_motion == 1, end[[u, v]],
+                        (position_texts[u], position_texts[v]), line))
+                    operation[1] += 1
+                    position = end
+                    motion = 1
+                    continue
+            flush(g_motion in (0, 1, 2, 3))
+            if comment is not None and comment[1:].lstrip().startswith('Operation'):
+                operation = [comment.partition(':')[2].strip() or operation[0], 0, 0]
+                report.operations.append(operation)
+            operation[1] += 1
+            emit(line)
+            if g_motion is not None:
+                motion = g_motion
+            if g_plane is not None:
+                plane = g_plane
+            if g_distance is not None:
+                absolute = g_distance == 90
+            for idx, value, text in updates:
+                position[idx] = value if absolute else numpy.nan
+                position_texts[idx] = text
+            for idx, value in vector_updates:
+                vector[idx] = value
+        flush(True)
+        report.operations = [op for op in report.operations if op[1]]
+
+    def _write_run(self, run, run_start, plane, motion_follows, emit):
+        """Writes the moves of run, replacing those lying on arcs with G2 and G3 blocks.  motion_follows is False if
+        the block following the run may rely on modal G1."""
+        points = numpy.vstack([run_start] + [move[3] for move in run])
+        arcs = fit_arcs(points, self.tolerance, self.min_blocks) if len(run) >= self.min_blocks else []
+        u, v, w = _PLANES[plane]
+        after_arc = False
+        move_idx = 0
+        for start, end, center, ccw, sweep in arcs:
+            for n_word, words, explicit_g1, end_point, end_texts, line in run[move_idx:start]:
+                emit(_restore_g1(n_word, words) if after_arc and not explicit_g1 else line)
+                after_arc = False
+            n_word = run[start][0]
+            end_texts = run[end-1][4]
+            out_words = [] if n_word is None else [n_word]
+            out_words.append('G3' if ccw else 'G2')
+            for axis, text in sorted(((u, end_texts[0]), (v, end_texts[1]))):
+                out_words.append(_AXIS_NAMES[axis] + text)
+            if self.use_cr:
+                radius = math.hypot(*(points[start] - center))
+                out_words.append('CR=' + _format_value(radius if sweep <= math.pi else -radius))
+            else:
+                offsets = center - points[start]
+                for axis, offset in sorted(((u, offsets[0]), (v, offsets[1]))):
+                    out_words.append(_CENTER_NAMES[axis] + _format_value(offset))
+            emit(' '.join(out_words))
+            self.report.arcs += 1
+            after_arc = True
+            move_idx = end
+        for n_word, words, explicit_g1, end_point, end_texts, line in run[move_idx:]:
+            emit(_restore_g1(n_word, words) if after_arc and not explicit_g1 else line)
+            after_arc = False
+        if after_arc and not motion_follows:
+            emit('G1')
+
+def fit_arcs(points, tolerance, min_blocks=3):
+    """Finds runs of the Nx2 array of consecutive points lying on circular arcs, returning a list of (start index, end
+    index, center, True if counterclockwise, sweep in radians) for non-overlapping arcs each spanning at least
+    min_blocks moves.  See ArcFitter for the tolerance criteria.  Arcs are grown greedily from the first point of each
+    run of consecutive moves turning the same way, by doubling and then bisecting the span."""
+    points = numpy.asarray(points, dtype=numpy.float64)
+    arcs = []
+    if len(points) < min_blocks + 1:
+        return arcs
+    # Points on an arc turn the same way at every point, so arcs are sought only within runs of consecutive moves
+    # that do
+    deltas = numpy.diff(points, axis=0)
+    turns = numpy.sign(deltas[:-1, 0]*deltas[1:, 1] - deltas[:-1, 1]*deltas[1:, 0])
+    changes = numpy.flatnonzero(turns[1:] != turns[:-1]) + 1
+    for lo, hi in zip(numpy.concatenate(([0], changes)).tolist(), numpy.concatenate((changes, [len(turns)])).tolist()):
+        # Turns lo..hi-1 are at points lo+1..hi, so the run spans points lo..hi+1
+        if turns[lo] == 0 or hi - lo < min_blocks - 1:
+            continue
+        start, last = lo, hi + 1
+        while last - start >= min_blocks:
+            good = start + min_blocks
+            fit = _fit_arc(points, start, good, tolerance)
+            if fit is None:
+                start += 1
+                continue
+            bad = last + 1
+            step = min_blocks
+            while good < last:
+                end = min(good + step, last)
+                end_fit = _fit_arc(points, start, end, tolerance)
+                if end_fit is None:
+                    bad = end
+                    break
+                good, fit = end, end_fit
+                step *= 2
+            while bad - good > 1:
+                end = (good + bad) // 2
+                end_fit = _fit_arc(points, start, end, tolerance)
+                if end_fit is None:
+                    bad = end
+                else:
+                    good, fit = end, end_fit
+            arcs.append((start, good) + fit)
+            start = good
+    return arcs
+
+def _fit_arc(points, start, end, tolerance):
+    """Returns (center, counterclockwise, sweep) for the arc from points[start] to points[end] through the point midway
+    between, or None if points[start:end+1] do not lie on it within tolerance."""
+    q = points[start:end+1]
+    a, b, c = q[0], q[len(q) // 2], q[-1]
+    d = 2 * (a[0]*(b[1]-c[1]) + b[0]*(c[1]-a[1]) + c[0]*(a[1]-b[1]))
+    if d == 0:
+        return None
+    a2, b2, c2 = a.dot(a), b.dot(b), c.dot(c)
+    center = numpy.array([
+        (a2*(b[1]-c[1]) + b2*(c[1]-a[1]) + c2*(a[1]-b[1])) / d,
+        (a2*(c[0]-b[0]) + b2*(a[0]-c[0]) + c2*(b[0]-a[0])) / d])
+    radius = math.hypot(*(a - center))
+    offsets = q - center
+    if numpy.abs(numpy.hypot(offsets[:, 0], offsets[:, 1]) - radius).max() > tolerance:
+        return None
+    half_chords = numpy.hypot(*numpy.diff(q, axis=0).T) / 2
+    if half_chords.max() >= radius or (radius - numpy.sqrt(radius*radius - half_chords*half_chords)).max() > tolerance:
+        return None
+    ccw = d > 0
+    # Every move must advance around the center the same way, by less than half a turn, and the arc must not close
+    steps = numpy.diff(numpy.arctan2(offsets[:, 1], offsets[:, 0]))
+    steps = (steps if ccw else -steps) % (2*math.pi)
+    sweep = steps.sum()
+    if steps.max() >= math.pi or sweep >= 2*math.pi:
+        return None
+    return center, ccw, float(sweep)
+
+def _split_block(line):
+    """Returns (N word or None, list of the other words, trailing comment or None)."""
+    text, semicolon, comment = line.partition(';')
+    words = _WHITESPACE_RE.split(text.strip())
+    if words == ['']:
+        words = []
+    n_word = None
+    if words and _N_WORD_RE.fullmatch(words[0]):
+        n_word = words.pop(0)
+    return n_word, words, semicolon + comment if semicolon else None
+
+def _parse_words(words):
+    """Returns (motion G-code or None, plane G-code or None, 90 or 91 or None, list of (axis index, value, value text)
+    tuples, list of (tool vector component index, value) pairs, True if any word is not one of these)."""
+    g_motion = g_plane = g_distance = None
+    updates = []
+    vector_updates = []
+    other = False
+    for word in words:
+        name = word.upper()
+        match = _G_WORD_RE.fullmatch(name)
+        if match is not None:
+            g = int(match.group(1))
+            if g in (0, 1, 2, 3):
+                g_motion = g
+            elif g in _PLANES:
+                g_plane = g
+            elif g in (90, 91):
+                g_distance = g
+            else:
+                other = True
+            continue
+        if name[:3] in _VECTOR_NAMES:
+            idx, text = _VECTOR_NAMES.index(name[:3]), word[3:]
+        elif name[:1] in _AXIS_NAMES:
+            idx, text = _AXIS_NAMES.index(name[:1]), word[1:]
+        else:
+            other = True
+            continue
+        try:
+            value = float(text)
+        except ValueError:
+            other = True
+            continue
+        if name[:3] in _VECTOR_NAMES:
+            vector_updates.append((idx, value))
+        else:
+            updates.append((idx, value, text))
+    return g_motion, g_plane, g_distance, updates, vector_updates, other
+
+def _is_g1(word):
+    match = _G_WORD_RE.fullmatch(word)
+    return match is not None and match.group(1) == '1'
+
+def _format_value(value):
+    """Formats value with seven decimal places, less trailing zeros, as exponents are not accepted."""
+    text = '{:.7f}'.format(value).rstrip('0').rstrip('.')
+    return '0' if text in ('', '-0') else text
+
+def _restore_g1(n_word, words):
+    return ' '.join(([] if n_word is None else [n_word]) + ['G1'] + words)
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser('G1 run to G2/G3 arc fitting commandline interface.')
+    parser.add_argument('--input', type=str, default='-')
+    parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--tolerance', type=float, default=0.0005)
+    parser.add_argument('--cr', action='store_true', help='write arc radii as CR= rather than centers as I, J, and K')
+    parser.add_argument('--min-blocks', type=int, default=3, help='the fewest G1 moves to replace with an arc')
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    args = parser.parse_args()
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
+    instrumentation = Instrumentation()
+    report = ArcFitter(args.tolerance, args.cr, args.min_blocks, instrumentation).run(input, output)
+    print(json.dumps(report.as_dict()), file=sys.stderr)
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
@@ -0,0 +1,56 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import sys
+import time
+from .cnc_program import CncProgram
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def benchmark_transform(mpf_fpath, repeat=1, max_workers=None):
+    """Times CncProgram.transform_for_dmu65ul and CncProgram.transform_for_dmu65ul_parallel on the blocks of mpf_fpath,
+    repeated repeat times, and checks that their outputs are identical.  Returns a dict of the block count, each
+    wall time, and (where the resource module is available) the CPU time spent by the worker processes, from which
+    the speedup to expect with more cores can be estimated."""
+    program = CncProgram()
+    program.import_mpf(mpf_fpath)
+    commands = program.commands * repeat
+    r = {'blocks': len(commands)}
+    program.commands = commands
+    t0 = time.perf_counter()
+    for _ in program.transform_for_dmu65ul():
+        pass
+    r['serial_wall_time'] = time.perf_counter() - t0
+    serial_lines = [cmd.mpf_line for cmd in program.commands]
+    program.commands = commands
+    children_cpu_time = _children_cpu_time()
+    t0 = time.perf_counter()
+    for _ in program.transform_for_dmu65ul_parallel(max_workers):
+        pass
+    r['parallel_wall_time'] = time.perf_counter() - t0
+    if resource is not None:
+        r['worker_cpu_time'] = _children_cpu_time() - children_cpu_time
+    if [cmd.mpf_line for cmd in program.commands] != serial_lines:
+        raise RuntimeError('transform_for_dmu65ul_parallel output differs from that of transform_for_dmu65ul')
+    return r
+
+def _children_cpu_time():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Serial vs parallel transform_for_dmu65ul benchmark.')
+    parser.add_argument('input', type=str)
+    parser.add_argument('--repeat', type=int, default=1, help='transform the blocks of input repeated this many times')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    args = parser.parse_args()
+    r = benchmark_transform(args.input, args.repeat, args.workers)
+    print('{} blocks: serial {:.3f}s, parallel {:.3f}s wall'.format(
+        r['blocks'], r['serial_wall_time'], r['parallel_wall_time']), file=sys.stderr)
+    if 'worker_cpu_time' in r:
+        print('workers: {:.3f}s cpu'.format(r['worker_cpu_time']), file=sys.stderr)
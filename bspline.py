@@ -0,0 +1,100 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import numpy
+
+# The greatest number of times linearize(..) halves a parameter interval
+_MAX_SUBDIVISIONS = 40
+# Fractions of each parameter interval at which linearize(..) measures the distance from the curve to the chord
+_CHORD_SAMPLES = numpy.arange(1, 6) / 6
+
+def basis_matrix(knots, degree, params):
+    """Returns the len(params) x (len(knots) - degree - 1) matrix of the B-spline basis functions of the given degree
+    and knot vector evaluated at each of params, so that basis_matrix(..) @ control_points evaluates the curve.  All
+    params are evaluated at once with the Cox-de Boor recursion; params at the last knot are taken to be at the end of
+    the last span."""
+    knots = numpy.asarray(knots, dtype=numpy.float64)
+    params = numpy.asarray(params, dtype=numpy.float64)
+    spans, basis = _local_basis(knots, degree, params)
+    matrix = numpy.zeros((len(params), len(knots) - degree - 1))
+    matrix[numpy.arange(len(params))[:, numpy.newaxis], _control_indexes(spans, degree)] = basis
+    return matrix
+
+def evaluate(knots, degree, control_points, params, weights=None):
+    """Evaluates the B-spline, or the NURBS curve if weights are given, at each of params, returning a row per param.
+    Only the degree+1 control points affecting each param are gathered, so memory is linear in the number of params
+    however many control points there are."""
+    knots = numpy.asarray(knots, dtype=numpy.float64)
+    params = numpy.asarray(params, dtype=numpy.float64)
+    control_points = numpy.asarray(control_points, dtype=numpy.float64)
+    spans, basis = _local_basis(knots, degree, params)
+    indexes = _control_indexes(spans, degree)
+    if weights is not None:
+        basis = basis * numpy.asarray(weights, dtype=numpy.float64)[indexes]
+    points = numpy.einsum('ij,ijk->ik', basis, control_points[indexes])
+    if weights is not None:
+        points /= basis.sum(axis=1)[:, numpy.newaxis]
+    return points
+
+def linearize(knots, degree, control_points, tolerance, weights=None):
+    """Returns (params, points) of points along the B-spline or NURBS curve from its start to its end such that no
+    chord between consecutive points is further than tolerance from the curve at any sixth of the way through its
+    parameter interval.  Each span is first sampled at degree+1 intervals, and then every interval out of tolerance is
+    halved, all intervals being evaluated together at each step."""
+    knots = numpy.asarray(knots, dtype=numpy.float64)
+    breaks = numpy.unique(knots[degree:len(knots)-degree])
+    fractions = numpy.arange(degree + 1) / (degree + 1)
+    params = numpy.append((breaks[:-1, numpy.newaxis] + numpy.diff(breaks)[:, numpy.newaxis] * fractions).ravel(), breaks[-1])
+    points = evaluate(knots, degree, control_points, params, weights)
+    check = numpy.arange(len(params) - 1)
+    for _ in range(_MAX_SUBDIVISIONS):
+        samples = (params[check, numpy.newaxis] + (params[check + 1] - params[check])[:, numpy.newaxis] * _CHORD_SAMPLES)
+        sample_points = evaluate(knots, degree, control_points, samples.ravel(), weights)
+        distances = _segment_distances(
+            sample_points, numpy.repeat(points[check], len(_CHORD_SAMPLES), axis=0),
+            numpy.repeat(points[check + 1], len(_CHORD_SAMPLES), axis=0))
+        split = (distances.reshape(len(check), len(_CHORD_SAMPLES)) > tolerance).any(axis=1)
+        if not split.any():
+            break
+        split_check = check[split]
+        mid = len(_CHORD_SAMPLES) // 2
+        params = numpy.insert(params, split_check + 1, samples[split, mid])
+        points = numpy.insert(points, split_check + 1, sample_points[mid::len(_CHORD_SAMPLES)][split], axis=0)
+        # Each split interval's left end moves along by the number of insertions before it
+        lefts = split_check + numpy.arange(len(split_check))
+        check = numpy.stack((lefts, lefts + 1), axis=1).ravel()
+    return params, points
+
+def clamped_knots(internal_knots, degree, start=0.0, end=1.0):
+    """Returns the knot vector with the given internal knots and degree+1 knots at each of start and end, so that the
+    curve begins at its first control point and ends at its last."""
+    return numpy.concatenate(([start] * (degree + 1), internal_knots, [end] * (degree + 1)))
+
+def _local_basis(knots, degree, params):
+    """Returns (the span index of each param, the len(params) x (degree+1) values of the basis functions of the
+    control points affecting each param)."""
+    n = len(knots) - degree - 1
+    spans = numpy.clip(numpy.searchsorted(knots, params, side='right') - 1, degree, n - 1)
+    basis = numpy.zeros((len(params), degree + 1))
+    basis[:, 0] = 1
+    left = numpy.empty((len(params), degree + 1))
+    right = numpy.empty((len(params), degree + 1))
+    for j in range(1, degree + 1):
+        left[:, j] = params - knots[spans + 1 - j]
+        right[:, j] = knots[spans + j] - params
+        saved = numpy.zeros(len(params))
+        for r in range(j):
+            temp = basis[:, r] / (right[:, r + 1] + left[:, j - r])
+            basis[:, r] = saved + right[:, r + 1] * temp
+            saved = left[:, j - r] * temp
+        basis[:, j] = saved
+    return spans, basis
+
+def _control_indexes(spans, degree):
+    return spans[:, numpy.newaxis] - degree + numpy.arange(degree + 1)
+
+def _segment_distances(points, starts, ends):
+    """Returns the distance of each row of points from the segment between the same rows of starts and ends."""
+    d = ends - starts
+    lengths = (d * d).sum(axis=1)
+    t = numpy.clip(((points - starts) * d).sum(axis=1) / numpy.where(lengths > 0, lengths, 1), 0, 1)
+    return numpy.linalg.norm(starts + d * t[:, numpy.newaxis] - points, axis=1)
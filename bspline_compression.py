@@ -0,0 +1,261 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import numpy
+import re
+import sys
+from .arc_fitting import _format_value, _is_g1, _parse_words, _split_block
+from .bspline import basis_matrix, clamped_knots
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
+
+_DEGREE = 3
+_ORIENTATION_MODE_RE = re.compile(r'ORI(AXES|VECT|PLANE|CONCW|CONCCW|CONIO|CONTO|CURVE|POLY)', flags=re.IGNORECASE)
+# Fractions along each move at which the spline's distance from the move is checked
+_SAMPLES = numpy.array([0.25, 0.5, 0.75])
+
+@attr.s
+class BSplineReport:
+    '''The result of BSplineCompressor.run(..).  splines counts the spline sections written, replacing moves_replaced
+    moves with spline_blocks blocks, and fallbacks the runs of moves that could not be fitted and were left linear.
+    max_deviation is the greatest distance of a written spline from the moves it replaced.'''
+    blocks_in = attr.ib(default=0)
+    blocks_out = attr.ib(default=0)
+    splines = attr.ib(default=0)
+    moves_replaced = attr.ib(default=0)
+    spline_blocks = attr.ib(default=0)
+    fallbacks = attr.ib(default=0)
+    max_deviation = attr.ib(default=0.0)
+
+    @property
+    def block_reduction(self):
+        return self.blocks_in - self.blocks_out
+
+    def as_dict(self):
+        d = attr.asdict(self)
+        d['block_reduction'] = self.block_reduction
+        return d
+
+class BSplineCompressor:
+    '''Replaces runs of short G1 moves with least-squares cubic B-splines, written as Siemens BSPLINE blocks (as NX
+    writes them, with the control points programmed and PL= giving the knot intervals).  Each spline begins and ends
+    at the end points of the moves it replaces, and is used only if it stays within tolerance of every move and needs
+    fewer blocks than the moves.  Knots are placed adaptively: a spline starts as a single span, and spans with moves
+    out of tolerance are split at the median parameter of their points until the spline fits or no longer saves
+    blocks, in which case the moves are written unchanged.  Runs are fitted in sections of at most max_points moves,
+    joined by knots of full multiplicity.
+
+    Moves are considered as for ArcFitter, except that they need not be planar.  If five_axis is True, moves changing
+    the tool vector are included as well, and splines of runs with changing tool vectors are written with ORICURVE,
+    the tool orientation being given by a second spline (XH=, YH=, ZH=) fitted to points orientation_length along the
+    tool vector, held to the same tolerance.  The orientation interpolation mode in effect before (ORIVECT if none was
+    programmed) is restored afterwards.'''
+
+    def __init__(self, tolerance=0.0005, five_axis=False, orientation_length=1.0, min_blocks=5, max_points=200,
+                 instrumentation=None):
+        self.tolerance = tolerance
+        self.five_axis = five_axis
+        self.orientation_length = orientation_length
+        self.min_blocks = min_blocks
+        self.max_points = max_points
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.report = None
+
+    def run(self, inputf, outputf):
+        with self.instrumentation.stage('BSplineCompressor.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+        return self.report
+
+    def _run(self, inputf, outputf, stage):
+        self.report = report = BSplineReport()
+        # Modal state; positions are NaN where not known
+        position = numpy.full(3, numpy.nan)
+        vector = numpy.array([0.0, 0.0, 1.0])
+        motion = None
+        absolute = True
+        orientation_mode = 'ORIVECT'
+        # The moves of the current run, as (N word or None, words other than G1, end position, end tool vector, input
+        # line), and the position and tool vector the run starts from
+        run = []
+        run_start = None
+
+        def emit(out_line):
+            print(out_line, file=outputf)
+            stage.blocks_out += 1
+            stage.bytes_written += text_bytes(out_line, outputf) + 1
+
+        def flush(motion_follows):
+            nonlocal run, run_start
+            if run:
+                self._write_run(run, run_start, motion_follows, orientation_mode, emit)
+                run = []
+                run_start = None
+
+        for line in inputf:
+            stage.blocks_in += 1
+            if stage.blocks_in % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            stage.bytes_read += text_bytes(line, inputf)
+            line = line.rstrip('\r\n')
+            n_word, words, comment = _split_block(line)
+            g_motion, g_plane, g_distance, updates, vector_updates, other = _parse_words(words)
+            block_motion = motion if g_motion is None else g_motion
+            if (
+                    not other and comment is None and g_plane is None and g_distance is None and absolute
+                    and block_motion == 1 and (updates or vector_updates) and not numpy.isnan(position).any()
+                    and (self.five_axis or all(vector[idx] == value for idx, value in vector_updates))):
+                end = position.copy()
+                for idx, value, text in updates:
+                    end[idx] = value
+                end_vector = vector.copy()
+                for idx, value in vector_updates:
+                    end_vector[idx] = value
+                if (end != position).any() or (end_vector != vector).any():
+                    if not run:
+                        run_start = position, vector
+                    run.append((n_word, [word for word in words if not _is_g1(word)], end, end_vector, line))
+                    position, vector = end, end_vector
+                    motion = 1
+                    continue
+            flush(g_motion in (0, 1, 2, 3))
+            emit(line)
+            for word in words:
+                if _ORIENTATION_MODE_RE.fullmatch(word):
+                    orientation_mode = word.upper()
+            if g_motion is not None:
+                motion = g_motion
+            if g_distance is not None:
+                absolute = g_distance == 90
+            if updates:
+                position = position.copy()
+                for idx, value, text in updates:
+                    position[idx] = value if absolute else numpy.nan
+            if vector_updates:
+                vector = vector.copy()
+                for idx, value in vector_updates:
+                    vector[idx] = value
+        flush(True)
+        report.blocks_in = stage.blocks_in
+        report.blocks_out = stage.blocks_out
+
+    def _write_run(self, run, run_start, motion_follows, orientation_mode, emit):
+        """Writes the moves of run, replacing sections that can be fitted with splines.  motion_follows is False if the
+        block following the run may rely on modal G1."""
+        report = self.report
+        xyz = numpy.vstack([run_start[0]] + [move[2] for move in run])
+        vectors = numpy.vstack([run_start[1]] + [move[3] for move in run])
+        oriented = self.five_axis and (vectors != vectors[0]).any()
+        if oriented:
+            vectors = vectors / numpy.linalg.norm(vectors, axis=1)[:, numpy.newaxis]
+            points = numpy.hstack((xyz, xyz + self.orientation_length * vectors))
+        else:
+            points = xyz
+        in_spline = False
+        for first in range(0, len(run), self.max_points):
+            last = min(first + self.max_points, len(run))
+            fit = self._fit(points[first:last+1]) if last - first >= self.min_blocks else None
+            if fit is None:
+                if last - first >= self.min_blocks:
+                    report.fallbacks += 1
+                for n_word, words, end, end_vector, line in run[first:last]:
+                    if in_spline:
+                        line = ' '.join(
+                            ([] if n_word is None else [n_word]) + ['G1'] + ([orientation_mode] if oriented else []) +
+                            words)
+                        in_spline = False
+                    emit(line)
+                continue
+            control_points, intervals, deviation = fit
+            for block_idx, (point, interval) in enumerate(zip(control_points[1:], intervals)):
+                out_words = []
+                if block_idx == 0 and not in_spline:
+                    n_word = run[first][0]
+                    out_words.extend(([] if n_word is None else [n_word]) + ['BSPLINE', 'SD={}'.format(_DEGREE)])
+                    if oriented:
+                        out_words.append('ORICURVE')
+                for name, value in zip(('X', 'Y', 'Z', 'XH=', 'YH=', 'ZH='), point):
+                    out_words.append(name + _format_value(value))
+                out_words.append('PL=' + _format_value(interval))
+                emit(' '.join(out_words))
+            in_spline = True
+            report.splines += 1
+            report.moves_replaced += last - first
+            report.spline_blocks += len(intervals)
+            report.max_deviation = max(report.max_deviation, deviation)
+        if in_spline:
+            out_words = ([] if motion_follows else ['G1']) + ([orientation_mode] if oriented else [])
+            if out_words:
+                emit(' '.join(out_words))
+
+    def _fit(self, points):
+        """Fits a clamped cubic B-spline to the polyline through the rows of points, returning (control points, knot
+        interval of each block, deviation), or None if no spline with fewer control points than the polyline has moves
+        is within tolerance of it.  Where points has six columns, the tolerance applies to the first three and last
+        three separately."""
+        chords = numpy.linalg.norm(numpy.diff(points, axis=0), axis=1)
+        total = chords.sum()
+        params = numpy.concatenate(([0.0], numpy.cumsum(chords))) / total
+        # The parameter of each sample along each move, and the fraction of the way along the move
+        samples = (params[:-1, numpy.newaxis] + numpy.diff(params)[:, numpy.newaxis] * _SAMPLES).ravel()
+        fractions = numpy.tile(_SAMPLES, len(chords))[:, numpy.newaxis]
+        starts = numpy.repeat(points[:-1], len(_SAMPLES), axis=0)
+        ends = numpy.repeat(points[1:], len(_SAMPLES), axis=0)
+        moves = len(points) - 1
+        groups = [slice(0, 3), slice(3, 6)] if points.shape[1] == 6 else [slice(0, 3)]
+        internal_knots = numpy.zeros(0)
+        while len(internal_knots) + _DEGREE < moves:
+            knots = clamped_knots(internal_knots, _DEGREE)
+            basis = basis_matrix(knots, _DEGREE, params)
+            # The ends are interpolated, and the interior control points fitted to the interior points
+            rhs = points[1:-1] - numpy.outer(basis[1:-1, 0], points[0]) - numpy.outer(basis[1:-1, -1], points[-1])
+            interior = numpy.linalg.lstsq(basis[1:-1, 1:-1], rhs, rcond=None)[0]
+            control_points = numpy.vstack((points[0], interior, points[-1]))
+            point_errors = numpy.zeros(len(points))
+            sample_errors = numpy.zeros(len(samples))
+            curve = basis @ control_points
+            sampled = basis_matrix(knots, _DEGREE, samples) @ control_points
+            for group in groups:
+                point_errors = numpy.maximum(
+                    point_errors, numpy.linalg.norm(curve[:, group] - points[:, group], axis=1))
+                # Each sample is compared with the point the same fraction of the way along its move
+                on_move = starts[:, group] + fractions * (ends[:, group] - starts[:, group])
+                sample_errors = numpy.maximum(sample_errors, numpy.linalg.norm(sampled[:, group] - on_move, axis=1))
+            move_errors = numpy.maximum.reduce([
+                point_errors[:-1], point_errors[1:], sample_errors.reshape(moves, len(_SAMPLES)).max(axis=1)])
+            deviation = float(move_errors.max())
+            if deviation <= self.tolerance:
+                intervals = numpy.diff(knots)[_DEGREE-1:1-_DEGREE] * total
+                return control_points, intervals, deviation
+            # Split each span holding a move out of tolerance at the median parameter of the points within it
+            unique_knots = numpy.unique(knots)
+            bad_spans = numpy.unique(numpy.clip(
+                numpy.searchsorted(unique_knots, params[:-1][move_errors > self.tolerance], side='right') - 1,
+                0, len(unique_knots) - 2))
+            new_knots = []
+            for span in bad_spans.tolist():
+                lo, hi = unique_knots[span], unique_knots[span+1]
+                inside = params[(params > lo) & (params < hi)]
+                new_knots.append(numpy.median(inside) if len(inside) else (lo + hi) / 2)
+            internal_knots = numpy.union1d(internal_knots, new_knots)
+        return None
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser('G1 run to BSPLINE compression commandline interface.')
+    parser.add_argument('--input', type=str, default='-')
+    parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--tolerance', type=float, default=0.0005)
+    parser.add_argument('--five-axis', action='store_true', help='fit moves changing the tool vector, using ORICURVE')
+    parser.add_argument('--orientation-length', type=float, default=1.0)
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    args = parser.parse_args()
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
+    instrumentation = Instrumentation()
+    compressor = BSplineCompressor(args.tolerance, args.five_axis, args.orientation_length, instrumentation=instrumentation)
+    report = compressor.run(input, output)
+    print(json.dumps(report.as_dict()), file=sys.stderr)
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
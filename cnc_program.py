@@ -1,162 +1,407 @@
 # Copyright (c) 2019 by Erik Hvatum
 
+import concurrent.futures
+import gc
+import os
+from pathlib import Path
 import re
 import sys
 from .cnc_command import CncCommand
 from .cnc_machine_state import CncMachineState
-from .flinereader import flinereader
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Canceled, Instrumentation
+from .machine_model import MachineModel
+from .program_index import ProgramIndex
 
 class CncProgram:
-    def __init__(self):
+    def __init__(self, instrumentation=None, machine_model=None):
         self.commands = []
+        self.index = None
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.machine_model = MachineModel() if machine_model is None else machine_model
 
-    def import_mpf(self, mpf_fpath):
+    def import_mpf(self, mpf_fpath, index=False):
+        """Appends the blocks of mpf_fpath to commands.  If index is True, the blocks are also indexed, as a
+        ProgramIndex in .index, in which block numbers are indexes into commands as imported into an empty CncProgram;
+        the index is not updated as commands are changed."""
         cms = CncMachineState()
-        for line in flinereader(mpf_fpath):
-            self.commands.extend(CncCommand.from_mpf_line(line, cms))
+        with self.instrumentation.stage('import_mpf', bytes_read=os.path.getsize(str(mpf_fpath))) as stage, \
+             LineReader.open(mpf_fpath) as reader:
+            for n, line in enumerate(reader.lines()):
+                if n % CHECKPOINT_BLOCKS == 0:
+                    # Position of the end of the chunk being read, which for compressed files is uncompressed
+                    stage.progress(min(reader.binary_file.tell() / max(stage.bytes_read, 1), 1.0))
+                self.commands.extend(CncCommand.from_mpf_line(line, cms))
+            stage.blocks_out = len(self.commands)
+        if index:
+            self.index = ProgramIndex.load(mpf_fpath, self.instrumentation)
 
     def export_mpf(self, mpf_fpath):
-        with open(str(mpf_fpath), 'w') as out:
-            for n, cmd in enumerate(self.commands):
-                print(f'N{n}', cmd.mpf_line, file=out)
+        with self.instrumentation.stage('export_mpf', blocks_in=len(self.commands)) as stage:
+            with open(str(mpf_fpath), 'w') as out:
+                for n, cmd in enumerate(self.commands):
+                    if n % CHECKPOINT_BLOCKS == 0:
+                        stage.progress(n / len(self.commands))
+                    print(f'N{n}', cmd.mpf_line, file=out)
+            stage.blocks_out = len(self.commands)
+            stage.bytes_written = os.path.getsize(str(mpf_fpath))
+
+    def export_mpf_split(self, mpf_fpath, max_bytes=None, max_blocks=None, extcall=False):
+        """Writes the program as a sequence of SPF subprogram files, each no larger than max_bytes and containing no more
+        than max_blocks blocks, plus a main MPF program at mpf_fpath that calls them in order (via EXTCALL if extcall
+        is True, for execution from external storage).  Parts are written as the program is traversed, and are split
+        only at safe points: between operations or immediately after a rapid, and never within a spline.  A trailing
+        M30 is moved to the main program.  Returns the list of paths written, main program first.
+
+        RuntimeError is raised if a stretch of the program without a safe split point does not fit in one part."""
+        mpf_fpath = Path(mpf_fpath)
+        commands = self.commands
+        trailer = ['M30']
+        if commands and commands[-1].nc == 'M30':
+            trailer = [commands[-1].mpf_line]
+            commands = commands[:-1]
+        if max_blocks is not None:
+            max_blocks -= 1 # Leave room for M17
+        # Lines are sized as written, in bytes, assuming the widest N-number a part could have
+        n_width = len(str(len(commands) if max_blocks is None else max_blocks))
+        line_overhead = 1 + n_width + 1 + 2
+        end_size = line_overhead + 3
+        with self.instrumentation.stage('export_mpf_split', blocks_in=len(self.commands), blocks_out=0, bytes_written=0) as stage:
+            part_fpaths = []
+            def write_part(lines):
+                part_fpath = mpf_fpath.parent / '{}_P{:03}.SPF'.format(mpf_fpath.stem, len(part_fpaths) + 1)
+                with open(str(part_fpath), 'w', newline='\r\n') as out:
+                    for n, line in enumerate(lines + ['M17']):
+                        print(f'N{n}', line, file=out)
+                part_fpaths.append(part_fpath)
+                stage.blocks_out += len(lines) + 1
+                stage.bytes_written += os.path.getsize(str(part_fpath))
+            def fits(size, blocks):
+                return (max_bytes is None or size <= max_bytes) and (max_blocks is None or blocks <= max_blocks)
+            part, part_size = [], end_size # Blocks committed to the current part, up to the most recent safe split point
+            tail, tail_size = [], 0 # Blocks following the most recent safe split point
+            motion = None
+            for idx, cmd in enumerate(commands):
+                if idx % CHECKPOINT_BLOCKS == 0:
+                    stage.progress(idx / len(commands))
+                if _is_operation_boundary(cmd) or motion == 'G0':
+                    part.extend(tail)
+                    part_size += tail_size
+                    tail, tail_size = [], 0
+                line = cmd.mpf_line
+                line_size = len(line.encode()) + line_overhead
+                if not fits(part_size + tail_size + line_size, len(part) + len(tail) + 1):
+                    if part:
+                        write_part(part)
+                        part, part_size = [], end_size
+                    if not fits(end_size + tail_size + line_size, len(tail) + 1):
+                        # The blocks since the last safe split point, which must stay together, do not fit in a part
+                        raise RuntimeError(f'no safe split point found within the part budget before block {idx}')
+                tail.append(line)
+                tail_size += line_size
+                for word in cmd.words:
+                    if word in _MOTION_WORDS:
+                        motion = word
+            part.extend(tail)
+            if part:
+                write_part(part)
+            call = 'EXTCALL "{}"' if extcall else '{}'
+            with open(str(mpf_fpath), 'w', newline='\r\n') as out:
+                for n, line in enumerate([call.format(part_fpath.stem) for part_fpath in part_fpaths] + trailer):
+                    print(f'N{n}', line, file=out)
+            stage.bytes_written += os.path.getsize(str(mpf_fpath))
+        return [mpf_fpath] + part_fpaths
 
     def apply_tool_preloading(self):
-        idx = 0
-        while idx < len(self.commands):
-            if self.commands[idx].nc == 'M6':
-                for ts_idx in range(idx+1, len(self.commands)):
-                    nc = self.commands[ts_idx].nc
-                    if nc.startswith('T=') or nc == 'T0':
+        with self.instrumentation.stage('apply_tool_preloading', blocks_in=len(self.commands)) as stage:
+            idx = 0
+            while idx < len(self.commands):
+                if idx % CHECKPOINT_BLOCKS == 0:
+                    stage.progress(idx / len(self.commands))
+                if self.commands[idx].nc == 'M6':
+                    for ts_idx in range(idx+1, len(self.commands)):
+                        if ts_idx % CHECKPOINT_BLOCKS == 0:
+                            stage.progress(ts_idx / len(self.commands))
+                        nc = self.commands[ts_idx].nc
+                        if nc.startswith('T=') or nc == 'T0':
+                            break
+                    else:
                         break
+                    self.commands.insert(idx+1, self.commands.pop(ts_idx))
+                    idx = ts_idx
                 else:
-                    break
-                self.commands.insert(idx+1, self.commands.pop(ts_idx))
-                idx = ts_idx
-            else:
-                idx += 1
+                    idx += 1
+            stage.blocks_out = len(self.commands)
 
     def pattern_ops_across_homes(self, count):
         HOMES = ['G54', 'G55', 'G56', 'G57', 'G58', 'G59']
-        ncmds = []
-        idx = 0
-        while idx < len(self.commands):
-            if self.commands[idx].nc == 'G54':
-                for eidx in range(idx+1, len(self.commands)):
-                    if self.commands[eidx].nc == 'CYCLE800()':
-                        for hidx in range(count):
-                            routine = [cmd.copy() for cmd in self.commands[idx:eidx]]
-                            routine[0].words[0] = HOMES[hidx]
-                            ncmds.extend(routine)
-                        idx += len(routine)-1
-                        break
+        with self.instrumentation.stage('pattern_ops_across_homes', blocks_in=len(self.commands)) as stage:
+            ncmds = []
+            idx = 0
+            while idx < len(self.commands):
+                if idx % CHECKPOINT_BLOCKS == 0:
+                    stage.progress(idx / len(self.commands))
+                if self.commands[idx].nc == 'G54':
+                    for eidx in range(idx+1, len(self.commands)):
+                        if eidx % CHECKPOINT_BLOCKS == 0:
+                            stage.progress(eidx / len(self.commands))
+                        if self.commands[eidx].nc == 'CYCLE800()':
+                            for hidx in range(count):
+                                routine = [cmd.copy() for cmd in self.commands[idx:eidx]]
+                                routine[0].words[0] = HOMES[hidx]
+                                ncmds.extend(routine)
+                            idx += len(routine)-1
+                            break
+                    else:
+                        raise RuntimeError('failed to find end of routine')
                 else:
-                    raise RuntimeError('failed to find end of routine')
-            else:
-                ncmds.append(self.commands[idx])
-            idx += 1
-        self.commands = ncmds
+                    ncmds.append(self.commands[idx])
+                idx += 1
+            self.commands = ncmds
+            stage.blocks_out = len(self.commands)
 
     def transform_for_dmu65ul(self):
-        tool = None
-        next_tool = None
-        seen_camtol_def = False
-        ncmds = []
-        skip_lines = [
-            'DEF REAL _X_HOME, _Y_HOME, _Z_HOME, _A_HOME, _C_HOME',
-            '_X_HOME=0 _Y_HOME=0 _Z_HOME=0',
-            '_A_HOME=0 _C_HOME=0',
-            'SUPA G0 Z=_Z_HOME D0',
-            'SUPA Z=_Z_HOME D0',
-            'SUPA X=_X_HOME Y=_Y_HOME A=_A_HOME C=_C_HOME D1',
-            'SUPA X=_X_HOME Y=_Y_HOME A=_A_HOME C=_C_HOME',
-            'SUPA Z=_Z_HOME'
-        ]
-        replace_lines = {
-#           'CYCLE832(_camtolerance,0,1)' : 'CYCLE832(_camtolerance,_SEMIFIN,1)'
-            }
-        idx = -1
-        yield 0.0
-        try:
-            while True:
-                idx += 1
-                if idx >= len(self.commands):
-                    break
-                if idx % 501 == 0:
-                    yield idx / len(self.commands)
-                in_cmd = self.commands[idx]
-                in_nc = in_cmd.nc
-                if in_nc in skip_lines:
-                    continue
-                if in_nc in replace_lines:
-                    ncmds.append(CncCommand(words=[replace_lines[in_nc]]))
-                    continue
-                match = re.match(r'(T="[^"]+"|T0|T=0) M6', in_nc)
-                if match:
-                    ncmds.append(CncCommand(words=[match.group(1)]))
-                    ncmds.append(CncCommand(words=['M6']))
-                    ncmds.append(CncCommand(words=['M11']))
-                    continue
-                if in_nc == 'DEF REAL _camtolerance':
-                    if seen_camtol_def:
-                        continue
-                    seen_camtol_def = True
-                    continue #!!!!!!!!!!
-                elif in_nc.startswith('_camtolerance='):#!!!!!!!!!!
-                    continue#!!!!!!!!!!
-                elif in_nc.startswith('ORIRESET') and len(self.commands)-idx >= 6:
-                    if self.commands[idx+1].nc == 'CYCLE832(_camtolerance,0,1)' and \
-                      self.commands[idx+2].nc == 'COMPOF' and \
-                      re.match(r'G5[456789]', self.commands[idx+3].nc) and \
-                      self.commands[idx+4].nc == 'TRAORI' and \
-                      'G0' in self.commands[idx+5].words:
-                        match = re.match(r'ORIRESET\(([^,]+),([^,]+)\)', in_nc)
-                        a, c = float(match.group(1)), float(match.group(2))
-                        if a < 0:
-                            a *= -1
-                            c += 180
-                        params = {v[0] : v for v in self.commands[idx+5].words if v != 'G0'}
-                        ncmds.append(CncCommand(['HOMEY']))
-                        ncmds.append(CncCommand(['M1']))
-                        ncmds.append(CncCommand([self.commands[idx+3].nc]))
-                        ncmds.append(CncCommand(['G0', f'A{a}', f'C{c}']))
-                        ncmds.extend(CncCommand([v]) for v in ('G642', 'COMPCURV', 'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)', 'TRAORI'))
-                        ncmds.append(CncCommand(self.commands[idx+5].words + ['M8'], self.commands[idx+5].comment))
-                        idx += 5
-                        continue
-                    else:
-                        match = re.match(r'ORIRESET\(([^,]+),([^,]+)\)', in_nc)
-                        a, c = float(match.group(1)), float(match.group(2))
-                        if a < 0:
-                            a *= -1
-                            c += 180
-                        ncmds.append(CncCommand(['HOMEY']))
-                        ncmds.append(CncCommand(['M1']))
-                        ncmds.append(CncCommand(['G0', f'A{a}', f'C{c}']))
-                        continue
-                elif in_nc == 'CYCLE832(_camtolerance,0,1)' and len(self.commands)-idx >= 3:
-                    if self.commands[idx+1].nc == 'COMPOF' and re.match(r'G5[456789]', self.commands[idx+2].nc):
-                        ncmds.extend(CncCommand([v]) for v in ('HOMEY', 'M1', self.commands[idx+2].nc, 'G642', 'COMPCURV',
-                                                               'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)'))
-                        idx += 2
-                        continue
+        with self.instrumentation.stage('transform_for_dmu65ul', blocks_in=len(self.commands)) as stage:
+            ncmds = []
+            idx = 0
+            yield 0.0
+            next_checkpoint = 0
+            try:
+                while idx < len(self.commands):
+                    if idx >= next_checkpoint:
+                        # _transform_dmu65ul_block consumes a varying number of blocks, so idx may skip any particular
+                        # multiple of CHECKPOINT_BLOCKS
+                        next_checkpoint = idx + CHECKPOINT_BLOCKS
+                        c = idx / len(self.commands)
+                        stage.progress(c)
+                        yield c
+                    idx = _transform_dmu65ul_block(self.commands, idx, ncmds, self.machine_model)
+            except Canceled:
+                raise
+            except Exception as e:
+                print(e, file=sys.stderr)
+                raise
+            _finish_dmu65ul_transform(ncmds)
+            self.commands = ncmds
+            stage.blocks_out = len(self.commands)
+        yield 1.0
+
+    def transform_for_dmu65ul_parallel(self, max_workers=None, min_segment_len=20000):
+        """Produces output identical to transform_for_dmu65ul, but transforms the program in segments split at operation
+        boundaries using a process pool.  transform_for_dmu65ul looks at most _DMU65UL_LOOKAHEAD blocks ahead of the
+        current block and carries no state from one operation to the next, so each segment is shipped to a worker
+        along with that many blocks of overlap.  If a lookahead match in one segment consumes blocks belonging to the
+        next (which should not happen at an operation boundary), the next segment is redone serially from the
+        correct block.  Programs too small to split, or transformed with a single worker, are transformed serially.
+
+        Workers return only the blocks they change, so nearly all of the parent's work is packing the program for
+        the workers.  The transform is cheap per block, however, and unpacking a segment in a worker costs about as
+        much as transforming it, so the speedup over transform_for_dmu65ul is well short of the worker count (see
+        benchmark_transform.py).
+
+        The CPU time recorded for this stage does not include that of the worker processes.  If the stage is
+        canceled, it returns without waiting for the workers to finish the segments they are transforming."""
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        bounds = _dmu65ul_segment_bounds(self.commands, max_workers, min_segment_len)
+        if max_workers <= 1 or len(bounds) <= 2:
+            yield from self.transform_for_dmu65ul()
+            return
+        with self.instrumentation.stage('transform_for_dmu65ul', blocks_in=len(self.commands)) as stage:
+            yield 0.0
+            spans = list(zip(bounds[:-1], bounds[1:]))
+            ncmds = []
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+            wait = True
+            try:
+                futures = []
+                for start, stop in spans:
+                    stage.checkpoint()
+                    futures.append(executor.submit(
+                        _transform_dmu65ul_packed_segment, _pack_commands(self.commands[start:stop+_DMU65UL_LOOKAHEAD]),
+                        stop-start, self.machine_model))
+                idx = 0
+                for (start, stop), future in zip(spans, futures):
+                    while not concurrent.futures.wait([future], _CHECKPOINT_WAIT).done:
+                        stage.checkpoint()
+                    edits, end = future.result()
+                    if idx == start:
+                        # Blocks the worker passed through unchanged are taken from this process's commands as they are
+                        for edit_start, edit_stop, packed in edits:
+                            ncmds.extend(self.commands[idx:start+edit_start])
+                            ncmds.extend(_unpack_commands(packed))
+                            idx = start + edit_stop
+                        ncmds.extend(self.commands[idx:start+end])
+                        idx = start + end
                     else:
-                        ncmds.extend(CncCommand([v]) for v in ('G642', 'COMPCURV', 'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)'))
-                        continue
-                elif 'M3' in in_cmd.words or 'M4' in in_cmd.words:
-                    ncmds.append(CncCommand(in_cmd.words + ['M8'], in_cmd.comment))
-                    continue
-                elif in_cmd.nc == 'M5':
-                    ncmds.append(CncCommand(['M9']))
-                    ncmds.append(CncCommand(['M5'], in_cmd.comment))
-                    continue
-                elif in_cmd.nc == 'COMPOF':
-                    continue
-                ncmds.append(CncCommand(list(in_cmd.words), in_cmd.comment))
-        except Exception as e:
-            print(e, sys.stderr)
-            raise
-        if ncmds:
-            if ncmds[-1].nc == 'M30':
-                ncmds.insert(-1, CncCommand(['HDSPIN']))
-        self.commands = ncmds
+                        # The previous segment ran past its stop; resume serially where it left off
+                        while idx < stop:
+                            stage.checkpoint()
+                            idx = _transform_dmu65ul_block(self.commands, idx, ncmds, self.machine_model)
+                    c = stop / len(self.commands)
+                    stage.progress(c)
+                    yield c
+            except BaseException:
+                # Don't wait for the segments being transformed, which run to completion in the workers regardless
+                wait = False
+                raise
+            finally:
+                executor.shutdown(wait=wait, cancel_futures=not wait)
+            _finish_dmu65ul_transform(ncmds)
+            self.commands = ncmds
+            stage.blocks_out = len(self.commands)
         yield 1.0
+
+_DMU65UL_SKIP_LINES = (
+    'DEF REAL _X_HOME, _Y_HOME, _Z_HOME, _A_HOME, _C_HOME',
+    '_X_HOME=0 _Y_HOME=0 _Z_HOME=0',
+    '_A_HOME=0 _C_HOME=0',
+    'SUPA G0 Z=_Z_HOME D0',
+    'SUPA Z=_Z_HOME D0',
+    'SUPA X=_X_HOME Y=_Y_HOME A=_A_HOME C=_C_HOME D1',
+    'SUPA X=_X_HOME Y=_Y_HOME A=_A_HOME C=_C_HOME',
+    'SUPA Z=_Z_HOME'
+)
+
+_DMU65UL_REPLACE_LINES = {
+#   'CYCLE832(_camtolerance,0,1)' : 'CYCLE832(_camtolerance,_SEMIFIN,1)'
+}
+
+# Seconds transform_for_dmu65ul_parallel waits for a segment between checkpoints
+_CHECKPOINT_WAIT = 0.01
+
+# The greatest number of blocks following the current block that _transform_dmu65ul_block examines
+_DMU65UL_LOOKAHEAD = 5
+
+def _transform_dmu65ul_block(commands, idx, ncmds, machine_model):
+    """Transforms the block at commands[idx], appending the result to ncmds, and returns the index of the next block
+    to be transformed."""
+    in_cmd = commands[idx]
+    in_nc = in_cmd.nc
+    if in_nc in _DMU65UL_SKIP_LINES:
+        return idx + 1
+    if in_nc in _DMU65UL_REPLACE_LINES:
+        ncmds.append(CncCommand(words=[_DMU65UL_REPLACE_LINES[in_nc]]))
+        return idx + 1
+    match = re.match(r'(T="[^"]+"|T0|T=0) M6', in_nc)
+    if match:
+        ncmds.append(CncCommand(words=[match.group(1)]))
+        ncmds.append(CncCommand(words=['M6']))
+        ncmds.append(CncCommand(words=['M11']))
+        return idx + 1
+    if in_nc == 'DEF REAL _camtolerance':
+        return idx + 1
+    elif in_nc.startswith('_camtolerance='):
+        return idx + 1
+    elif in_nc.startswith('ORIRESET') and len(commands)-idx >= 6:
+        if commands[idx+1].nc == 'CYCLE832(_camtolerance,0,1)' and \
+          commands[idx+2].nc == 'COMPOF' and \
+          re.match(r'G5[456789]', commands[idx+3].nc) and \
+          commands[idx+4].nc == 'TRAORI' and \
+          'G0' in commands[idx+5].words:
+            ncmds.append(CncCommand(['HOMEY']))
+            ncmds.append(CncCommand(['M1']))
+            ncmds.append(CncCommand([commands[idx+3].nc]))
+            ncmds.append(_orireset_move(in_nc, machine_model))
+            ncmds.extend(CncCommand([v]) for v in ('G642', 'COMPCURV', 'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)', 'TRAORI'))
+            ncmds.append(CncCommand(commands[idx+5].words + ['M8'], commands[idx+5].comment))
+            return idx + 6
+        else:
+            ncmds.append(CncCommand(['HOMEY']))
+            ncmds.append(CncCommand(['M1']))
+            ncmds.append(_orireset_move(in_nc, machine_model))
+            return idx + 1
+    elif in_nc == 'CYCLE832(_camtolerance,0,1)' and len(commands)-idx >= 3:
+        if commands[idx+1].nc == 'COMPOF' and re.match(r'G5[456789]', commands[idx+2].nc):
+            ncmds.extend(CncCommand([v]) for v in ('HOMEY', 'M1', commands[idx+2].nc, 'G642', 'COMPCURV',
+                                                   'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)'))
+            return idx + 3
+        else:
+            ncmds.extend(CncCommand([v]) for v in ('G642', 'COMPCURV', 'FFWON', 'SOFT', 'CYCLE832(.002,_SEMIFIN,1)'))
+            return idx + 1
+    elif 'M3' in in_cmd.words or 'M4' in in_cmd.words:
+        ncmds.append(CncCommand(in_cmd.words + ['M8'], in_cmd.comment))
+        return idx + 1
+    elif in_cmd.nc == 'M5':
+        ncmds.append(CncCommand(['M9']))
+        ncmds.append(CncCommand(['M5'], in_cmd.comment))
+        return idx + 1
+    elif in_cmd.nc == 'COMPOF':
+        return idx + 1
+    # Passed through as is, which callers rely on to tell unchanged blocks apart
+    ncmds.append(in_cmd)
+    return idx + 1
+
+def _orireset_move(orireset_nc, machine_model):
+    """Returns the G0 block moving to the orientation of an ORIRESET(tilt,rotary) block, using the preferred solution
+    for that orientation."""
+    match = re.match(r'ORIRESET\(([^,]+),([^,]+)\)', orireset_nc)
+    tilt, rotary = machine_model.preferred_solution(float(match.group(1)), float(match.group(2)))
+    return CncCommand(['G0', f'{machine_model.tilt_name}{tilt}', f'{machine_model.rotary_name}{rotary}'])
+
+def _finish_dmu65ul_transform(ncmds):
+    if ncmds:
+        if ncmds[-1].nc == 'M30':
+            ncmds.insert(-1, CncCommand(['HDSPIN']))
+
+# Words selecting the modal motion type (G group 1).  Splines are cancelled by any of the others.
+_MOTION_WORDS = {'G0', 'G1', 'G2', 'G3', 'CIP', 'ASPLINE', 'BSPLINE', 'CSPLINE', 'POLY'}
+
+def _is_operation_boundary(cmd):
+    if cmd.comment.startswith(';Operation'):
+        return not cmd.words
+    nc = cmd.nc
+    return nc == 'M6' or re.match(r'(T="[^"]+"|T0|T=0) M6', nc) is not None
+
+def _dmu65ul_segment_bounds(commands, max_workers, min_segment_len):
+    """Returns the indexes at which commands should be split for parallel transformation, including 0 and
+    len(commands).  Operations are coalesced so that there are a few segments per worker, and so that no segment
+    (other than the last) is shorter than min_segment_len."""
+    target_len = max(min_segment_len, len(commands) // (max_workers * 4) + 1)
+    bounds = [0]
+    for idx, cmd in enumerate(commands):
+        if idx - bounds[-1] >= target_len and _is_operation_boundary(cmd):
+            bounds.append(idx)
+    bounds.append(len(commands))
+    return bounds
+
+# Blocks cross the process boundary as one string rather than as a list of CncCommand instances, which is both
+# much smaller to pickle and much faster to unpickle.  CncCommand words never contain whitespace or control characters.
+_WORD_SEP, _COMMENT_SEP, _BLOCK_SEP = '\x1f', '\x1d', '\x1e'
+
+def _pack_commands(commands):
+    return _BLOCK_SEP.join(_WORD_SEP.join(cmd.words) + _COMMENT_SEP + cmd.comment for cmd in commands)
+
+def _unpack_commands(packed):
+    if not packed:
+        return []
+    commands = []
+    for block in packed.split(_BLOCK_SEP):
+        words, comment = block.split(_COMMENT_SEP)
+        commands.append(CncCommand(words.split(_WORD_SEP) if words else [], comment))
+    return commands
+
+def _transform_dmu65ul_packed_segment(packed, stop, machine_model):
+    """Process pool entry point for CncProgram.transform_for_dmu65ul_parallel.  Transforms the first stop blocks of
+    packed, using any blocks that follow for lookahead only.  Most blocks pass through unchanged, so rather than the
+    whole result, returns a list of (start, stop, packed) edits, each replacing the blocks from start up to stop with
+    the packed blocks, along with the index of the first block not consumed."""
+    # The blocks unpacked here hold no reference cycles and are freed on return, but creating so many of them would
+    # otherwise trigger repeated full collections that cost several times as much as the transform itself
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        commands = _unpack_commands(packed)
+        edits = []
+        ncmds = []
+        idx = 0
+        while idx < stop:
+            next_idx = _transform_dmu65ul_block(commands, idx, ncmds, machine_model)
+            if next_idx != idx + 1 or len(ncmds) != 1 or ncmds[0] is not commands[idx]:
+                edits.append((idx, next_idx, _pack_commands(ncmds)))
+            ncmds.clear()
+            idx = next_idx
+        return edits, idx
+    finally:
+        if gc_enabled:
+            gc.enable()
@@ -1,75 +1,196 @@
 #!/usr/bin/env python
 # (C) Erik Hvatum, Arcterik LLC 2019. All rights reserved.
 
-import math
+import attr
+import itertools
+import queue
 import re
+import threading
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
+from .machine_model import MachineModel
 
 class ConfineTraoriHemisphere:
     '''This simple implementation attempts to traverse to the A>=0 hemisphere on a 5-axis AC table machine at the beginning
-    of every set of consecutive G0 operations.'''
+    of every set of consecutive G0 operations.  The machine, and so the hemisphere, is described by machine_model.'''
+    def __init__(self, instrumentation=None, machine_model=None):
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.machine_model = MachineModel() if machine_model is None else machine_model
+
     def run(self, inputf, outputf):
-        line_num = -1
-        line = inputf.readline()
-        in_Gx = None
-        shortvalids = set(('X', 'Y', 'Z'))
-        longvalids = set(('A3=', 'B3=', 'C3='))
-        name_to_lit = {'X':'x','Y':'y','Z':'z','A3=':'i','B3=':'j','C3=':'k'}
-        max_c3=-999999999999999
-        xyz_ijk = dict(i=0,j=0,k=1)
-
-        while line != '':
-            line = line.strip()
+        with self.instrumentation.stage('ConfineTraoriHemisphere.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+
+    def _run(self, inputf, outputf, stage):
+        lines = iter(inputf)
+        state = ModalState(self.machine_model.reference_rotary)
+        while True:
+            chunk = list(itertools.islice(lines, CHECKPOINT_BLOCKS))
+            if not chunk:
+                break
+            text = self._confine(chunk, inputf, state, stage)
+            outputf.write(text)
+            stage.bytes_written += text_bytes(text, outputf)
+
+    def _confine(self, lines, inputf, state, stage):
+        """Returns the output text for lines, which follow the blocks that left the modal state state, and updates
+        state to follow lines."""
+        model = self.machine_model
+        out_format = 'N{:06} G{} X{} Y{} Z{} ' + model.tilt_name + '={} ' + model.rotary_name + '={}'
+        xyz_ijk = state.xyz_ijk
+        rotary = state.rotary
+        line_num = state.line_num
+        out_lines = []
+        for line in lines:
+            stage.bytes_read += text_bytes(line, inputf)
             line_num += 1
-            match = re.match('\s*N\d+\s*(.*)', line, flags=re.IGNORECASE)
-            if match:
-                line = match.group(1).strip()
-            components = re.split('\s+', line)
-            is_G = False
-            if components[0] == 'G0':
-                in_Gx = 0
-                is_G = True
-                components.pop(0)
-            elif components[0] == 'G1':
-                in_Gx = 1
-                is_G = True
-                components.pop(0)
-            seen_component_names = set()
-            ok = True
-            hasValue = False
-            for component in components:
-                component = component.upper()
-                if component[0:1] in shortvalids:
-                    component_name, component_value = component[0], component[1:]
-                    hasValue = True
-                elif component[:3] in longvalids:
-                    component_name, component_value = component[:3], component[3:]
-                    hasValue = True
-                elif component[0:1] == ';':
-                    break
-                else:
-                    ok = False
-                    break
-                if component_name in seen_component_names:
-                    raise RuntimeError('component {} is specified more than once in a block'.format(component_name))
-                seen_component_names.add(component_name)
-                xyz_ijk[name_to_lit[component_name]] = float(component_value)
-            if ok and hasValue and is_G:
+            if line_num % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            line, in_Gx, updates, is_motion = _parse_block(line)
+            xyz_ijk.update(updates)
+            if is_motion:
                 x, y, z, i, j, k = (xyz_ijk[k] for k in 'xyzijk')
                 # Note: we always want to use the solution for A and C in which A is either positive or very close to zero
-                if k < .99:
-                    l = math.sqrt(i*i+j*j)
-                    i_n = i / l
-                    j_n = j / l
-#                   k_n = k / l
-#               print(k_n)
-                a = math.acos(k) * ( 360 / (2*math.pi) )
-                c = 90 + math.asin(j_n) * ( 360 / (2*math.pi) )
-                if a < 0:
-                    print(a)
-                print('N{:06} G{} X{} Y{} Z{} A={} C={}'.format(line_num, in_Gx, x, y, z, a, c), file=outputf)
+                tilt, rotary = model.inverse_one(i, j, k, rotary)
+                out_lines.append(out_format.format(line_num, in_Gx, x, y, z, tilt, rotary))
             else:
-                print('N{:06} {}'.format(line_num, line), file=outputf)
-            line = inputf.readline()
+                out_lines.append('N{:06} {}'.format(line_num, line))
+        state.rotary = rotary
+        state.line_num = line_num
+        stage.blocks_in = stage.blocks_out = line_num + 1
+        out_lines.append('')
+        return '\n'.join(out_lines)
+
+class ChunkedConfineTraoriHemisphere(ConfineTraoriHemisphere):
+    '''Produces the same output as ConfineTraoriHemisphere, with memory use bounded regardless of input size.  Input
+    is processed in chunks of chunk_lines lines, with the modal tool position and vector, the held rotary axis position,
+    and the block number carried from each chunk to the next in a ModalState.  A reader thread reads the next chunk and
+    a writer thread writes the previous chunk's output while the current chunk is converted, and each thread hands off
+    through a one-chunk queue, so that no more than about five chunks of lines or output are held at once.
+
+    If chunk_lines is not specified, it is chosen so that the chunks held take no more than memory_limit bytes,
+    assuming lines no longer than those written by DMU65UL_Post.  Reading (see LineReader) takes a further fixed 10 to
+    15 MiB.'''
+    DEFAULT_MEMORY_LIMIT = 256 * 1024**2
+    # About 1 KiB per chunk line was measured at peak; twice that leaves room for lines longer than DMU65UL_Post's
+    _BYTES_PER_LINE = 2048
+
+    def __init__(self, instrumentation=None, machine_model=None, memory_limit=DEFAULT_MEMORY_LIMIT, chunk_lines=None):
+        super().__init__(instrumentation, machine_model)
+        if chunk_lines is None:
+            chunk_lines = max(CHECKPOINT_BLOCKS, memory_limit // self._BYTES_PER_LINE)
+        self.chunk_lines = chunk_lines
+
+    def _run(self, inputf, outputf, stage):
+        chunks = queue.Queue(maxsize=1)
+        out_texts = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        failures = []
+
+        def read():
+            try:
+                lines = iter(inputf)
+                while not stop.is_set():
+                    chunk = list(itertools.islice(lines, self.chunk_lines))
+                    chunks.put(chunk)
+                    if not chunk:
+                        break
+            except BaseException as e:
+                failures.append(e)
+                chunks.put(None)
+
+        def write():
+            while True:
+                text = out_texts.get()
+                if text is None:
+                    break
+                if not failures:
+                    try:
+                        outputf.write(text)
+                    except BaseException as e:
+                        failures.append(e)
+
+        reader = threading.Thread(target=read, name='ConfineTraoriHemisphere reader', daemon=True)
+        writer = threading.Thread(target=write, name='ConfineTraoriHemisphere writer', daemon=True)
+        reader.start()
+        writer.start()
+        state = ModalState(self.machine_model.reference_rotary)
+        try:
+            while not failures:
+                chunk = chunks.get()
+                if not chunk:
+                    break
+                text = self._confine(chunk, inputf, state, stage)
+                del chunk
+                stage.bytes_written += text_bytes(text, outputf)
+                out_texts.put(text)
+                del text
+        finally:
+            stop.set()
+            if reader.is_alive():
+                # Unblock the reader if it is waiting to hand off a chunk
+                try:
+                    chunks.get_nowait()
+                except queue.Empty:
+                    pass
+            out_texts.put(None)
+            writer.join()
+        reader.join()
+        if failures:
+            raise failures[0]
+
+@attr.s
+class ModalState:
+    '''The state ConfineTraoriHemisphere carries from block to block: the modal tool position and vector (x, y, z, i,
+    j, and k, of which x, y, and z are absent until programmed), the rotary axis position, which is held through
+    vertical tool vectors, and the number of the last block.'''
+    rotary = attr.ib()
+    xyz_ijk = attr.ib(factory=lambda: dict(i=0, j=0, k=1))
+    line_num = attr.ib(default=-1)
+
+_N_PREFIX_RE = re.compile(r'\s*N\d+\s*(.*)', flags=re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+_SHORT_VALIDS = {'X', 'Y', 'Z'}
+_LONG_VALIDS = {'A3=', 'B3=', 'C3='}
+_NAME_TO_LIT = {'X':'x','Y':'y','Z':'z','A3=':'i','B3=':'j','C3=':'k'}
+
+def _parse_block(line):
+    """Returns (line stripped of whitespace and N-number, 0 for G0 or 1 for G1 or None, list of (component literal,
+    value) pairs, is_motion).  The components listed are those to be applied to the modal tool position and vector,
+    which includes any preceding an unrecognized component.  is_motion is True if the block is a G0 or G1 with at least
+    one position or vector component and nothing unrecognized."""
+    line = line.strip()
+    match = _N_PREFIX_RE.match(line)
+    if match:
+        line = match.group(1).strip()
+    components = _WHITESPACE_RE.split(line)
+    in_Gx = None
+    if components[0] == 'G0':
+        in_Gx = 0
+        components.pop(0)
+    elif components[0] == 'G1':
+        in_Gx = 1
+        components.pop(0)
+    seen_component_names = set()
+    ok = True
+    updates = []
+    for component in components:
+        component = component.upper()
+        if component[0:1] in _SHORT_VALIDS:
+            component_name, component_value = component[0], component[1:]
+        elif component[:3] in _LONG_VALIDS:
+            component_name, component_value = component[:3], component[3:]
+        elif component[0:1] == ';':
+            break
+        else:
+            ok = False
+            break
+        if component_name in seen_component_names:
+            raise RuntimeError('component {} is specified more than once in a block'.format(component_name))
+        seen_component_names.add(component_name)
+        updates.append((_NAME_TO_LIT[component_name], float(component_value)))
+    return line, in_Gx, updates, ok and len(updates) > 0 and in_Gx is not None
 
 
 if __name__ == '__main__':
@@ -78,8 +199,23 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser('TRAORI-mode hemisphere containment for I,J,K tool vector format commandline interface.')
     parser.add_argument('--input', type=str, default='-')
     parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    parser.add_argument('--profile', type=str, default=None, help='write cProfile stats for the run to this path')
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile')
+    parser.add_argument('--chunked', action='store_true', help='convert in chunks on reader and writer threads, within --memory-limit')
+    parser.add_argument('--memory-limit', type=int, default=ChunkedConfineTraoriHemisphere.DEFAULT_MEMORY_LIMIT // 1024**2,
+                        help='memory limit for --chunked, in MiB')
     args = parser.parse_args()
-    input = sys.stdin if args.input == '-' else open(args.input, newline='\r\n')
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
     output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
-    c = ConfineTraoriHemisphere()
+    instrumentation = Instrumentation(
+        profile_stage=None if args.profile is None else 'ConfineTraoriHemisphere.run',
+        profile_fpath=args.profile)
+    machine_model = None if args.machine_profile is None else MachineModel.load(args.machine_profile)
+    if args.chunked:
+        c = ChunkedConfineTraoriHemisphere(instrumentation, machine_model, args.memory_limit * 1024**2)
+    else:
+        c = ConfineTraoriHemisphere(instrumentation, machine_model)
     c.run(input, output)
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
@@ -1,19 +1,271 @@
 # Copyright (c) 2019 by Erik Hvatum
 
+import attr
+import concurrent.futures
+import multiprocessing
+import os
 from PyQt5 import Qt
+import queue
 import sys
+import time
 from . import om
 from pathlib import Path
 import re
-from .cnc_program import CncProgram
-from .progress_thread_dlg import ProgressThreadDlg
+from .hot_folder import post_file
+from .instrumentation import Canceled, Instrumentation
+from .program_viewer import ProgramViewer
+from .progress import EtaEstimator, format_eta
+
+def _adjust_file(job_id, fpath, out_fpath, events, canceled):
+    """Runs in a JobQueuePanel worker process, reporting (job_id, stage name, completion) to the events queue at every
+    stage event and giving up at the first after job_id appears in canceled.  Returns the size of the output."""
+    def on_stage_event(event, record):
+        if job_id in canceled:
+            raise Canceled()
+        events.put((job_id, record.name, record.completion))
+    instrumentation = Instrumentation()
+    instrumentation.listeners.append(on_stage_event)
+    post_file(fpath, out_fpath, 'mpf', 3, instrumentation=instrumentation)
+    return os.path.getsize(str(out_fpath))
+
+@attr.s
+class AdjustJob:
+    '''A file queued in a JobQueuePanel.  status is one of 'Queued', 'Running', 'Done', 'Failed', or 'Canceled'.'''
+    id = attr.ib()
+    fpath = attr.ib()
+    out_fpath = attr.ib()
+    status = attr.ib(default='Queued')
+    stage = attr.ib(default='')
+    completion = attr.ib(default=0.0)
+    eta = attr.ib(default=None)
+    started = attr.ib(default=None)
+    elapsed = attr.ib(default=None)
+    output_size = attr.ib(default=None)
+    error = attr.ib(default=None)
+    future = attr.ib(default=None, repr=False)
+    item = attr.ib(default=None, repr=False)
+    eta_estimator = attr.ib(default=attr.Factory(EtaEstimator), repr=False)
+
+    @property
+    def finished(self):
+        return self.status in ('Done', 'Failed', 'Canceled')
+
+class _ProgressDelegate(Qt.QStyledItemDelegate):
+    def paint(self, painter, option, index):
+        completion = index.data(Qt.Qt.UserRole)
+        if completion is None:
+            super().paint(painter, option, index)
+            return
+        bar = Qt.QStyleOptionProgressBar()
+        bar.rect = option.rect
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = int(round(completion * 100))
+        bar.text = '{}%'.format(bar.progress)
+        bar.textVisible = True
+        Qt.QApplication.style().drawControl(Qt.QStyle.CE_ProgressBar, bar, painter)
+
+class JobQueuePanel(Qt.QWidget):
+    '''A queue of files being adjusted (see adjust_nx_post_output(..)) by a pool of max_workers worker processes, one
+    row per file showing its status, current stage, the stage's progress and estimated time remaining, elapsed time, and
+    output size.  enqueue(..) returns at once.  Queued jobs start in row order, which the Move Up and Move Down buttons
+    change, and Cancel removes selected jobs from the queue or stops them at their next progress report, leaving no
+    output.
+
+    The GUI thread only polls for progress, every poll_interval milliseconds while jobs are queued or running.
+    job_activated(job) is emitted when a job's row is double clicked.'''
+    job_activated = Qt.pyqtSignal(object)
+    COLUMNS = ('File', 'Status', 'Stage', 'Progress', 'Remaining', 'Elapsed', 'Output Size')
+    _PROGRESS_COLUMN = 3
+
+    def __init__(self, parent=None, max_workers=None, poll_interval=100):
+        super().__init__(parent)
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.jobs = []
+        self._next_id = 0
+        self._executor = None
+        self._manager = None
+        self._events = None
+        self._canceled = None
+        layout = Qt.QVBoxLayout()
+        self.setLayout(layout)
+        self._tree = Qt.QTreeWidget()
+        self._tree.setHeaderLabels(self.COLUMNS)
+        self._tree.setRootIsDecorated(False)
+        self._tree.setSelectionMode(Qt.QAbstractItemView.ExtendedSelection)
+        self._tree.setItemDelegateForColumn(self._PROGRESS_COLUMN, _ProgressDelegate(self._tree))
+        self._tree.itemDoubleClicked.connect(self._on_item_double_clicked)
+        layout.addWidget(self._tree)
+        buttons = Qt.QHBoxLayout()
+        layout.addLayout(buttons)
+        for text, slot in (
+                ('Move Up', self.move_selected_up), ('Move Down', self.move_selected_down),
+                ('Cancel', self.cancel_selected), ('Clear Finished', self.clear_finished)):
+            button = Qt.QPushButton(text)
+            button.clicked.connect(slot)
+            buttons.addWidget(button)
+        self._timer = Qt.QTimer(self)
+        self._timer.setInterval(poll_interval)
+        self._timer.timeout.connect(self._poll)
+
+    def enqueue(self, fpath, out_fpath=None):
+        """Queues the adjustment of the MPF file at fpath, writing out_fpath (or overwriting fpath if out_fpath is
+        None), and returns the AdjustJob."""
+        fpath = Path(fpath)
+        job = AdjustJob(self._next_id, fpath, fpath if out_fpath is None else Path(out_fpath))
+        self._next_id += 1
+        job.item = Qt.QTreeWidgetItem([fpath.name] + [''] * (len(self.COLUMNS) - 1))
+        job.item.setToolTip(0, str(fpath))
+        self._tree.addTopLevelItem(job.item)
+        self.jobs.append(job)
+        self._update_item(job)
+        self._schedule()
+        return job
+
+    def cancel(self, job):
+        if job.status == 'Queued':
+            self._finish(job, 'Canceled')
+        elif job.status == 'Running':
+            self._canceled[job.id] = True
+
+    def cancel_selected(self):
+        for job in self._selected_jobs():
+            self.cancel(job)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            self.cancel(job)
+
+    def move_selected_up(self):
+        self._move_selected(-1)
+
+    def move_selected_down(self):
+        self._move_selected(1)
+
+    def clear_finished(self):
+        for job in [job for job in self.jobs if job.finished]:
+            self._tree.takeTopLevelItem(self._tree.indexOfTopLevelItem(job.item))
+            self.jobs.remove(job)
+
+    def shutdown(self):
+        """Cancels every job, waits for the running jobs to stop, and shuts down the worker processes."""
+        self.cancel_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._poll()
+            self._manager.shutdown()
+            self._executor = self._manager = self._events = self._canceled = None
+        self._timer.stop()
+
+    def _on_item_double_clicked(self, item, column):
+        for job in self.jobs:
+            if job.item is item:
+                self.job_activated.emit(job)
+                break
+
+    def _selected_jobs(self):
+        selected = set(id(item) for item in self._tree.selectedItems())
+        return [job for job in self.jobs if id(job.item) in selected]
+
+    def _move_selected(self, step):
+        selected = self._selected_jobs()
+        if not selected:
+            return
+        order = self.jobs if step < 0 else self.jobs[::-1]
+        # Move each selected job past the nearest unselected job, as long as one precedes it (in the direction moved)
+        for idx in range(1, len(order)):
+            if order[idx] in selected and order[idx-1] not in selected:
+                order[idx-1], order[idx] = order[idx], order[idx-1]
+        self.jobs = order if step < 0 else order[::-1]
+        for job in selected:
+            self._tree.takeTopLevelItem(self._tree.indexOfTopLevelItem(job.item))
+        for job in selected:
+            self._tree.insertTopLevelItem(self.jobs.index(job), job.item)
+            job.item.setSelected(True)
+
+    def _schedule(self):
+        """Starts queued jobs, in row order, while workers are free."""
+        running = sum(1 for job in self.jobs if job.status == 'Running')
+        for job in self.jobs:
+            if running >= self.max_workers:
+                break
+            if job.status != 'Queued':
+                continue
+            if self._executor is None:
+                self._manager = multiprocessing.Manager()
+                self._events = self._manager.Queue()
+                self._canceled = self._manager.dict()
+                self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+            job.future = self._executor.submit(
+                _adjust_file, job.id, str(job.fpath), str(job.out_fpath), self._events, self._canceled)
+            job.status = 'Running'
+            job.started = time.monotonic()
+            running += 1
+            self._update_item(job)
+        if running and not self._timer.isActive():
+            self._timer.start()
+
+    def _poll(self):
+        jobs = {job.id: job for job in self.jobs}
+        if self._events is not None:
+            while True:
+                try:
+                    job_id, stage, completion = self._events.get_nowait()
+                except queue.Empty:
+                    break
+                job = jobs.get(job_id)
+                if job is not None and job.status == 'Running':
+                    if stage != job.stage:
+                        job.eta_estimator.reset()
+                    job.stage, job.completion = stage, completion
+                    job.eta = job.eta_estimator.update(completion)
+        for job in self.jobs:
+            if job.status != 'Running':
+                continue
+            job.elapsed = time.monotonic() - job.started
+            if job.future.done():
+                error = job.future.exception()
+                if error is None:
+                    job.output_size = job.future.result()
+                    self._finish(job, 'Done')
+                elif isinstance(error, Canceled):
+                    self._finish(job, 'Canceled')
+                else:
+                    job.error = '{}: {}'.format(type(error).__name__, error)
+                    self._finish(job, 'Failed')
+            else:
+                self._update_item(job)
+        self._schedule()
+        if not any(job.status == 'Running' for job in self.jobs):
+            self._timer.stop()
+
+    def _finish(self, job, status):
+        job.status = status
+        job.eta = None
+        if self._canceled is not None:
+            self._canceled.pop(job.id, None)
+        if status == 'Done':
+            job.completion = 1.0
+        self._update_item(job)
+
+    def _update_item(self, job):
+        item = job.item
+        item.setText(1, job.status)
+        item.setText(2, job.stage)
+        item.setData(self._PROGRESS_COLUMN, Qt.Qt.UserRole, None if job.status == 'Queued' else job.completion)
+        item.setText(4, format_eta(job.eta))
+        item.setText(5, '' if job.elapsed is None else '{:.1f} s'.format(job.elapsed))
+        item.setText(6, '' if job.output_size is None else '{:,} bytes'.format(job.output_size))
+        item.setToolTip(1, job.error or '')
 
 class NxPostOutputAdjuster(Qt.QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle('DMU65 NX Post Output Adjuster')
         self.setAcceptDrops(True)
-        self._cnc_program = None
+        self.job_queue = JobQueuePanel(self)
+        self.job_queue.job_activated.connect(self._on_job_activated)
+        self.setCentralWidget(self.job_queue)
 
     def dragEnterEvent(self, event):
         event.acceptProposedAction()
@@ -30,21 +282,25 @@ class NxPostOutputAdjuster(Qt.QMainWindow):
                     self.transform_file(fpath)
 
     def transform_file(self, fpath):
-        cnc_program = CncProgram()
-        cnc_program.import_mpf(fpath)
-        pt_dlg = ProgressThreadDlg(cnc_program.transform_for_dmu65ul, self)
-        pt_dlg.exec()
-        if pt_dlg._worker.completed:
-            cnc_program.apply_tool_preloading()
-            outfn = fpath.name
-            # outfn = fpath.stem
-            # if outfn[-1] == '_':
-            #     outfn = outfn[:-1]
-            # else:
-            #     outfn = outfn + '_'
-            # outfn += '.mpf'
-            cnc_program.pattern_ops_across_homes(3)
-            cnc_program.export_mpf(fpath.parent / outfn)
+        outfn = fpath.name
+        # outfn = fpath.stem
+        # if outfn[-1] == '_':
+        #     outfn = outfn[:-1]
+        # else:
+        #     outfn = outfn + '_'
+        # outfn += '.mpf'
+        return self.job_queue.enqueue(fpath, fpath.parent / outfn)
+
+    def _on_job_activated(self, job):
+        if job.status == 'Done':
+            # Parented so that it closes with the main window, and flagged as a window so that it is shown as one
+            viewer = ProgramViewer(job.out_fpath, self)
+            viewer.setWindowFlags(Qt.Qt.Window)
+            viewer.show()
+
+    def closeEvent(self, event):
+        self.job_queue.shutdown()
+        super().closeEvent(event)
 
 if __name__ == '__main__':
     app = Qt.QApplication(sys.argv)
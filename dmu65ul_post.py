@@ -6,18 +6,48 @@ Testing, verification, and rapid development Python implementation of TetraDecaP
 implementation, named simply "TetraDecaPost", is C++.
 """
 
+import numpy
 import re
+from .arc_fitting import _format_value
+from .bspline import clamped_knots, linearize
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
 
 class DMU65UL_Post:
-    def __init__(self):
+    '''NURBS/ record groups (a NURBS/ record followed by KNOT/ records, listing one or more knots each, and CNTRL/
+    records, each giving a control point as X,Y,Z or X,Y,Z,weight) are linearized to G1 moves, with every chord within
+    nurbs_tolerance of the curve.  As NX writes them, the curve's first control point is not listed, being the tool
+    position the curve starts from, and the knots listed are those following the degree+1 knots at the start of the
+    curve, the knot at its end being listed once; the degree is the number of control points less the number of
+    knots listed.'''
+    def __init__(self, instrumentation=None, nurbs_tolerance=0.0005):
         super().__init__()
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.nurbs_tolerance = nurbs_tolerance
 
     def run(self, inputf, outputf):
+        with self.instrumentation.stage('DMU65UL_Post.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+
+    def _run(self, inputf, outputf, stage):
         line_num = -1
         line = inputf.readline()
         prev_was_rapid = False
+        # The X,Y,Z of the most recent GOTO, or None
+        position = None
+
+        def emit(*args):
+            out_line = ' '.join(args)
+            print(out_line, file=outputf)
+            stage.blocks_out += 1
+            stage.bytes_written += text_bytes(out_line, outputf) + 1
 
         while line != '':
+            stage.blocks_in += 1
+            if stage.blocks_in % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            stage.bytes_read += text_bytes(line, inputf)
             line = line.strip()
             # print(' <= ', line)
             line_num += 1
@@ -29,9 +59,9 @@ class DMU65UL_Post:
             if line == 'RAPID':
                 prev_was_rapid = True
             elif line.startswith('FEDRAT/IPM,'):
-                print('G1 F{}'.format(line.split(',')[1]), file=outputf)
+                emit('G1 F{}'.format(line.split(',')[1]))
             elif line.startswith('FEDRAT/'):
-                print('G1 F{}'.format(line.split('/')[1]), file=outputf)
+                emit('G1 F{}'.format(line.split('/')[1]))
             elif line.startswith('GOTO/'):
                 values = line[len('GOTO/'):].split(',')
                 value_count = len(values)
@@ -41,18 +71,74 @@ class DMU65UL_Post:
                     coords = 'X{} Y{} Z{} A3={} B3={} C3={}'.format(*values)
                 else:
                     raise RuntimeError('Bad value count - must be either 3 or 6, not {}.'.format(value_count))
-                print('G0' if prev_was_rapid else 'G1', coords, file=outputf)
+                emit('G0' if prev_was_rapid else 'G1', coords)
                 prev_was_rapid = False
+                position = tuple(float(value) for value in values[:3])
+            elif line.startswith('NURBS/'):
+                knots = []
+                control_points = []
+                line = inputf.readline()
+                while line.lstrip().startswith(('KNOT/', 'CNTRL/')):
+                    stage.blocks_in += 1
+                    stage.bytes_read += text_bytes(line, inputf)
+                    line_num += 1
+                    record, values = line.strip().split('/', 1)
+                    values = [float(value) for value in values.split(',')]
+                    if record == 'KNOT':
+                        knots.extend(values)
+                    elif len(values) in (3, 4):
+                        control_points.append(values + [1.0] * (4 - len(values)))
+                    else:
+                        raise RuntimeError('Bad CNTRL value count - must be either 3 or 4, not {}.'.format(len(values)))
+                    line = inputf.readline()
+                for point in self._linearize_nurbs(knots, control_points, position):
+                    emit('G1', 'X{} Y{} Z{}'.format(*(_format_value(value) for value in point)))
+                    position = tuple(point)
+                prev_was_rapid = False
+                # line is the record following the NURBS group, not yet processed
+                continue
             line = inputf.readline()
 
+    def _linearize_nurbs(self, knots, control_points, position):
+        """Returns the end points of the G1 moves along the NURBS curve starting from position."""
+        if not control_points:
+            return []
+        if position is None:
+            raise RuntimeError('Bad NURBS - no GOTO precedes it.')
+        control_points = numpy.array([list(position) + [1.0]] + control_points)
+        degree = len(control_points) - len(knots)
+        if degree < 1:
+            raise RuntimeError('Bad NURBS - {} knots are too many for {} control points.'.format(len(knots), len(control_points) - 1))
+        knots = clamped_knots(knots[:-1], degree, 0.0, knots[-1])
+        weights = control_points[:, 3] if (control_points[:, 3] != 1).any() else None
+        params, points = linearize(knots, degree, control_points[:, :3], self.nurbs_tolerance, weights)
+        return points[1:].tolist()
+
 if __name__ == '__main__':
     import argparse
     import sys
     parser = argparse.ArgumentParser('TetraDecaPost Python prototype implementation commandline interface.')
     parser.add_argument('--input', type=str, default='-')
     parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    parser.add_argument('--profile', type=str, default=None, help='write cProfile stats for the run to this path')
+    parser.add_argument('--nurbs-tolerance', type=float, default=0.0005, help='chord tolerance of NURBS linearization')
+    parser.add_argument('--dnc', type=str, default=None, help='drip feed the output to host:port or a named pipe')
+    parser.add_argument('--dnc-buffer-blocks', type=int, default=10000)
+    parser.add_argument('--dnc-start-block', type=int, default=0, help='resume drip feeding at this block number')
     args = parser.parse_args()
-    input = sys.stdin if args.input == '-' else open(args.input, newline='\r\n')
-    output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
-    pp = DMU65UL_Post()
-    pp.run(input, output)
\ No newline at end of file
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+    if args.dnc is not None:
+        from .dnc import DncSink
+        output = DncSink(args.dnc, args.dnc_buffer_blocks, args.dnc_start_block)
+    else:
+        output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
+    instrumentation = Instrumentation(
+        profile_stage=None if args.profile is None else 'DMU65UL_Post.run',
+        profile_fpath=args.profile)
+    pp = DMU65UL_Post(instrumentation, args.nurbs_tolerance)
+    pp.run(input, output)
+    if args.dnc is not None:
+        output.close()
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
\ No newline at end of file
@@ -0,0 +1,439 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import collections
+import re
+import socket
+import threading
+import time
+
+XON, XOFF = b'\x11', b'\x13'
+_RESUME_RE = re.compile(rb'\s*RESUME\s+(\d+)\s*')
+# The socket send buffer size, kept small so that little is in flight when the controller sends XOFF or is disconnected
+_SEND_BUFFER_BYTES = 1 << 16
+
+def parse_address(address):
+    """Returns (host, port) for a TCP address given as 'host:port' or (host, port), or the address unchanged if it is
+    the path of a named pipe."""
+    if isinstance(address, str):
+        host, sep, port = address.rpartition(':')
+        if sep and host and port.isdigit():
+            return host, int(port)
+        return address
+    return tuple(address)
+
+class DncSink:
+    '''A text file object, for the output of DMU65UL_Post or any stage writing lines to a file object, that drip feeds
+    each block (line) to a CNC controller as soon as it is written rather than once the whole program has been posted.
+    The controller is reached over TCP (address 'host:port' or (host, port)) or through a named pipe (address a path).
+    Blocks are sent with CRLF line endings.
+
+    Blocks written are held in a buffer of up to buffer_blocks blocks until sent.  While the buffer is full of unsent
+    blocks, write(..) waits, so that the stage producing the program runs no further ahead of the controller than
+    that.  The controller's flow control is respected: TCP's, and, over TCP, XOFF and XON characters from the controller
+    pause and resume sending.
+
+    Blocks are numbered from 0 in the order written.  Blocks before start_block are discarded, so that an interrupted
+    job can be resumed by running it again.  Room in the buffer not needed for unsent blocks holds the blocks most
+    recently sent, so that if the connection is lost, it is remade (retrying for up to reconnect_timeout seconds) and
+    sending resumes from the block given by a "RESUME <block number>" line from the controller, if one arrives within
+    resume_timeout seconds, or else from the first block not completely sent.  The blocks retained must cover those in
+    flight (in the operating system's buffers) when the connection is lost, which buffer_blocks should allow for.
+
+    Sending runs on its own thread.  A failure there (such as the connection not being remade) is raised by the next
+    write(..), flush(), or close().'''
+
+    def __init__(self, address, buffer_blocks=10000, start_block=0, encoding='utf-8', connect_timeout=10.0,
+                 reconnect_timeout=30.0, resume_timeout=1.0, retry_interval=0.1, batch_blocks=256):
+        self.address = parse_address(address)
+        self.buffer_blocks = buffer_blocks
+        self.start_block = start_block
+        self.encoding = encoding
+        self.connect_timeout = connect_timeout
+        self.reconnect_timeout = reconnect_timeout
+        self.resume_timeout = resume_timeout
+        self.retry_interval = retry_interval
+        self.batch_blocks = batch_blocks
+        self.closed = False
+        # Written text not yet pushed to the buffer, and the number of line endings in it
+        self._partial = []
+        self._partial_blocks = 0
+        # The number of blocks written so far, including those before start_block
+        self._numbered = 0
+        self._cond = threading.Condition()
+        # Blocks sent and retained, and blocks not yet sent; _next_send is the number of _unsent[0]
+        self._sent = collections.deque()
+        self._unsent = collections.deque()
+        self._next_send = start_block
+        self._finishing = False
+        self._sender_idle = False
+        self._paused = False
+        self._resume = None
+        self._disconnected = False
+        self._connection = None
+        self._error = None
+        self._sender = threading.Thread(target=self._send_loop, daemon=True)
+        self._sender.start()
+
+    @property
+    def blocks_sent(self):
+        """The number of the first block not yet sent."""
+        return self._next_send
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._partial.append(text)
+        if '\n' in text:
+            self._partial_blocks += text.count('\n')
+            if self._partial_blocks >= self.batch_blocks or self._sender_idle:
+                self._push(final=False)
+        return len(text)
+
+    def flush(self):
+        self._push(final=False)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._push(final=True)
+        with self._cond:
+            self._finishing = True
+            self._cond.notify_all()
+        self._sender.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _push(self, final):
+        """Moves the complete lines written (and, if final, any incomplete last line) to the buffer, waiting for room."""
+        text = ''.join(self._partial)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        blocks = text.split('\n')
+        last = blocks.pop()
+        self._partial = [last] if last and not final else []
+        self._partial_blocks = 0
+        if last and final:
+            blocks.append(last)
+        skip = max(0, min(len(blocks), self.start_block - self._numbered))
+        self._numbered += len(blocks)
+        idx = skip
+        with self._cond:
+            while idx < len(blocks):
+                self._raise_error()
+                room = self.buffer_blocks - len(self._unsent)
+                if room <= 0:
+                    self._cond.wait()
+                    continue
+                self._unsent.extend(blocks[idx:idx+room])
+                idx += room
+                excess = len(self._sent) + len(self._unsent) - self.buffer_blocks
+                for _ in range(min(excess, len(self._sent))):
+                    self._sent.popleft()
+                self._cond.notify_all()
+            self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _send_loop(self):
+        reconnecting = False
+        try:
+            while True:
+                connection = self._connect(self.reconnect_timeout if reconnecting else self.connect_timeout)
+                try:
+                    if self._send_connection(connection, reconnecting):
+                        return
+                except OSError:
+                    pass
+                finally:
+                    connection.close()
+                reconnecting = True
+        except BaseException as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+
+    def _connect(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if isinstance(self.address, tuple):
+                    return _SocketConnection(self.address, self)
+                return _PipeConnection(self.address)
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(self.retry_interval)
+
+    def _send_connection(self, connection, reconnecting):
+        """Sends blocks until every block has been sent and the end of the program signaled (returning True) or the
+        connection is lost (returning False)."""
+        with self._cond:
+            self._connection = connection
+            self._paused = False
+            self._disconnected = False
+        connection.start()
+        with self._cond:
+            if reconnecting and connection.duplex:
+                deadline = time.monotonic() + self.resume_timeout
+                while self._resume is None and not self._disconnected and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+        while True:
+            with self._cond:
+                while True:
+                    if self._disconnected:
+                        return False
+                    if self._resume is not None:
+                        self._rewind(self._resume)
+                        self._resume = None
+                    if (self._unsent and not self._paused) or (self._finishing and not self._unsent):
+                        break
+                    self._sender_idle = True
+                    self._cond.wait()
+                    self._sender_idle = False
+                if not self._unsent:
+                    break
+                batch = [self._unsent[idx] for idx in range(min(len(self._unsent), self.batch_blocks))]
+                first = self._next_send
+            connection.send(('\r\n'.join(batch) + '\r\n').encode(self.encoding))
+            with self._cond:
+                # Unless a resume request rewound the buffer meanwhile
+                if self._next_send == first and self._resume is None:
+                    for _ in range(len(batch)):
+                        self._sent.append(self._unsent.popleft())
+                    self._next_send += len(batch)
+                    excess = len(self._sent) + len(self._unsent) - self.buffer_blocks
+                    for _ in range(min(excess, len(self._sent))):
+                        self._sent.popleft()
+                    self._cond.notify_all()
+        return connection.finish()
+
+    def _rewind(self, block):
+        if block > self._next_send:
+            raise RuntimeError('Cannot resume at block {}, which has not been sent.'.format(block))
+        if block < self._next_send - len(self._sent):
+            raise RuntimeError('Cannot resume at block {}, which is no longer buffered (block {} is the first).'.format(
+                block, self._next_send - len(self._sent)))
+        for _ in range(self._next_send - block):
+            self._unsent.appendleft(self._sent.pop())
+        self._next_send = block
+
+    def _on_received(self, connection, xon_xoff, lines, disconnected):
+        """Called by a connection's reader thread with the last of XON or XOFF received (or None), the complete lines
+        received, and whether the connection has been lost."""
+        with self._cond:
+            if connection is not self._connection:
+                return
+            if xon_xoff is not None:
+                self._paused = xon_xoff == XOFF
+            for line in lines:
+                match = _RESUME_RE.fullmatch(line)
+                if match is not None:
+                    self._resume = int(match.group(1))
+            if disconnected:
+                self._disconnected = True
+            self._cond.notify_all()
+
+class _SocketConnection:
+    duplex = True
+
+    def __init__(self, address, sink):
+        self.socket = socket.create_connection(address, timeout=sink.connect_timeout)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _SEND_BUFFER_BYTES)
+        self.socket.settimeout(None)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sink = sink
+        self.reset = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self):
+        self._reader.start()
+
+    def send(self, data):
+        self.socket.sendall(data)
+
+    def finish(self):
+        """Signals the end of the program and waits briefly for the receiver to close the connection, returning False
+        if the connection was reset instead, as when the receiver drops it before reading everything sent."""
+        try:
+            self.socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            return False
+        self._reader.join(self.sink.connect_timeout)
+        return not self.reset
+
+    def close(self):
+        self.socket.close()
+
+    def _read_loop(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.socket.recv(4096)
+            except OSError:
+                self.reset = True
+                data = b''
+            if not data:
+                self.sink._on_received(self, None, [], True)
+                return
+            last = max(data.rfind(XON), data.rfind(XOFF))
+            xon_xoff = None if last < 0 else data[last:last+1]
+            lines = (buffer + data.replace(XON, b'').replace(XOFF, b'')).split(b'\n')
+            buffer = lines.pop()
+            self.sink._on_received(self, xon_xoff, lines, False)
+
+class _PipeConnection:
+    duplex = False
+
+    def __init__(self, fpath):
+        self.file = open(fpath, 'wb', buffering=0)
+
+    def start(self):
+        pass
+
+    def send(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[self.file.write(view):]
+
+    def finish(self):
+        return True
+
+    def close(self):
+        self.file.close()
+
+class StandInReceiver:
+    '''A local stand-in for a CNC controller's DNC input, for testing DncSink.  Listens on host:port (port 0 picks a free
+    port; see .address) for one sender at a time and takes each line received as a block, appended to .blocks.
+
+    If rate is given, blocks are executed at rate blocks per second from a buffer of buffer_blocks blocks; XOFF is sent
+    when the buffer is full, and XON once it has drained by half, as a controller does.  If drop_after is given, the
+    first connection is dropped after that many blocks, and the sender is asked to resume with a "RESUME <block
+    number>" line when it reconnects.  .first_block_time is the time.perf_counter() at which the first block arrived,
+    and .finished is set once a sender has closed the connection after its last block.'''
+
+    def __init__(self, host='127.0.0.1', port=0, rate=None, buffer_blocks=1000, drop_after=None):
+        self.rate = rate
+        self.buffer_blocks = buffer_blocks
+        self.drop_after = drop_after
+        self.blocks = []
+        self.connections = 0
+        self.first_block_time = None
+        self.finished = threading.Event()
+        self._server = socket.create_server((host, port))
+        self._connection = None
+        self.address = self._server.getsockname()[:2]
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stops listening and drops the connection, if any."""
+        self._server.close()
+        connection = self._connection
+        if connection is not None:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _serve(self):
+        while not self.finished.is_set():
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with connection:
+                self._connection = connection
+                self.connections += 1
+                if self.connections > 1:
+                    connection.sendall('RESUME {}\r\n'.format(len(self.blocks)).encode())
+                if self._receive(connection, self.drop_after if self.connections == 1 else None):
+                    self.finished.set()
+                self._connection = None
+
+    def _receive(self, connection, drop_after):
+        """Receives blocks until the sender closes the connection (returning True), or until the connection is lost or
+        dropped after drop_after blocks (returning False)."""
+        buffer = b''
+        executed = 0
+        t0 = time.perf_counter()
+        paused = False
+        while True:
+            if self.rate is not None:
+                executed = min(len(self.blocks), max(executed, int((time.perf_counter() - t0) * self.rate)))
+                held = len(self.blocks) - executed
+                if paused and held > self.buffer_blocks // 2:
+                    time.sleep(min(0.01, (held - self.buffer_blocks // 2) / self.rate))
+                    continue
+                if paused or held >= self.buffer_blocks:
+                    paused = not paused
+                    try:
+                        connection.sendall(XOFF if paused else XON)
+                    except OSError:
+                        return False
+                    continue
+            try:
+                data = connection.recv(65536)
+            except OSError:
+                return False
+            if not data:
+                return True
+            lines = (buffer + data).split(b'\n')
+            buffer = lines.pop()
+            if lines and self.first_block_time is None:
+                self.first_block_time = time.perf_counter()
+            self.blocks.extend(line.rstrip(b'\r').decode() for line in lines)
+            if drop_after is not None and len(self.blocks) >= drop_after:
+                del self.blocks[drop_after:]
+                return False
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from .flinereader import LineReader
+    parser = argparse.ArgumentParser('DNC drip feed commandline interface.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send', help='drip feed an MPF file')
+    send_parser.add_argument('address', type=str, help='host:port, or the path of a named pipe')
+    send_parser.add_argument('--input', type=str, default='-')
+    send_parser.add_argument('--buffer-blocks', type=int, default=10000)
+    send_parser.add_argument('--start-block', type=int, default=0, help='resume the job at this block number')
+    receive_parser = subparsers.add_parser('receive', help='run a stand-in receiver until one program has been received')
+    receive_parser.add_argument('--port', type=int, default=0)
+    receive_parser.add_argument('--output', type=str, default=None, help='write the blocks received to this path')
+    receive_parser.add_argument('--rate', type=float, default=None, help='blocks executed per second')
+    receive_parser.add_argument('--buffer-blocks', type=int, default=1000)
+    receive_parser.add_argument('--drop-after', type=int, default=None, help='drop the first connection after this many blocks')
+    args = parser.parse_args()
+    if args.command == 'send':
+        input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+        with input, DncSink(args.address, args.buffer_blocks, args.start_block) as sink:
+            for line in input:
+                sink.write(line)
+    else:
+        with StandInReceiver(port=args.port, rate=args.rate, buffer_blocks=args.buffer_blocks,
+                             drop_after=args.drop_after) as receiver:
+            print('listening on {}:{}'.format(*receiver.address), file=sys.stderr, flush=True)
+            receiver.finished.wait()
+        print('{} blocks over {} connection(s)'.format(len(receiver.blocks), receiver.connections), file=sys.stderr)
+        if args.output is not None:
+            with open(args.output, 'w', newline='\r\n') as f:
+                for block in receiver.blocks:
+                    print(block, file=f)
@@ -1,20 +1,173 @@
 # Copyright (c) 2019 by Erik Hvatum
 
-def flinereader(fpath):
+import bz2
+import gzip
+import lzma
+import numpy
+from pathlib import Path
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+_BOM = b'\xef\xbb\xbf'
+_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+def flinereader(fpath, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
     '''flinereader is a generator function that yields the content of the file specified by fpath,
-    one line at a time, with trailing linefeed or linefeed & carriage return removed.
+    one line at a time, with trailing linefeed or linefeed & carriage return removed.  See LineReader.
 
     Usage example:
     for line in flinereader("/foo/bar/baz.txt"):
         print(line)'''
 
-    fpath = str(fpath)
-    with open(fpath) as f:
-        line = f.readline()
-        while line != '':
-            if line[-2:] == '\r\n':
-                line = line[:-2]
-            elif line[-1] == '\n':
-                line = line[:-1]
-            yield line
+    with LineReader.open(fpath, encoding, chunk_size=chunk_size) as reader:
+        yield from reader.lines()
+
+def open_binary(fpath):
+    """Opens fpath for binary reading, decompressing it if its suffix is .gz, .bz2, or .xz."""
+    return _OPENERS.get(Path(fpath).suffix.lower(), open)(str(fpath), 'rb')
+
+class LineReader:
+    '''Reads lines from the binary file object binary_file chunk_size bytes at a time, decoding and splitting each
+    chunk's lines in bulk.  Lines may end with CRLF or LF, and a leading UTF-8 byte order mark is skipped.
+
+    lines() yields lines without their line endings.  A LineReader may also stand in for a text file opened for
+    reading: iteration, readline(), and readlines() give lines ending with LF.  memoryviews() yields the undecoded
+    lines, without line endings, as memoryview slices of the chunks read, without copying.'''
+
+    def __init__(self, binary_file, encoding='utf-8', errors='strict', chunk_size=DEFAULT_CHUNK_SIZE, close=False):
+        self.binary_file = binary_file
+        self.encoding = encoding
+        self.errors = errors
+        self.chunk_size = chunk_size
+        self._close = close
+        self._batches = self._line_batches()
+        # Lines of the current batch not yet returned by readline(), in reverse order
+        self._pending = []
+
+    @classmethod
+    def open(cls, fpath, encoding='utf-8', errors='strict', chunk_size=DEFAULT_CHUNK_SIZE):
+        """Returns a LineReader for the file at fpath (see open_binary(..)) that closes it when closed."""
+        return cls(open_binary(fpath), encoding, errors, chunk_size, close=True)
+
+    def close(self):
+        if self._close:
+            self.binary_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lines(self):
+        for batch in iter(self._next_batch, None):
+            yield from batch
+
+    def __iter__(self):
+        for batch in iter(self._next_batch, None):
+            yield from [line + '\n' for line in batch]
+
+    def readline(self):
+        if not self._pending:
+            batch = next(self._batches, None)
+            if batch is None:
+                return ''
+            batch.reverse()
+            self._pending = batch
+        return self._pending.pop() + '\n'
+
+    def readlines(self):
+        return list(self)
+
+    def memoryviews(self):
+        for chunk in self._chunks():
+            ends = numpy.flatnonzero(numpy.frombuffer(chunk, dtype=numpy.uint8) == ord('\n'))
+            starts = numpy.concatenate(([0], ends + 1))
+            if starts[-1] < len(chunk):
+                # The final line of the file, lacking a line ending
+                ends = numpy.append(ends, len(chunk))
+            else:
+                starts = starts[:-1]
+            cr = ends > starts
+            cr[cr] = numpy.frombuffer(chunk, dtype=numpy.uint8)[ends[cr] - 1] == ord('\r')
+            for start, end in zip(starts.tolist(), (ends - cr).tolist()):
+                yield chunk[start:end]
+
+    def _next_batch(self):
+        if self._pending:
+            batch = self._pending[::-1]
+            self._pending = []
+            return batch
+        return next(self._batches, None)
+
+    def _line_batches(self):
+        """Yields the lines of each chunk as a list."""
+        for chunk in self._chunks():
+            text = str(chunk, self.encoding, self.errors)
+            lines = text.splitlines()
+            # splitlines() also breaks lines at lone carriage returns and other characters that are not line endings
+            # here; each would add a line
+            if len(lines) != text.count('\n') + (text[-1] != '\n'):
+                lines = text.replace('\r\n', '\n').split('\n')
+                if not lines[-1]:
+                    lines.pop()
+            yield lines
+
+    def _chunks(self):
+        """Yields memoryviews of successive chunks of the file, each ending with a line ending except possibly the
+        last, and the first without the byte order mark."""
+        carry = b''
+        first = True
+        while True:
+            data = self.binary_file.read(self.chunk_size)
+            if not data:
+                if carry:
+                    yield memoryview(carry)
+                return
+            data = carry + data if carry else data
+            if first:
+                if len(data) < len(_BOM) and _BOM.startswith(data):
+                    carry = data
+                    continue
+                if data.startswith(_BOM):
+                    data = data[len(_BOM):]
+                first = False
+            end = data.rfind(b'\n') + 1
+            if end == 0:
+                carry = data
+                continue
+            carry = data[end:]
+            yield memoryview(data)[:end]
+
+if __name__ == '__main__':
+    import argparse
+    import io
+    import time
+    parser = argparse.ArgumentParser('Line reader benchmark commandline interface.')
+    parser.add_argument('input', type=str)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    def readline_loop(fpath):
+        # The line reading loop flinereader formerly used, given open_binary(..) so that it can read the same inputs
+        with io.TextIOWrapper(open_binary(fpath)) as f:
             line = f.readline()
+            while line != '':
+                if line[-2:] == '\r\n':
+                    line = line[:-2]
+                elif line[-1] == '\n':
+                    line = line[:-1]
+                yield line
+                line = f.readline()
+
+    def memoryview_lines(fpath):
+        with LineReader.open(fpath) as reader:
+            yield from reader.memoryviews()
+
+    for name, reader in (('readline loop', readline_loop), ('flinereader', flinereader), ('memoryviews', memoryview_lines)):
+        best = None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            count = sum(1 for line in reader(args.input))
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        print('{}: {} lines, {:.3f}s'.format(name, count, best))
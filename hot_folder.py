@@ -0,0 +1,266 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import asyncio
+import attr
+import concurrent.futures
+import functools
+import json
+import os
+from pathlib import Path
+import sys
+import time
+import traceback
+from .adjust_nx_post_output import adjust_nx_post_output
+from .dmu65ul_post import DMU65UL_Post
+from .flinereader import LineReader
+from .instrumentation import Instrumentation
+from .machine_model import MachineModel
+
+@attr.s
+class HotFolderJob:
+    '''A file posted by HotFolderWatcher.  status is one of 'queued', 'running', 'done', 'failed', or 'canceled' (queued
+    when the watcher stopped).  The *_at times are seconds since the epoch, and wall_time and cpu_time are those of the
+    job's stages, measured in the worker process, whose instrumentation report stages are kept in stages.'''
+    input = attr.ib()
+    output = attr.ib()
+    kind = attr.ib()
+    status = attr.ib(default='queued')
+    queued_at = attr.ib(default=None)
+    started_at = attr.ib(default=None)
+    finished_at = attr.ib(default=None)
+    wall_time = attr.ib(default=None)
+    cpu_time = attr.ib(default=None)
+    error = attr.ib(default=None)
+    stages = attr.ib(default=None, repr=False)
+
+    def as_dict(self):
+        d = attr.asdict(self)
+        d['input'] = str(self.input)
+        d['output'] = str(self.output)
+        return d
+
+def post_file(fpath, out_fpath, kind, pattern_count=3, machine_profile=None, nurbs_tolerance=0.0005,
+              instrumentation=None):
+    """Posts the file at fpath to out_fpath and returns the instrumentation report.  kind is 'mpf' for NX post output,
+    which is adjusted by adjust_nx_post_output(..), or 'cl' for CL data, which is posted by DMU65UL_Post.
+    machine_profile is the path of a JSON machine profile, or None for the default MachineModel.  The output is written
+    beside out_fpath with the suffix .part added and renamed to out_fpath once complete, so that out_fpath is never
+    found part written and a failed job leaves no output."""
+    if kind not in ('mpf', 'cl'):
+        raise ValueError("kind must be 'mpf' or 'cl', not {!r}.".format(kind))
+    out_fpath = Path(out_fpath)
+    part_fpath = out_fpath.with_name(out_fpath.name + '.part')
+    instrumentation = Instrumentation() if instrumentation is None else instrumentation
+    try:
+        if kind == 'mpf':
+            machine_model = None if machine_profile is None else MachineModel.load(machine_profile)
+            adjust_nx_post_output(
+                fpath, part_fpath, instrumentation, pattern_count, machine_model=machine_model, parallel=False)
+        else:
+            with LineReader.open(fpath) as inputf, open(str(part_fpath), 'w', newline='\r\n') as outputf:
+                DMU65UL_Post(instrumentation, nurbs_tolerance).run(inputf, outputf)
+        os.replace(str(part_fpath), str(out_fpath))
+    finally:
+        if part_fpath.exists():
+            part_fpath.unlink()
+    return instrumentation.report(fpath)
+
+class HotFolderWatcher:
+    '''Watches watch_dir for NX post output (mpf_suffixes) and CL data (cl_suffixes) files, posting each new or changed
+    file to output_dir (see post_file(..)).  CL data output is named for the input with the suffix .mpf; MPF output
+    keeps the input's name.
+
+    watch_dir is polled every poll_interval seconds rather than watched through operating system notifications, which
+    are unreliable for the network shares NX writes to.  A file is queued once its size and modification time have
+    gone unchanged for settle_time seconds and it can be opened, so that files still being written are not posted
+    part way.  A file changing while its job is queued or running is posted again once the job is done.
+
+    Scheduling runs on an asyncio event loop, and posting in a pool of worker processes, so that many files arriving
+    at once are spread across cores; each job transforms its program serially.
+
+    Each job's progress is appended to log_fpath, if given, as a line of JSON per event: the HotFolderJob.as_dict()
+    fields, plus event ('queued', 'started', or 'finished') and time.  Listeners are callables accepting (event, job),
+    called on the event loop's thread.'''
+
+    def __init__(self, watch_dir, output_dir, log_fpath=None, workers=None, poll_interval=1.0, settle_time=2.0,
+                 mpf_suffixes=('.mpf',), cl_suffixes=('.cls', '.txt'), pattern_count=3, machine_profile=None,
+                 nurbs_tolerance=0.0005):
+        self.watch_dir = Path(watch_dir)
+        self.output_dir = Path(output_dir)
+        if self.output_dir.resolve() == self.watch_dir.resolve():
+            raise ValueError('output_dir must differ from watch_dir, or the output would be posted in turn.')
+        self.log_fpath = None if log_fpath is None else Path(log_fpath)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.kinds = {suffix.lower(): 'mpf' for suffix in mpf_suffixes}
+        self.kinds.update((suffix.lower(), 'cl') for suffix in cl_suffixes)
+        self.pattern_count = pattern_count
+        self.machine_profile = None if machine_profile is None else str(machine_profile)
+        self.nurbs_tolerance = nurbs_tolerance
+        self.jobs = []
+        self.listeners = []
+        # (size, mtime) of each file that is changing or settling, and the monotonic time it was first seen so
+        self._settling = {}
+        # (size, mtime) of each file when last queued
+        self._queued_signatures = {}
+        # Input paths of the jobs queued or running
+        self._active = set()
+        self._loop = None
+        self._stopping = None
+
+    def run(self, once=False):
+        """Runs serve(once) on a new event loop until it returns."""
+        asyncio.run(self.serve(once))
+
+    def stop(self):
+        """Asks serve(..) to return once the running jobs finish, canceling queued jobs.  May be called from any
+        thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self, once=False):
+        """Watches and posts until stop() is called or, if once is True, until the files present have been posted."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        queue = asyncio.Queue()
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            workers = [asyncio.create_task(self._work(queue, pool)) for _ in range(self.workers)]
+            try:
+                while not self._stopping.is_set():
+                    for job in self.poll():
+                        queue.put_nowait(job)
+                    if once and not self._settling and not self._active:
+                        break
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                while not queue.empty():
+                    job = queue.get_nowait()
+                    queue.task_done()
+                    job.status = 'canceled'
+                    job.finished_at = time.time()
+                    self._active.discard(job.input)
+                    self._notify('finished', job)
+                await queue.join()
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    def poll(self):
+        """Scans watch_dir once, returning a new queued HotFolderJob for each file that has settled since it appeared
+        or last changed."""
+        now = time.monotonic()
+        present = set()
+        jobs = []
+        with os.scandir(str(self.watch_dir)) as entries:
+            for entry in entries:
+                kind = self.kinds.get(os.path.splitext(entry.name)[1].lower())
+                if kind is None or not entry.is_file():
+                    continue
+                fpath = Path(entry.path)
+                present.add(fpath)
+                if fpath in self._active:
+                    continue
+                stat = entry.stat()
+                signature = stat.st_size, stat.st_mtime_ns
+                if self._queued_signatures.get(fpath) == signature:
+                    continue
+                settling = self._settling.get(fpath)
+                if settling is None or settling[0] != signature:
+                    self._settling[fpath] = signature, now
+                elif now - settling[1] >= self.settle_time and _can_open(fpath):
+                    del self._settling[fpath]
+                    self._queued_signatures[fpath] = signature
+                    jobs.append(self._queue(fpath, kind))
+        # Forget deleted files, so that a file of the same name dropped in again is posted
+        for fpaths in (self._settling, self._queued_signatures):
+            for fpath in [fpath for fpath in fpaths if fpath not in present]:
+                del fpaths[fpath]
+        return jobs
+
+    def _queue(self, fpath, kind):
+        out_fpath = self.output_dir / (fpath.name if kind == 'mpf' else fpath.stem + '.mpf')
+        job = HotFolderJob(fpath, out_fpath, kind, queued_at=time.time())
+        self.jobs.append(job)
+        self._active.add(fpath)
+        self._notify('queued', job)
+        return job
+
+    async def _work(self, queue, pool):
+        while True:
+            job = await queue.get()
+            try:
+                await self._run_job(job, pool)
+            finally:
+                queue.task_done()
+
+    async def _run_job(self, job, pool):
+        job.status = 'running'
+        job.started_at = time.time()
+        self._notify('started', job)
+        try:
+            report = await self._loop.run_in_executor(pool, functools.partial(
+                post_file, job.input, job.output, job.kind, self.pattern_count, self.machine_profile,
+                self.nurbs_tolerance))
+        except Exception as e:
+            job.status = 'failed'
+            job.error = ''.join(traceback.format_exception_only(type(e), e)).strip()
+        else:
+            job.status = 'done'
+            job.wall_time = report['wall_time']
+            job.cpu_time = report['cpu_time']
+            job.stages = report['stages']
+        job.finished_at = time.time()
+        self._active.discard(job.input)
+        self._notify('finished', job)
+
+    def _notify(self, event, job):
+        if self.log_fpath is not None:
+            entry = job.as_dict()
+            entry.update(event=event, time=time.time())
+            with open(str(self.log_fpath), 'a') as f:
+                print(json.dumps(entry), file=f)
+        for listener in self.listeners:
+            listener(event, job)
+
+def _can_open(fpath):
+    """False if fpath cannot be opened, as on Windows while the program writing it holds it open."""
+    try:
+        with open(str(fpath), 'rb'):
+            return True
+    except OSError:
+        return False
+
+def _print_job_event(event, job):
+    if event == 'finished':
+        if job.status == 'done':
+            print('{}: done, {:.3f}s wall, {:.3f}s cpu'.format(job.input, job.wall_time, job.cpu_time), file=sys.stderr)
+        else:
+            print('{}: {}{}'.format(job.input, job.status, '' if job.error is None else ' - ' + job.error), file=sys.stderr)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Hot folder NX post output and CL data posting service commandline interface.')
+    parser.add_argument('watch_dir', type=str)
+    parser.add_argument('output_dir', type=str)
+    parser.add_argument('--log', type=str, default=None, help='append per-job status and timing JSON lines to this path')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--settle-time', type=float, default=2.0, help='seconds a file must go unchanged before posting')
+    parser.add_argument('--once', action='store_true', help='post the files present and exit')
+    parser.add_argument('--pattern-count', type=int, default=3)
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile')
+    parser.add_argument('--nurbs-tolerance', type=float, default=0.0005)
+    args = parser.parse_args()
+    watcher = HotFolderWatcher(
+        args.watch_dir, args.output_dir, args.log, args.workers, args.poll_interval, args.settle_time,
+        pattern_count=args.pattern_count, machine_profile=args.machine_profile, nurbs_tolerance=args.nurbs_tolerance)
+    watcher.listeners.append(_print_job_event)
+    try:
+        watcher.run(args.once)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,179 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The number of blocks a stage processes between calls to StageRecord.progress(..) or StageRecord.checkpoint(); small
+# enough that no stage goes much more than 10ms between calls
+CHECKPOINT_BLOCKS = 1000
+
+def text_bytes(text, f):
+    """Returns the number of bytes text takes up encoded as the text file (or LineReader) f encodes it."""
+    return len(text) if text.isascii() else len(text.encode(getattr(f, 'encoding', None) or 'utf-8'))
+
+def stream_position(f):
+    """Returns the byte offset reached in the binary file underlying f, a binary file, text file, or LineReader, or
+    None where there is no such offset, eg for a pipe or an io.StringIO."""
+    if isinstance(f, io.TextIOWrapper):
+        f.flush()
+        f = f.buffer
+    else:
+        f = getattr(f, 'binary_file', f)
+    if not isinstance(f, (io.BufferedIOBase, io.RawIOBase)):
+        return None
+    try:
+        return f.tell() if f.seekable() else None
+    except (OSError, ValueError):
+        return None
+
+@contextlib.contextmanager
+def stream_bytes(stage, inputf, outputf):
+    """For a stage reading lines from inputf and writing lines to outputf, which counts bytes_read and bytes_written
+    line by line with text_bytes(..) (and so counts each line ending as LF), replaces either count with the number of
+    bytes the stage actually moved through the underlying binary file where its position is available.  This counts
+    CRLF line endings, and for a file written with newline='\\r\\n', the CR added to each line."""
+    read_start, written_start = stream_position(inputf), stream_position(outputf)
+    yield
+    if read_start is not None:
+        read_end = stream_position(inputf)
+        if read_end is not None:
+            stage.bytes_read = read_end - read_start
+    if written_start is not None:
+        written_end = stream_position(outputf)
+        if written_end is not None:
+            stage.bytes_written = written_end - written_start
+
+class Canceled(Exception):
+    '''Raised within the stage running when its Instrumentation is canceled.'''
+
+@attr.s
+class StageRecord:
+    name = attr.ib()
+    wall_time = attr.ib(default=None)
+    cpu_time = attr.ib(default=None)
+    blocks_in = attr.ib(default=None)
+    blocks_out = attr.ib(default=None)
+    bytes_read = attr.ib(default=None)
+    bytes_written = attr.ib(default=None)
+    peak_memory = attr.ib(default=None)
+    completion = attr.ib(default=0.0)
+    instrumentation = attr.ib(default=None, repr=False)
+
+    def progress(self, completion):
+        self.completion = completion
+        self.instrumentation._progress(self)
+
+    def checkpoint(self):
+        """progress(..) for stages that cannot estimate their completion."""
+        self.instrumentation._progress(self)
+
+    def as_dict(self):
+        return attr.asdict(self, filter=lambda a, v: a.name != 'instrumentation')
+
+class Instrumentation:
+    '''Every pipeline stage (MPF import, each CncProgram transform pass, MPF export, DMU65UL_Post.run, and
+    ConfineTraoriHemisphere.run) runs inside Instrumentation.stage(..), which records a StageRecord with wall and CPU
+    time, block counts, byte counts, and peak memory.  Stages report completion through StageRecord.progress(..), or
+    call StageRecord.checkpoint() if they cannot estimate it, every CHECKPOINT_BLOCKS blocks.
+
+    Listeners are callables accepting (event, stage_record), where event is one of 'started', 'progress', or
+    'finished'.  'progress' events are sent at most every progress_interval seconds.  The GUI (see progress.py), the
+    hot folder service, and the batch commandline interface in adjust_nx_post_output.py obtain progress this way.
+
+    cancel(), which may be called from any thread, makes the stage running raise Canceled at its next progress report
+    or checkpoint, and any stage started afterwards raise Canceled as it starts.  A listener may also raise Canceled.
+
+    If trace_memory is True, peak memory is measured per stage with tracemalloc (slow).  Otherwise, peak memory is
+    the process's peak resident set size so far, where the platform provides it.
+
+    If profile_stage names a stage, that stage is run under cProfile, and the resulting pstats.Stats is stored in
+    .profile_stats and optionally dumped to profile_fpath.'''
+    progress_interval = 0.05
+
+    def __init__(self, profile_stage=None, profile_fpath=None, trace_memory=False):
+        self.profile_stage = profile_stage
+        self.profile_fpath = profile_fpath
+        self.profile_stats = None
+        self.trace_memory = trace_memory
+        self.records = []
+        self.listeners = []
+        self.canceled = False
+        self._last_progress = None
+
+    def cancel(self):
+        self.canceled = True
+
+    @contextlib.contextmanager
+    def stage(self, name, **counts):
+        """counts: initial values for any of the StageRecord block and byte count fields."""
+        if self.canceled:
+            raise Canceled()
+        record = StageRecord(name, instrumentation=self, **counts)
+        self.records.append(record)
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        self._notify('started', record)
+        wall_t0, cpu_t0 = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record.wall_time = time.perf_counter() - wall_t0
+            record.cpu_time = time.process_time() - cpu_t0
+            record.peak_memory = self._peak_memory()
+            if profiler is not None:
+                self.profile_stats = pstats.Stats(profiler)
+                if self.profile_fpath is not None:
+                    self.profile_stats.dump_stats(str(self.profile_fpath))
+        record.completion = 1.0
+        self._notify('finished', record)
+
+    def _peak_memory(self):
+        if self.trace_memory:
+            return tracemalloc.get_traced_memory()[1]
+        if resource is not None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+            return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def _progress(self, record):
+        if self.canceled:
+            raise Canceled()
+        now = time.monotonic()
+        if self._last_progress is None or now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self._notify('progress', record)
+
+    def _notify(self, event, record):
+        for listener in self.listeners:
+            listener(event, record)
+
+    def report(self, fpath=None):
+        return {
+            'file': None if fpath is None else str(fpath),
+            'wall_time': sum(r.wall_time for r in self.records if r.wall_time is not None),
+            'cpu_time': sum(r.cpu_time for r in self.records if r.cpu_time is not None),
+            'stages': [r.as_dict() for r in self.records]}
+
+    def write_report(self, json_fpath, fpath=None):
+        with open(str(json_fpath), 'w') as f:
+            json.dump(self.report(fpath), f, indent=2)
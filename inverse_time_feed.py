@@ -0,0 +1,193 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import numpy
+import re
+import sys
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
+from .machine_model import MachineModel
+
+_N_WORD_RE = re.compile(r'N\d+', flags=re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+# Inverse-time blocks never take less than this many minutes, which bounds F and covers zero-length blocks
+_MIN_BLOCK_TIME = 1e-4
+
+class InverseTimeFeed:
+    '''Rewrites each run of G1 moves with rotary motion in inverse-time feed mode (G93), so that the controller executes
+    every block of the run in the time it takes the tool tip to traverse it at the programmed feedrate.  The block time
+    is lengthened where moving at that rate would exceed an axis velocity limit of the machine model's profile.  G94 and
+    the programmed feedrate are restored at the end of the run.
+
+    Input is rotary axis format (eg A= and C=, as written by ConfineTraoriHemisphere) or I,J,K tool vector format (as
+    written by DMU65UL_Post).  X, Y, and Z are taken to be tool tip coordinates.  For I,J,K format, the angle swept by
+    the tool vector is limited by the slower of the tilt and rotary axis velocity limits.
+
+    A run is a sequence of G1 motion blocks, possibly interspersed with feedrate-only blocks, which are absorbed into
+    the run.  Any other block ends the run.'''
+
+    def __init__(self, machine_model=None, instrumentation=None):
+        self.machine_model = MachineModel() if machine_model is None else machine_model
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+
+    def run(self, inputf, outputf):
+        with self.instrumentation.stage('InverseTimeFeed.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+
+    def _run(self, inputf, outputf, stage):
+        # Component name -> column in the position arrays; A3=, B3=, and C3= are the I,J,K tool vector components
+        columns = {
+            'X': 0, 'Y': 1, 'Z': 2, self.machine_model.tilt_name + '=': 3, self.machine_model.rotary_name + '=': 4,
+            'A3=': 5, 'B3=': 6, 'C3=': 7}
+        # Modal position; NaN where not yet known
+        position = numpy.full(len(columns), numpy.nan)
+        position[5:] = 0, 0, 1
+        feed = None
+        run = _Run()
+
+        def emit(out_line):
+            print(out_line, file=outputf)
+            stage.blocks_out += 1
+            stage.bytes_written += text_bytes(out_line, outputf) + 1
+
+        def flush():
+            nonlocal run
+            for out_line in run.lines(self.machine_model.profile, feed):
+                emit(out_line)
+            run = _Run()
+
+        for line in inputf:
+            stage.blocks_in += 1
+            if stage.blocks_in % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            stage.bytes_read += text_bytes(line, inputf)
+            line = line.rstrip('\r\n')
+            words, comment, in_Gx, updates, block_feed, is_motion = _parse_block(line, columns)
+            if block_feed is not None:
+                feed = block_feed
+            if is_motion and in_Gx == 1:
+                new_position = position.copy()
+                for col, value in updates:
+                    new_position[col] = value
+                run.append_move(line, words, comment, feed, position, new_position)
+                position = new_position
+            elif is_motion is None and block_feed is not None and in_Gx in (None, 1) and run.moves:
+                run.append_feed(line)
+            else:
+                flush()
+                for col, value in updates:
+                    position[col] = value
+                emit(line)
+        flush()
+
+class _Run:
+    def __init__(self):
+        # Each item is (line, words, comment, feed) for a move or (line, None, None, None) for a feedrate-only block
+        self.items = []
+        self.moves = []
+        self.starts = []
+        self.ends = []
+
+    def append_move(self, line, words, comment, feed, start, end):
+        item = line, words, comment, feed
+        self.items.append(item)
+        self.moves.append(item)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append_feed(self, line):
+        self.items.append((line, None, None, None))
+
+    def lines(self, machine_profile, final_feed):
+        """Yields the output lines for the run: the blocks unchanged if the run has no rotary motion or a move with no
+        known feedrate, and otherwise G93, the moves with inverse-time F words, and G94 with the programmed feedrate.
+        Feedrate-only blocks are dropped from G93 runs, as F means inverse time under G93; the programmed feedrate in
+        effect at the end of the run is restored by the G94 block."""
+        if not self.moves:
+            return
+        starts = numpy.array(self.starts)
+        ends = numpy.array(self.ends)
+        feeds = numpy.array([numpy.nan if feed is None else feed for line, words, comment, feed in self.moves])
+        deltas = numpy.nan_to_num(ends - starts)
+        rotary_deltas = numpy.abs(deltas[:, 3:5])
+        vector_angles = numpy.nan_to_num(numpy.degrees(numpy.arccos(numpy.clip(
+            numpy.einsum('ij,ij->i', starts[:, 5:], ends[:, 5:]), -1, 1))))
+        if not (rotary_deltas.any() or vector_angles.any()) or numpy.isnan(feeds).any():
+            for line, words, comment, feed in self.items:
+                yield line
+            return
+        x_v, y_v, z_v, tilt_v, rotary_v = machine_profile.max_velocities(['x', 'y', 'z', 'tilt', 'rotary'])
+        times = numpy.stack([
+            numpy.linalg.norm(deltas[:, :3], axis=1) / feeds,
+            numpy.abs(deltas[:, 0]) / x_v,
+            numpy.abs(deltas[:, 1]) / y_v,
+            numpy.abs(deltas[:, 2]) / z_v,
+            rotary_deltas[:, 0] / tilt_v,
+            rotary_deltas[:, 1] / rotary_v,
+            vector_angles / min(tilt_v, rotary_v),
+            numpy.full(len(feeds), _MIN_BLOCK_TIME)]).max(axis=0)
+        yield 'G93'
+        for (line, words, comment, feed), inverse_time in zip(self.moves, (1 / times).tolist()):
+            # The F word goes before any comment, which runs to the end of the block
+            yield ' '.join(words + ['F{:.4f}'.format(inverse_time)] + ([comment] if comment else []))
+        yield 'G94 F{}'.format(final_feed)
+
+def _parse_block(line, columns):
+    """Returns (words of the block other than F, trailing comment (from ';' to the end of the block) or None, 0 for G0 or
+    1 for G1 or None, list of (position column, value) pairs, F value or None, is_motion), with position columns looked
+    up in columns (component name -> column).  is_motion is True for a G0 or G1 with at least one position or vector
+    component and nothing unrecognized, None for a block with no unrecognized words and no components, and False
+    otherwise."""
+    code, semicolon, comment = line.partition(';')
+    comment = semicolon + comment.rstrip() if semicolon else None
+    words = _WHITESPACE_RE.split(code.strip())
+    if words == ['']:
+        words = []
+    in_Gx = None
+    updates = []
+    feed = None
+    ok = True
+    kept = []
+    for word_idx, word in enumerate(words):
+        if word_idx == 0 and _N_WORD_RE.fullmatch(word):
+            kept.append(word)
+            continue
+        name = word.upper()
+        if name in ('G0', 'G1'):
+            in_Gx = int(name[1])
+            kept.append(word)
+            continue
+        name = name[:3] if name[:3] in columns else name[:2] if name[:2] in columns else name[:1]
+        try:
+            value = float(word[len(name):])
+        except ValueError:
+            value = None
+        if name == 'F' and value is not None:
+            feed = value
+            continue
+        kept.append(word)
+        if name in columns and value is not None:
+            updates.append((columns[name], value))
+        else:
+            ok = False
+    if not ok:
+        return kept, comment, in_Gx, updates, feed, False
+    if not updates:
+        return kept, comment, in_Gx, updates, feed, None
+    return kept, comment, in_Gx, updates, feed, in_Gx is not None
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Inverse-time (G93) feedrate commandline interface.')
+    parser.add_argument('--input', type=str, default='-')
+    parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile')
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    args = parser.parse_args()
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
+    instrumentation = Instrumentation()
+    machine_model = None if args.machine_profile is None else MachineModel.load(args.machine_profile)
+    InverseTimeFeed(machine_model, instrumentation).run(input, output)
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
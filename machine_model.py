@@ -0,0 +1,130 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import math
+import numpy
+from .machine_profile import MachineProfile
+
+# The coordinate indexes (p, q) of the plane each axis rotates, ordered so that a positive rotation takes p toward q
+_ROTATION_PLANES = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}
+_TILT_AXES = {'A': 'x', 'B': 'y'}
+
+class MachineModel:
+    '''Forward and inverse kinematics of the trunnion machine described by a MachineProfile (see MachineProfile for the
+    conventions).  Everything that converts between tool vectors, rotary axis positions, and machine positions goes
+    through a MachineModel, so that supporting another trunnion machine is a matter of configuration.
+
+    Angles are in degrees.  The per-machine parts of the kinematics (which plane each axis rotates, the direction
+    signs, the pivot) are resolved once, on construction, and the vectorized methods compute each rotation once per
+    run of blocks at the same angle, so the configurability costs nothing per block.'''
+    # Tool vectors whose component perpendicular to Z does not exceed this are treated as parallel to Z
+    singularity_tolerance = 1e-6
+
+    def __init__(self, profile=None):
+        self.profile = profile = MachineProfile() if profile is None else profile
+        if profile.tilt_axis not in _TILT_AXES:
+            raise ValueError('tilt_axis must be one of {}, not {!r}.'.format(', '.join(_TILT_AXES), profile.tilt_axis))
+        self.tilt_name = profile.tilt_axis
+        self.rotary_name = profile.rotary_axis
+        self._tilt_about = _TILT_AXES[profile.tilt_axis]
+        self._tilt_direction = profile.tilt_direction
+        self._rotary_direction = profile.rotary_direction
+        self._rotary_zero = profile.rotary_zero
+        self._preferred_tilt_sign = profile.preferred_tilt_sign
+        # The sign of the sine of the tilt rotation for the preferred solution
+        self._s = profile.tilt_direction * profile.preferred_tilt_sign
+        if self._tilt_about == 'x':
+            self._pivot = numpy.array([0.0, profile.tilt_pivot[0], profile.tilt_pivot[1]])
+        else:
+            self._pivot = numpy.array([profile.tilt_pivot[0], 0.0, profile.tilt_pivot[1]])
+        self._table_offset = numpy.array(profile.table_center) - self._pivot
+        self._work_offset = numpy.array(profile.work_offset)
+        self.reference_rotary = self.inverse_one(1, 0, 0, None)[1]
+
+    @classmethod
+    def load(cls, fpath):
+        return cls(MachineProfile.load(fpath))
+
+    def _theta(self, i, j, atan2):
+        """The rotation about Z that brings (i, j) into the tilt axis's plane of rotation, in radians."""
+        s = self._s
+        if self._tilt_about == 'x':
+            return atan2(s*i, s*j)
+        return atan2(s*j, -s*i)
+
+    def inverse_one(self, i, j, k, held_rotary):
+        """Returns the preferred (tilt, rotary) pointing the tool along the vector (i, j, k).  Where the vector is
+        within singularity_tolerance of parallel to Z, the rotary axis position is indeterminate and held_rotary is
+        returned for it.  ValueError is raised if |k| > 1."""
+        tilt = self._preferred_tilt_sign * math.degrees(math.acos(k))
+        if math.sqrt(i*i+j*j) <= self.singularity_tolerance:
+            return tilt, held_rotary
+        return tilt, self._rotary_direction * math.degrees(self._theta(i, j, math.atan2)) + self._rotary_zero
+
+    def inverse(self, ijk, held_rotary):
+        """Vectorized inverse_one(..) for the rows of the Nx3 array ijk, with the rotary axis position held from the
+        preceding row (or held_rotary, for leading rows) through rows parallel to Z.  Returns (tilt, rotary)."""
+        i, j, k = numpy.asarray(ijk, dtype=numpy.float64).T
+        if (numpy.abs(k) > 1).any():
+            raise ValueError('math domain error')
+        tilt = self._preferred_tilt_sign * numpy.degrees(numpy.arccos(k))
+        rotary = self._rotary_direction * numpy.degrees(self._theta(i, j, numpy.arctan2)) + self._rotary_zero
+        nonsingular = numpy.hypot(i, j) > self.singularity_tolerance
+        rows = numpy.where(nonsingular, numpy.arange(len(rotary)), -1)
+        numpy.maximum.accumulate(rows, out=rows)
+        rotary = numpy.where(rows >= 0, rotary[numpy.maximum(rows, 0)], held_rotary)
+        return tilt, rotary
+
+    def solutions(self, i, j, k):
+        """Returns the two (tilt, rotary) solutions for the tool vector (i, j, k), preferred first, or None if the
+        vector is within singularity_tolerance of parallel to Z.  Other solutions differ by whole turns of the rotary
+        axis."""
+        if math.sqrt(i*i+j*j) <= self.singularity_tolerance:
+            return None
+        solution = self.inverse_one(i, j, k, None)
+        return solution, self.other_solution(*solution)
+
+    def other_solution(self, tilt, rotary):
+        """Returns the other (tilt, rotary) solution giving the same tool orientation as (tilt, rotary)."""
+        return -tilt, rotary + 180
+
+    def preferred_solution(self, tilt, rotary):
+        """Returns whichever of (tilt, rotary) and its other solution has a tilt of the preferred sign."""
+        if tilt * self._preferred_tilt_sign < 0:
+            return self.other_solution(tilt, rotary)
+        return tilt, rotary
+
+    def tool_vectors(self, tilt, rotary):
+        """Returns the Nx3 array of tool vectors, in work coordinates, for the axis positions tilt and rotary."""
+        z = numpy.zeros((numpy.size(tilt), 3))
+        z[:, 2] = 1
+        v = self._rotate(z, self._tilt_about, -self._tilt_direction * numpy.asarray(tilt, dtype=numpy.float64))
+        return self._rotate(v, 'z', -self._rotary_direction * (numpy.asarray(rotary, dtype=numpy.float64) - self._rotary_zero))
+
+    def forward(self, xyz, tilt, rotary, tool_length=0.0):
+        """Returns the Nx3 array of machine linear axis positions placing the tool tip at the work coordinate positions
+        xyz (an Nx3 array) with the rotary axes at tilt and rotary.  tool_length is added to Z."""
+        p = numpy.asarray(xyz, dtype=numpy.float64) + self._work_offset
+        p = self._rotate(p, 'z', self._rotary_direction * (numpy.asarray(rotary, dtype=numpy.float64) - self._rotary_zero))
+        p += self._table_offset
+        p = self._rotate(p, self._tilt_about, self._tilt_direction * numpy.asarray(tilt, dtype=numpy.float64))
+        p += self._pivot
+        p[:, 2] += tool_length
+        return p
+
+    @staticmethod
+    def _rotate(points, axis, angles):
+        """Rotates the rows of the Nx3 array points by the corresponding angles (degrees) about the named axis.  Cosines
+        and sines are computed once per run of equal angles."""
+        if not len(points):
+            return points.copy()
+        angles = numpy.broadcast_to(angles, (len(points),))
+        starts = numpy.flatnonzero(numpy.concatenate(([True], angles[1:] != angles[:-1])))
+        radians = numpy.radians(angles[starts])
+        counts = numpy.diff(numpy.append(starts, len(angles)))
+        c = numpy.repeat(numpy.cos(radians), counts)
+        s = numpy.repeat(numpy.sin(radians), counts)
+        p, q = _ROTATION_PLANES[axis]
+        r = points.copy()
+        r[:, p] = c*points[:, p] - s*points[:, q]
+        r[:, q] = s*points[:, p] + c*points[:, q]
+        return r
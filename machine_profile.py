@@ -0,0 +1,88 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import json
+import warnings
+
+@attr.s
+class MachineProfile:
+    '''Machine capabilities, geometry, and conventions not expressed in part programs.  Linear quantities are in inches
+    and angles in degrees, and velocity limits are per minute.  The defaults describe our DMU65; the travel limits and
+    geometry are nominal and should be set from the machine's actual configuration.
+
+    The machine is a trunnion: the rotary axis (rotary_axis, eg C) turns the table about Z, and the tilt axis
+    (tilt_axis, A for a tilt about X or B for a tilt about Y) tilts the rotary axis and table.  tilt_direction and
+    rotary_direction are +1 if a positive axis move turns the table counterclockwise as seen from the positive end of
+    its axis of rotation and -1 otherwise.  rotary_zero is the rotary axis position at which the table is in its
+    reference orientation.  Every tool vector not parallel to Z is reached by two tilt axis positions of opposite
+    sign, and the one with the sign of preferred_tilt_sign is used.
+
+    table_center is the machine position of the point where the rotary axis meets the table surface with both axes at
+    zero.  tilt_pivot is the position of the tilt axis in the plane it is perpendicular to: (Y, Z) for a tilt about X,
+    or (X, Z) for a tilt about Y.  work_offset is the position of the work coordinate system origin relative to
+    table_center, with both axes at zero.  Rotary travel limits of None indicate an endless rotary axis.
+
+    A profile may be loaded from a JSON file containing an object with any subset of these attributes.  Files written
+    before the tilt and rotary axes were configurable, using a_ and c_ names (eg a_max_velocity or c_min) and
+    a_pivot, load with a FutureWarning.'''
+    tilt_axis = attr.ib(default='A')
+    rotary_axis = attr.ib(default='C')
+    tilt_direction = attr.ib(default=-1)
+    rotary_direction = attr.ib(default=-1)
+    rotary_zero = attr.ib(default=0.0)
+    preferred_tilt_sign = attr.ib(default=1)
+    x_max_velocity = attr.ib(default=1181.0)
+    y_max_velocity = attr.ib(default=1181.0)
+    z_max_velocity = attr.ib(default=1181.0)
+    tilt_max_velocity = attr.ib(default=9000.0)
+    rotary_max_velocity = attr.ib(default=14400.0)
+    x_min = attr.ib(default=-12.8)
+    x_max = attr.ib(default=12.8)
+    y_min = attr.ib(default=-12.8)
+    y_max = attr.ib(default=12.8)
+    z_min = attr.ib(default=-4.0)
+    z_max = attr.ib(default=18.0)
+    tilt_min = attr.ib(default=-120.0)
+    tilt_max = attr.ib(default=120.0)
+    rotary_min = attr.ib(default=None)
+    rotary_max = attr.ib(default=None)
+    table_center = attr.ib(default=(0.0, 0.0, 0.0), converter=tuple)
+    tilt_pivot = attr.ib(default=(0.0, -4.0), converter=tuple)
+    work_offset = attr.ib(default=(0.0, 0.0, 0.0), converter=tuple)
+
+    @classmethod
+    def load(cls, fpath):
+        with open(str(fpath)) as f:
+            attributes = json.load(f)
+        renamed = [name for name in _RENAMED_ATTRIBUTES if name in attributes]
+        if renamed:
+            for name in renamed:
+                if _RENAMED_ATTRIBUTES[name] in attributes:
+                    raise ValueError('{} specifies both {} and {}.'.format(fpath, name, _RENAMED_ATTRIBUTES[name]))
+                attributes[_RENAMED_ATTRIBUTES[name]] = attributes.pop(name)
+            # A FutureWarning rather than a DeprecationWarning, as profiles are edited by users, who would not otherwise
+            # see it
+            warnings.warn('{} uses deprecated machine profile attributes {}; rename them to {}.'.format(
+                fpath, ', '.join(renamed), ', '.join(_RENAMED_ATTRIBUTES[name] for name in renamed)),
+                FutureWarning, stacklevel=2)
+        return cls(**attributes)
+
+    def max_velocities(self, axes):
+        """Returns the velocity limits of the named axes, eg ['x', 'y', 'z', 'tilt', 'rotary'], as a list."""
+        return [getattr(self, axis + '_max_velocity') for axis in axes]
+
+    def travel_limits(self, axis):
+        """Returns (min, max) for the named axis, eg 'x' or 'tilt', or None if the axis is unlimited."""
+        limits = getattr(self, axis + '_min'), getattr(self, axis + '_max')
+        return None if None in limits else limits
+
+# Attributes of profiles written before the tilt and rotary axes were configurable, and their current names
+_RENAMED_ATTRIBUTES = {
+    'a_max_velocity': 'tilt_max_velocity',
+    'c_max_velocity': 'rotary_max_velocity',
+    'a_min': 'tilt_min',
+    'a_max': 'tilt_max',
+    'c_min': 'rotary_min',
+    'c_max': 'rotary_max',
+    'a_pivot': 'tilt_pivot'
+}
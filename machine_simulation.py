@@ -0,0 +1,215 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import numpy
+import re
+import sys
+from .machine_model import MachineModel
+
+@attr.s
+class TravelReport:
+    '''The result of check_travel(..).  violations maps each axis name (x, y, z, and the lowercase tilt and rotary axis
+    names, eg a and c) to None or to a dict with the index of the first block taking that axis beyond its travel limits,
+    the axis position there, and the limits.  envelopes is a list of (operation, {axis: [min, max]}) pairs, in program
+    order.'''
+    blocks_checked = attr.ib()
+    violations = attr.ib()
+    envelopes = attr.ib()
+
+    @property
+    def ok(self):
+        return all(v is None for v in self.violations.values())
+
+    def as_dict(self):
+        return {
+            'blocks_checked': self.blocks_checked,
+            'ok': self.ok,
+            'violations': self.violations,
+            'envelopes': [{'operation': op, 'envelope': envelope} for op, envelope in self.envelopes]}
+
+@attr.s
+class Toolpath:
+    '''Programmed positions as arrays with one element per position: block holds the index of the block or record
+    (in the program or CL file) the position comes from, xyz the Nx3 tool tip positions in work coordinates, tilt and
+    rotary the rotary axis positions in degrees, and operations an array of indexes into operation_names.'''
+    block = attr.ib()
+    xyz = attr.ib()
+    tilt = attr.ib()
+    rotary = attr.ib()
+    operations = attr.ib()
+    operation_names = attr.ib()
+
+def check_travel(toolpath, machine_model=None, tool_length=0.0):
+    """Computes machine axis positions for every position of toolpath and checks them against the travel limits of
+    machine_model's profile, returning a TravelReport."""
+    if machine_model is None:
+        machine_model = MachineModel()
+    machine = machine_model.forward(toolpath.xyz, toolpath.tilt, toolpath.rotary, tool_length)
+    # Report axis name -> (profile axis name, positions)
+    axes = {
+        'x': ('x', machine[:, 0]),
+        'y': ('y', machine[:, 1]),
+        'z': ('z', machine[:, 2]),
+        machine_model.tilt_name.lower(): ('tilt', toolpath.tilt),
+        machine_model.rotary_name.lower(): ('rotary', toolpath.rotary)}
+    positions = {axis: v for axis, (profile_axis, v) in axes.items()}
+    violations = {}
+    for axis, (profile_axis, v) in axes.items():
+        limits = machine_model.profile.travel_limits(profile_axis)
+        violations[axis] = None
+        if limits is None or not len(toolpath.block):
+            continue
+        outside = (v < limits[0]) | (v > limits[1])
+        if outside.any():
+            idx = int(outside.argmax())
+            violations[axis] = {'block': int(toolpath.block[idx]), 'position': float(v[idx]), 'limits': list(limits)}
+    envelopes = []
+    if len(toolpath.block):
+        # Operations are contiguous runs of toolpath.operations; an operation may occur in more than one run
+        starts = numpy.flatnonzero(numpy.concatenate(([True], toolpath.operations[1:] != toolpath.operations[:-1])))
+        mins = {axis: numpy.minimum.reduceat(v, starts).tolist() for axis, v in positions.items()}
+        maxs = {axis: numpy.maximum.reduceat(v, starts).tolist() for axis, v in positions.items()}
+        for run_idx, start in enumerate(starts.tolist()):
+            envelopes.append((
+                toolpath.operation_names[toolpath.operations[start]],
+                {axis: [mins[axis][run_idx], maxs[axis][run_idx]] for axis in positions}))
+    return TravelReport(len(toolpath.block), violations, envelopes)
+
+def program_toolpath(commands, machine_model=None):
+    """Returns the Toolpath of the programmed end positions of the blocks in commands (a list of CncCommand, eg
+    CncProgram.commands) with axis words.  Positions are included once X, Y, Z, and the tool orientation are all known.
+    The tool orientation is given either by rotary axis words (eg A and C) or by A3=, B3=, and C3= tool vector words,
+    whichever were most recently programmed.  SUPA (machine coordinate) blocks and symbolic axis values are disregarded,
+    as are arc and spline shapes between programmed end positions.  Operations are named by ';Operation : NAME'
+    comments."""
+    if machine_model is None:
+        machine_model = MachineModel()
+    tilt_name, rotary_name = machine_model.tilt_name, machine_model.rotary_name
+    word_re = re.compile(r'([XYZ]|{}|{}|A3|B3|C3)=?(-?\d*\.?\d*(?:[eE][-+]?\d+)?)'.format(tilt_name, rotary_name))
+    columns = {'X': 0, 'Y': 1, 'Z': 2, tilt_name: 3, rotary_name: 4, 'A3': 5, 'B3': 6, 'C3': 7}
+    initials = set('XYZABC' + tilt_name + rotary_name)
+    rows, cols, values, op_rows, op_names = [], [], [], [], []
+    operation_names = ['(program start)']
+    for idx, cmd in enumerate(commands):
+        if not cmd.words:
+            if cmd.comment.startswith(';Operation'):
+                op_rows.append(idx)
+                op_names.append(len(operation_names))
+                operation_names.append(cmd.comment.partition(':')[2].strip() or operation_names[-1])
+            continue
+        if cmd.words[0] == 'SUPA':
+            continue
+        for word in cmd.words:
+            if word[0] in initials:
+                match = word_re.fullmatch(word)
+                if match is not None:
+                    try:
+                        value = float(match.group(2))
+                    except ValueError:
+                        continue
+                    rows.append(idx)
+                    cols.append(columns[match.group(1)])
+                    values.append(value)
+    return _toolpath(len(commands), rows, cols, values, op_rows, op_names, operation_names, machine_model)
+
+_CL_TOOL_PATH_RE = re.compile(rb'^TOOL PATH/([^,\r\n]*)', flags=re.MULTILINE)
+
+def cl_toolpath(text, machine_model=None):
+    """Returns the Toolpath of the GOTO positions of the NX CAM CL data in text (str or bytes), with block indexes
+    being line indexes and rotary axis positions from machine_model's inverse kinematics.  Operations are named by
+    TOOL PATH records."""
+    data = text.encode() if isinstance(text, str) else text
+    if not data.endswith(b'\n'):
+        data += b'\n'
+    buf = numpy.frombuffer(data, dtype=numpy.uint8)
+    line_ends = numpy.flatnonzero(buf == ord('\n'))
+    line_starts = numpy.concatenate(([0], line_ends[:-1] + 1))
+    # Find GOTO records by looking at the first bytes of every line at once
+    padded = numpy.concatenate((buf, numpy.zeros(5, dtype=numpy.uint8)))
+    is_goto = numpy.ones(len(line_starts), dtype=bool)
+    for offset, char in enumerate(b'GOTO/'):
+        is_goto &= padded[line_starts + offset] == char
+    goto_rows = numpy.flatnonzero(is_goto)
+    # Gather the values of every GOTO record into one comma separated string, with each record's newline becoming the
+    # comma separating it from the next
+    marks = numpy.zeros(len(buf) + 1, dtype=numpy.int8)
+    marks[line_starts[goto_rows] + 5] = 1
+    marks[line_ends[goto_rows] + 1] = -1
+    in_goto = numpy.cumsum(marks[:-1], dtype=numpy.int8) > 0
+    in_goto &= buf != ord('\r')
+    commas = numpy.flatnonzero(in_goto & (buf == ord(',')))
+    counts = numpy.bincount(numpy.searchsorted(line_starts, commas, side='right') - 1, minlength=len(line_starts))
+    counts = counts[goto_rows] + 1
+    bad = numpy.flatnonzero((counts != 3) & (counts != 6))
+    if len(bad):
+        raise RuntimeError('Bad value count in GOTO record on line {} - must be either 3 or 6, not {}.'.format(
+            goto_rows[bad[0]] + 1, counts[bad[0]]))
+    payload = buf[in_goto].copy()
+    payload[payload == ord('\n')] = ord(',')
+    values = numpy.array(payload.tobytes()[:-1].split(b','), dtype=numpy.float64) if len(payload) else numpy.zeros(0)
+    rows = numpy.repeat(goto_rows, counts)
+    # The fourth through sixth values of a record are its tool vector
+    positions = numpy.arange(len(rows)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    cols = numpy.where(positions < 3, positions, positions + 2)
+    op_offsets, op_names = [], []
+    operation_names = ['(program start)']
+    for match in _CL_TOOL_PATH_RE.finditer(data):
+        op_offsets.append(match.start())
+        op_names.append(len(operation_names))
+        operation_names.append(match.group(1).strip().decode())
+    op_rows = (numpy.searchsorted(line_starts, op_offsets, side='right') - 1).tolist()
+    return _toolpath(len(line_starts), rows, cols, values, op_rows, op_names, operation_names,
+                     MachineModel() if machine_model is None else machine_model)
+
+def _toolpath(n, rows, cols, values, op_rows, op_names, operation_names, machine_model):
+    rows = numpy.asarray(rows, dtype=numpy.int64)
+    cols = numpy.asarray(cols, dtype=numpy.int64)
+    updates = numpy.zeros((n, 8))
+    present = numpy.zeros((n, 8), dtype=bool)
+    updates[rows, cols] = values
+    present[rows, cols] = True
+    # Carry each axis forward from the most recent block that set it
+    last_set = numpy.where(present, numpy.arange(n)[:, numpy.newaxis], -1)
+    numpy.maximum.accumulate(last_set, axis=0, out=last_set)
+    modal = updates[numpy.maximum(last_set, 0), numpy.arange(8)]
+    # The orientation is taken from rotary axis words or from the tool vector, whichever was programmed more recently
+    axes_set = last_set[:, 3:5].max(axis=1)
+    vector_set = last_set[:, 5:8].max(axis=1)
+    use_vector = vector_set > axes_set
+    ijk = numpy.where(last_set[:, 5:8] >= 0, modal[:, 5:8], (0, 0, 1))
+    ijk[:, 2] = numpy.clip(ijk[:, 2], -1, 1)
+    vector_tilt, vector_rotary = machine_model.inverse(ijk, machine_model.reference_rotary)
+    tilt = numpy.where(use_vector, vector_tilt, modal[:, 3])
+    rotary = numpy.where(use_vector, vector_rotary, modal[:, 4])
+    orientation_known = use_vector | ((last_set[:, 3] >= 0) & (last_set[:, 4] >= 0))
+    has_position = numpy.zeros(n, dtype=bool)
+    has_position[rows] = True
+    selected = numpy.flatnonzero(has_position & (last_set[:, :3] >= 0).all(axis=1) & orientation_known)
+    operations = numpy.zeros(n, dtype=numpy.int64)
+    operations[op_rows] = op_names
+    numpy.maximum.accumulate(operations, out=operations)
+    return Toolpath(selected, modal[selected, :3], tilt[selected], rotary[selected], operations[selected], operation_names)
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from .cnc_program import CncProgram
+    from .flinereader import open_binary
+    parser = argparse.ArgumentParser('Machine travel limit check commandline interface.')
+    parser.add_argument('input', type=str, help='MPF program, or CL data if --cl is specified')
+    parser.add_argument('--cl', action='store_true', help='input is NX CAM CL data')
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile')
+    parser.add_argument('--tool-length', type=float, default=0.0)
+    args = parser.parse_args()
+    machine_model = None if args.machine_profile is None else MachineModel.load(args.machine_profile)
+    if args.cl:
+        with open_binary(args.input) as f:
+            toolpath = cl_toolpath(f.read(), machine_model)
+    else:
+        program = CncProgram()
+        program.import_mpf(args.input)
+        toolpath = program_toolpath(program.commands, machine_model)
+    report = check_travel(toolpath, machine_model, args.tool_length)
+    json.dump(report.as_dict(), sys.stdout, indent=1)
+    print()
+    sys.exit(0 if report.ok else 1)
@@ -130,6 +130,12 @@ class DragDropModelBehavior:
 
     def handle_dropped_rows(self, src_model, src_rows, dst_row, dst_column, dst_parent):
         d_sl, s_sl = self.signaling_list, src_model.signaling_list
+        if s_sl is d_sl and self.should_delete_rows_dragged_from_source(src_model):
+            # Rows dragged within a list are moved, rather than copied and then deleted, so that their elements
+            # remain attached to the model and views keep their selection.  A dst_row of -1 is a drop on the
+            # viewport beyond the last row.
+            d_sl.move(src_rows, len(d_sl) if dst_row == -1 else dst_row)
+            return True
         elements = [s_sl[src_row] for src_row in src_rows]
         if self.should_delete_rows_dragged_from_source(src_model):
             orig_src_midxs = [Qt.QPersistentModelIndex(src_model.createIndex(src_row, 0)) for src_row in reversed(src_rows)]
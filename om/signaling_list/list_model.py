@@ -85,7 +85,7 @@ class ListModel(Qt.QAbstractListModel):
         f |= self.drag_drop_flags(midx)
         return f
 
-    def drag_drop_flags(self):
+    def drag_drop_flags(self, midx):
         return 0
 
     def get_row(self, row):
@@ -121,7 +121,7 @@ class ListModel(Qt.QAbstractListModel):
                 return Qt.QVariant(section)
         elif orientation == Qt.Qt.Horizontal:
             if role == Qt.Qt.DisplayRole and 0 <= section < self.columnCount():
-                return Qt.QVariant(self.property_names[section])
+                return Qt.QVariant(self.property_name)
         return Qt.QVariant()
 
     def removeRows(self, row, count, parent=Qt.QModelIndex()):
@@ -148,6 +148,12 @@ class ListModel(Qt.QAbstractListModel):
                         self._signaling_list.replaced.disconnect(self._on_replaced)
                         self._signaling_list.removing.disconnect(self._on_removing)
                         self._signaling_list.removed.disconnect(self._on_removed)
+                        self._signaling_list.moving.disconnect(self._on_moving)
+                        self._signaling_list.moved.disconnect(self._on_moved)
+                        self._signaling_list.permuting.disconnect(self._on_permuting)
+                        self._signaling_list.permuted.disconnect(self._on_permuted)
+                        self._signaling_list.resetting.disconnect(self._on_resetting)
+                        self._signaling_list.reset.disconnect(self._on_reset)
                         self._detach_elements(self._signaling_list)
                     assert self.property_name is None or len(self._instance_counts) == 0
                     self._signaling_list = v
@@ -157,6 +163,12 @@ class ListModel(Qt.QAbstractListModel):
                         v.replaced.connect(self._on_replaced)
                         v.removing.connect(self._on_removing)
                         v.removed.connect(self._on_removed)
+                        v.moving.connect(self._on_moving)
+                        v.moved.connect(self._on_moved)
+                        v.permuting.connect(self._on_permuting)
+                        v.permuted.connect(self._on_permuted)
+                        v.resetting.connect(self._on_resetting)
+                        v.reset.connect(self._on_reset)
                         self._attach_elements(v)
                 finally:
                     self.endResetModel()
@@ -194,30 +206,64 @@ class ListModel(Qt.QAbstractListModel):
                 self._instance_counts[element] = instance_count
 
     def _on_property_changed(self, element):
-        sl = self.signaling_list
-        next_row = 0
         instance_count = self._instance_counts[element]
         assert instance_count > 0
-        for _ in range(instance_count):
-            row = sl.index(element, next_row)
-            next_row = row + 1
+        for row in self.signaling_list.positions(element, instance_count):
             self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, 0))
 
-    def _on_inserting(self, idx, elements):
-        self.beginInsertRows(Qt.QModelIndex(), idx, idx+len(elements)-1)
+    def _on_inserting(self, idxs, elements):
+        self.beginInsertRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
 
-    def _on_inserted(self, idx, elements):
+    def _on_inserted(self, idxs, elements):
         self.endInsertRows()
         self._attach_elements(elements)
 
     def _on_replaced(self, idxs, replaced_elements, elements):
         self._detach_elements(replaced_elements)
         self._attach_elements(elements)
-        self.dataChanged.emit(self.createIndex(min(idxs), 0), self.createIndex(max(idxs), 0))
+        self.dataChanged.emit(self.createIndex(idxs.start, 0), self.createIndex(idxs[-1], 0))
 
     def _on_removing(self, idxs, elements):
-        self.beginRemoveRows(Qt.QModelIndex(), min(idxs), max(idxs))
+        if idxs.step == 1:
+            self.beginRemoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
+        else:
+            # Rows removed from a strided slice are not one span of rows
+            self.beginResetModel()
 
     def _on_removed(self, idxs, elements):
-        self.endRemoveRows()
-        self._detach_elements(elements)
+        if idxs.step == 1:
+            self.endRemoveRows()
+            self._detach_elements(elements)
+        else:
+            self._detach_elements(elements)
+            self.endResetModel()
+
+    def _on_moving(self, idxs, dest):
+        self.beginMoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1, Qt.QModelIndex(), dest)
+
+    def _on_moved(self, idxs, dest):
+        self.endMoveRows()
+
+    def _on_permuting(self, idxs, sources):
+        self.layoutAboutToBeChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_permuted(self, idxs, sources):
+        midxs = self.persistentIndexList()
+        if midxs:
+            # Persistent indexes (selections, the current index, etc) of rearranged rows follow the rows
+            start, stop = idxs.start, idxs.stop
+            rows = [0] * len(sources)
+            for row, source in enumerate(sources, start):
+                rows[source - start] = row
+            self.changePersistentIndexList(midxs, [
+                self.createIndex(rows[midx.row() - start], midx.column()) if start <= midx.row() < stop else midx
+                for midx in midxs])
+        self.layoutChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_resetting(self, idxs, replaced_elements, elements):
+        self.beginResetModel()
+
+    def _on_reset(self, idxs, replaced_elements, elements):
+        self._detach_elements(replaced_elements)
+        self._attach_elements(elements)
+        self.endResetModel()
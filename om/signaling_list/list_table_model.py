@@ -157,13 +157,9 @@ class ListTableModel(Qt.QAbstractTableModel):
                 # TODO: 
 
     def _on_element_property_changed(self, element):
-        sl = self.signaling_list
-        next_idx = 0
-        instance_count = self._element_micro_models[element].element_instance_count
-        assert instance_count > 0
-        for _ in range(instance_count):
-            row = sl.index(element, next_idx)
-            next_idx = row + 1
+        eic = self._element_inst_nodes[element].eic
+        assert eic > 0
+        for row in self.signaling_list.positions(element, eic):
             self.dataChanged.emit(self.createIndex(row, 0), self.createIndex(row, 0))
 
     def _on_inserting(self, idx, elements):
@@ -182,15 +178,11 @@ class ListTableModel(Qt.QAbstractTableModel):
         pass
 
     def _on_ees_changed(self, e, ee, eeidxs):
-        sl = self.signaling_list
-        next_eidx = 0
         eic = self._element_inst_nodes[e].eic
         assert eic > 0
-        for _ in range(eic):
-            eidx = sl.index(e, next_eidx)
-            next_eidx = eidx + 1
+        for eidx in self.signaling_list.positions(e, eic):
             for eeidx in eeidxs:
-                self.dataChanged.emit(self.createIndex(idx, eeidx+1), self.createIndex(row, eeidx+1))
+                self.dataChanged.emit(self.createIndex(eidx, eeidx+1), self.createIndex(eidx, eeidx+1))
 
     def _on_ees_inserting(self, ein, idx, ees):
         self.beginInsertRows(Qt.QModelIndex(), )
@@ -208,12 +200,12 @@ class ListTableModel(Qt.QAbstractTableModel):
         pass
 
 class _ElementInstNode(Qt.QObject):
-    ees_changed = Qt.pyqtSignal(object, object, idxs)
-    ees_inserting = Qt.pyqtSignal(object, int, list)
-    ees_inserted = Qt.pyqtSignal(object, int, list)
-    ees_replaced = Qt.pyqtSignal(object, list, list, list)
-    ees_removing = Qt.pyqtSignal(object, list, list)
-    ees_removed = Qt.pyqtSignal(object, list, list)
+    ees_changed = Qt.pyqtSignal(object, object, list)
+    ees_inserting = Qt.pyqtSignal(object, object, object)
+    ees_inserted = Qt.pyqtSignal(object, object, object)
+    ees_replaced = Qt.pyqtSignal(object, object, object, object)
+    ees_removing = Qt.pyqtSignal(object, object, object)
+    ees_removed = Qt.pyqtSignal(object, object, object)
 
     def __init__(self, element, element_instance_count=1, element_element_property_name=None):
         super().__init__()
@@ -283,15 +275,9 @@ class _ElementInstNode(Qt.QObject):
     def _on_property_changed(self, ee):
         sl = self.e.signaling_list
         assert ee in sl
-        next_idx = 0
         eeic = self.eeics[ee]
         assert eeic > 0
-        idxs = []
-        for _ in range(eeic):
-            idx = sl.index(ee, next_idx)
-            next_idx = idx + 1
-            idxs.append(idx)
-        self.ees_changed.emit(self, ee, idxs)
+        self.ees_changed.emit(self, ee, sl.positions(ee, eeic))
 
     def _on_inserting(self, idx, ees):
         self.ees_inserting.emit(self, idx, ees)
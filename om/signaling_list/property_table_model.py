@@ -35,7 +35,8 @@ class PropertyTableModel(Qt.QAbstractTableModel):
     will connect to it and cause all associated views to update the appropriate cells when the that
     _changed signal is emitted.
 
-    Duplicate elements are fully supported.
+    Duplicate elements are fully supported.  The rows of an element whose property changed are found with
+    SignalingList.positions(..), which scans the list unless its positions_indexed is True.
 
     Additionally, "properties" may be plain attributes, with the limitation that changes to plain
     attributes will not be detected.
@@ -206,6 +207,12 @@ class PropertyTableModel(Qt.QAbstractTableModel):
                         self._signaling_list.replaced.disconnect(self._on_replaced)
                         self._signaling_list.removing.disconnect(self._on_removing)
                         self._signaling_list.removed.disconnect(self._on_removed)
+                        self._signaling_list.moving.disconnect(self._on_moving)
+                        self._signaling_list.moved.disconnect(self._on_moved)
+                        self._signaling_list.permuting.disconnect(self._on_permuting)
+                        self._signaling_list.permuted.disconnect(self._on_permuted)
+                        self._signaling_list.resetting.disconnect(self._on_resetting)
+                        self._signaling_list.reset.disconnect(self._on_reset)
                         self._detach_elements(self._signaling_list)
                     assert len(self._instance_counts) == 0
                     self._signaling_list = v
@@ -215,6 +222,12 @@ class PropertyTableModel(Qt.QAbstractTableModel):
                         v.replaced.connect(self._on_replaced)
                         v.removing.connect(self._on_removing)
                         v.removed.connect(self._on_removed)
+                        v.moving.connect(self._on_moving)
+                        v.moved.connect(self._on_moved)
+                        v.permuting.connect(self._on_permuting)
+                        v.permuted.connect(self._on_permuted)
+                        v.resetting.connect(self._on_resetting)
+                        v.reset.connect(self._on_reset)
                         self._attach_elements(v)
                 finally:
                     self.endResetModel()
@@ -249,31 +262,65 @@ class PropertyTableModel(Qt.QAbstractTableModel):
 
     def _on_property_changed(self, element, property_name):
         column = self.property_columns[property_name]
-        signaling_list = self.signaling_list
-        next_idx = 0
         instance_count = self._instance_counts[element]
         assert instance_count > 0
-        for _ in range(instance_count):
-            row = signaling_list.index(element, next_idx)
-            next_idx = row + 1
+        for row in self.signaling_list.positions(element, instance_count):
             self.dataChanged.emit(self.createIndex(row, column), self.createIndex(row, column))
 
-    def _on_inserting(self, idx, elements):
-        self.beginInsertRows(Qt.QModelIndex(), idx, idx+len(elements)-1)
+    def _on_inserting(self, idxs, elements):
+        self.beginInsertRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
 
-    def _on_inserted(self, idx, elements):
+    def _on_inserted(self, idxs, elements):
         self.endInsertRows()
         self._attach_elements(elements)
-        self.dataChanged.emit(self.createIndex(idx, 0), self.createIndex(idx + len(elements) - 1, len(self.property_names) - 1))
+        self.dataChanged.emit(self.createIndex(idxs.start, 0), self.createIndex(idxs.stop - 1, len(self.property_names) - 1))
 
     def _on_replaced(self, idxs, replaced_elements, elements):
         self._detach_elements(replaced_elements)
         self._attach_elements(elements)
-        self.dataChanged.emit(self.createIndex(min(idxs), 0), self.createIndex(max(idxs), len(self.property_names) - 1))
+        self.dataChanged.emit(self.createIndex(idxs.start, 0), self.createIndex(idxs[-1], len(self.property_names) - 1))
 
     def _on_removing(self, idxs, elements):
-        self.beginRemoveRows(Qt.QModelIndex(), min(idxs), max(idxs))
+        if idxs.step == 1:
+            self.beginRemoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
+        else:
+            # Rows removed from a strided slice are not one span of rows
+            self.beginResetModel()
 
     def _on_removed(self, idxs, elements):
-        self.endRemoveRows()
-        self._detach_elements(elements)
+        if idxs.step == 1:
+            self.endRemoveRows()
+            self._detach_elements(elements)
+        else:
+            self._detach_elements(elements)
+            self.endResetModel()
+
+    def _on_moving(self, idxs, dest):
+        self.beginMoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1, Qt.QModelIndex(), dest)
+
+    def _on_moved(self, idxs, dest):
+        self.endMoveRows()
+
+    def _on_permuting(self, idxs, sources):
+        self.layoutAboutToBeChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_permuted(self, idxs, sources):
+        midxs = self.persistentIndexList()
+        if midxs:
+            # Persistent indexes (selections, the current index, etc) of rearranged rows follow the rows
+            start, stop = idxs.start, idxs.stop
+            rows = [0] * len(sources)
+            for row, source in enumerate(sources, start):
+                rows[source - start] = row
+            self.changePersistentIndexList(midxs, [
+                self.createIndex(rows[midx.row() - start], midx.column()) if start <= midx.row() < stop else midx
+                for midx in midxs])
+        self.layoutChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_resetting(self, idxs, replaced_elements, elements):
+        self.beginResetModel()
+
+    def _on_reset(self, idxs, replaced_elements, elements):
+        self._detach_elements(replaced_elements)
+        self._attach_elements(elements)
+        self.endResetModel()
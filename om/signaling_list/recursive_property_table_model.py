@@ -50,7 +50,8 @@ class RecursivePropertyTableModel(Qt.QAbstractTableModel):
     RecursivePropertyTableModel will connect to each element's a_changed, a.b_changed, and
     a.b.c_changed signals only once.
 
-    Duplicate .signaling_list elements are fully supported, as are signaling list elements entirely
+    Duplicate .signaling_list elements are fully supported (the rows of an element whose property changed are found
+    with SignalingList.positions(..), which scans the list unless its positions_indexed is True), as are signaling list elements entirely
     lacking a property at any depth (EG, if there is a column "foo" and
     hasattr(model.signaling_list[0], "foo") returns false, row zero's "foo" cell will be empty.
 
@@ -77,6 +78,7 @@ class RecursivePropertyTableModel(Qt.QAbstractTableModel):
         for pn in property_names:
             self._rec_init_descr_tree(self._property_descr_tree_root, pn.split('.'))
         self._property_inst_tree_root = PropertyInstTreeRootNode()
+        self._attaching_elements = False
         self.signaling_list = signaling_list
 
     def _rec_init_descr_tree(self, parent, path):
@@ -176,6 +178,12 @@ class RecursivePropertyTableModel(Qt.QAbstractTableModel):
                         self._signaling_list.replaced.disconnect(self._on_replaced)
                         self._signaling_list.removing.disconnect(self._on_removing)
                         self._signaling_list.removed.disconnect(self._on_removed)
+                        self._signaling_list.moving.disconnect(self._on_moving)
+                        self._signaling_list.moved.disconnect(self._on_moved)
+                        self._signaling_list.permuting.disconnect(self._on_permuting)
+                        self._signaling_list.permuted.disconnect(self._on_permuted)
+                        self._signaling_list.resetting.disconnect(self._on_resetting)
+                        self._signaling_list.reset.disconnect(self._on_reset)
                         self._detach_elements(self._signaling_list)
                     assert len(self._property_inst_tree_root.children) == 0
                     self._signaling_list = v
@@ -185,42 +193,92 @@ class RecursivePropertyTableModel(Qt.QAbstractTableModel):
                         v.replaced.connect(self._on_replaced)
                         v.removing.connect(self._on_removing)
                         v.removed.connect(self._on_removed)
+                        v.moving.connect(self._on_moving)
+                        v.moved.connect(self._on_moved)
+                        v.permuting.connect(self._on_permuting)
+                        v.permuted.connect(self._on_permuted)
+                        v.resetting.connect(self._on_resetting)
+                        v.reset.connect(self._on_reset)
                         self._attach_elements(v)
                 finally:
                     self.endResetModel()
 
     def _attach_elements(self, elements):
         property_inst_tree_root = self._property_inst_tree_root
-        for element in elements:
-            try:
-                element_inst_node = property_inst_tree_root.children[element]
-            except KeyError:
-                element_inst_node = PropertyInstTreeElementNode(property_inst_tree_root, element, self._property_descr_tree_root)
-            element_inst_node.attach()
+        # The rows of elements are refreshed as a whole by the caller (by endInsertRows, endResetModel, or a dataChanged
+        # spanning them), so their cells are not signaled one at a time as they are attached
+        self._attaching_elements = True
+        try:
+            for element in elements:
+                try:
+                    element_inst_node = property_inst_tree_root.children[element]
+                except KeyError:
+                    element_inst_node = PropertyInstTreeElementNode(property_inst_tree_root, element, self._property_descr_tree_root)
+                element_inst_node.attach()
+        finally:
+            self._attaching_elements = False
 
     def _detach_elements(self, elements):
         for element in elements:
             element_inst_node = self._property_inst_tree_root.children[element]
             element_inst_node.detach()
 
-    def _on_inserting(self, idx, elements):
-        self.beginInsertRows(Qt.QModelIndex(), idx, idx+len(elements)-1)
+    def _on_inserting(self, idxs, elements):
+        self.beginInsertRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
 
-    def _on_inserted(self, idx, elements):
+    def _on_inserted(self, idxs, elements):
         self.endInsertRows()
         self._attach_elements(elements)
 
     def _on_replaced(self, idxs, replaced_elements, elements):
         self._detach_elements(replaced_elements)
         self._attach_elements(elements)
-        self.dataChanged.emit(self.createIndex(min(idxs), 0), self.createIndex(max(idxs), len(self.property_names) - 1))
+        self.dataChanged.emit(self.createIndex(idxs.start, 0), self.createIndex(idxs[-1], len(self.property_names) - 1))
 
     def _on_removing(self, idxs, elements):
-        self.beginRemoveRows(Qt.QModelIndex(), min(idxs), max(idxs))
+        if idxs.step == 1:
+            self.beginRemoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1)
+        else:
+            # Rows removed from a strided slice are not one span of rows
+            self.beginResetModel()
 
     def _on_removed(self, idxs, elements):
-        self.endRemoveRows()
-        self._detach_elements(elements)
+        if idxs.step == 1:
+            self.endRemoveRows()
+            self._detach_elements(elements)
+        else:
+            self._detach_elements(elements)
+            self.endResetModel()
+
+    def _on_moving(self, idxs, dest):
+        self.beginMoveRows(Qt.QModelIndex(), idxs.start, idxs.stop - 1, Qt.QModelIndex(), dest)
+
+    def _on_moved(self, idxs, dest):
+        self.endMoveRows()
+
+    def _on_permuting(self, idxs, sources):
+        self.layoutAboutToBeChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_permuted(self, idxs, sources):
+        midxs = self.persistentIndexList()
+        if midxs:
+            # Persistent indexes (selections, the current index, etc) of rearranged rows follow the rows
+            start, stop = idxs.start, idxs.stop
+            rows = [0] * len(sources)
+            for row, source in enumerate(sources, start):
+                rows[source - start] = row
+            self.changePersistentIndexList(midxs, [
+                self.createIndex(rows[midx.row() - start], midx.column()) if start <= midx.row() < stop else midx
+                for midx in midxs])
+        self.layoutChanged.emit([], Qt.QAbstractItemModel.VerticalSortHint)
+
+    def _on_resetting(self, idxs, replaced_elements, elements):
+        self.beginResetModel()
+
+    def _on_reset(self, idxs, replaced_elements, elements):
+        self._detach_elements(replaced_elements)
+        self._attach_elements(elements)
+        self.endResetModel()
 
     if __debug__:
         def _show_desc_graph(self):
@@ -440,15 +498,7 @@ class PropertyInstTreeElementNode(PropertyInstTreeBaseNode):
         instance_count = self.instance_count
         assert instance_count > 0
         model = self.desc_tree_node.model
-        signaling_list = model.signaling_list
-        element = self.value
-        next_idx = 0
-        idxs = []
-        for _ in range(instance_count):
-            row = signaling_list.index(element, next_idx)
-            next_idx = row + 1
-            idxs.append(str(row))
-        return ', '.join(idxs)
+        return ', '.join(str(row) for row in model.signaling_list.positions(self.value, instance_count))
 
 # "Named" in PropertyInstTreeNamedNode indicates an instance represents a
 # RecursivePropertyTableModel.signaling_list[n].named.property.component.
@@ -456,15 +506,13 @@ class PropertyInstTreeNamedNode(PropertyInstTreeBaseNode):
     def on_seen_value_changed(self):
         dtn = self.desc_tree_node
         model = dtn.model
+        if model._attaching_elements:
+            return
         column = model.property_columns[dtn.full_name]
         iten = self.inst_tree_element_node
-        element = iten.value
-        signaling_list = model.signaling_list
-        next_idx = 0
-        instance_count = iten.instance_count
-        for _ in range(min(instance_count, 1)): # In the case where instance count is zero
-            row = signaling_list.index(element, next_idx)
-            next_idx = row + 1
+        if iten.instance_count == 0:
+            return
+        for row in model.signaling_list.positions(iten.value, iten.instance_count):
             model.dataChanged.emit(model.createIndex(row, column), model.createIndex(row, column))
 
 class PropertyInstTreeIntermediatePropNode(PropertyInstTreeNamedNode):
@@ -23,49 +23,104 @@
 # Authors: Erik Hvatum <ice.rikh@gmail.com>
 
 from abc import ABCMeta
-from collections.abc import MutableSequence
+import bisect
+from collections.abc import MutableSequence, Sequence
+import contextlib
+import math
 from PyQt5 import Qt
 import textwrap
 
 class _QtAbcMeta(type(Qt.QObject), ABCMeta):
     pass
 
+class ElementsView(Sequence):
+    '''A read-only sequence of the elements of a list at the indexes of a range, read from the list as they are
+    accessed rather than copied out of it.'''
+    __slots__ = ('list', 'range')
+    def __init__(self, list, range):
+        self.list = list
+        self.range = range
+
+    def __len__(self):
+        return len(self.range)
+
+    def __getitem__(self, idx_or_slice):
+        if isinstance(idx_or_slice, slice):
+            return ElementsView(self.list, self.range[idx_or_slice])
+        return self.list[self.range[idx_or_slice]]
+
+    def __iter__(self):
+        r = self.range
+        return iter(self.list[r.start:r.stop if r.stop >= 0 else None:r.step])
+
+    def __repr__(self):
+        return 'ElementsView({!r})'.format(list(self))
+
 class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
     """
     SignalingList: a list-like container representing a collection of objects that
     emits change signals when one or more elements is inserted, removed, or replaced.
 
     Pre-change signals:
-    * inserting(index where objects will be inserted, the objects that will be inserted)
+    * inserting(indexes the objects will have, the objects that will be inserted)
     * removing(indexes of objects to be removed, the objects that will be removed)
     * replacing(indexes of the objects to be replaced, the objects that will be replaced, the objects that will replace them)
 
     Post-change signals:
-    * inserted(index of first inserted object, the objects inserted)
+    * inserted(indexes of the inserted objects, the objects inserted)
     * removed(former indexes of removed objects, the objects removed)
     * replaced(indexes of the replaced objects, the objects that were replaced, the objects that replaced them)
 
+    Rearrangement signals, emitted by move(..) and sort(..), which neither insert nor remove objects:
+    * moving(indexes of the objects to be moved, index of the object before which they will be moved)
+    * moved(former indexes of the moved objects, former index of the object before which they were moved)
+    * permuting(indexes of the objects to be rearranged, for each of those indexes the index of the object that will be at it)
+    * permuted(indexes of the rearranged objects, for each of those indexes the former index of the object now at it)
+
+    Reset signals, emitted in place of the above for large batches of changes (see batch(..)):
+    * resetting(indexes of the objects to be replaced, the objects that will be replaced, the objects that will replace them)
+    * reset(former indexes of the replaced objects, the objects that were replaced, the objects that replaced them)
+
+    Indexes are signaled as ascending ranges, of step 1 except for the removal or replacement of a strided slice,
+    and objects as sequences (not necessarily lists) in the order of the indexes.  The objects are valid only while
+    the signal is handled, and should be copied with list(..) if they are to be kept.  A reset replaces the objects
+    at the indexes with the objects that replace them, which may be fewer or more.
+
     The pre-change signals are handy for things like virtual table views that must know of certain changes
     before they occur in order to maintain a consistent state.
 
     No signals are emitted for objects with indexes that change as a result of inserting or removing
     a preceeding object."""
 
-    inserting = Qt.pyqtSignal(int, list)
-    removing = Qt.pyqtSignal(list, list)
-    replacing = Qt.pyqtSignal(list, list, list)
+    inserting = Qt.pyqtSignal(object, object)
+    removing = Qt.pyqtSignal(object, object)
+    replacing = Qt.pyqtSignal(object, object, object)
 
-    inserted = Qt.pyqtSignal(int, list)
-    removed = Qt.pyqtSignal(list, list)
-    replaced = Qt.pyqtSignal(list, list, list)
+    inserted = Qt.pyqtSignal(object, object)
+    removed = Qt.pyqtSignal(object, object)
+    replaced = Qt.pyqtSignal(object, object, object)
 
-    def __init__(self, iterable=None, parent=None):
+    moving = Qt.pyqtSignal(object, int)
+    moved = Qt.pyqtSignal(object, int)
+    permuting = Qt.pyqtSignal(object, object)
+    permuted = Qt.pyqtSignal(object, object)
+
+    resetting = Qt.pyqtSignal(object, object, object)
+    reset = Qt.pyqtSignal(object, object, object)
+
+    # A batch whose changed span holds more than this fraction of the list's elements is signaled as a reset
+    batch_reset_fraction = 0.5
+
+    def __init__(self, iterable=None, parent=None, positions_indexed=False):
         Qt.QObject.__init__(self, parent)
         self.objectNameChanged.connect(self._on_objectNameChanged)
         if iterable is None:
             self._list = list()
         else:
             self._list = list(iterable)
+        self._batch = None
+        self._positions = None
+        self.positions_indexed = positions_indexed
 
     name_changed = Qt.pyqtSignal(object)
     def _on_objectNameChanged(self):
@@ -103,18 +158,58 @@ class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
 
     def clear(self):
         'S.clear() -> None -- remove all items from S'
-        idxs = list(range(0, len(self._list)))
-        objs = list(self._list)
-        self.removing.emit(idxs, objs)
-        del self._list[:]
-        self.removed.emit(idxs, objs)
+        del self[:]
+
+    @property
+    def positions_indexed(self):
+        """If True, the positions of the list's elements are indexed by element identity, so that positions(..),
+        index(..) and the in operator take time proportional to the number of times an element is in the list rather
+        than to the list's length, at the cost of a dict entry per distinct element and some upkeep for each change.
+        index(..) and the in operator then find elements by identity alone, rather than by identity or equality as a
+        list does."""
+        return self._positions is not None
+
+    @positions_indexed.setter
+    def positions_indexed(self, v):
+        if v:
+            if self._positions is None:
+                self._positions = _PositionIndex(self._list)
+        else:
+            self._positions = None
+
+    def positions(self, obj, count=None):
+        """Returns the ascending list of the indexes at which obj (it, not something equal to it) is found.  If the
+        number of times obj is in the list is known, passing it as count saves scanning the rest of the list once
+        they have been found when positions are not indexed."""
+        if self._positions is not None:
+            return list(self._positions.positions(obj))
+        positions = []
+        idx = -1
+        try:
+            while count is None or len(positions) < count:
+                # list.index(..) scans for something equal to obj, which obj may not be
+                idx = self._list.index(obj, idx + 1)
+                if self._list[idx] is obj:
+                    positions.append(idx)
+        except ValueError:
+            pass
+        return positions
 
     def __contains__(self, obj):
+        if self._positions is not None:
+            return obj in self._positions
         return obj in self._list
 
     def index(self, value, *va):
         """L.index(value, [start, [stop]]) -> integer -- return first index of value.
         Raises ValueError if the value is not present."""
+        if self._positions is not None:
+            start, stop, _ = slice(va[0] if va else None, va[1] if len(va) > 1 else None).indices(len(self._list))
+            positions = self._positions.positions(value)
+            i = bisect.bisect_left(positions, start)
+            if i < len(positions) and positions[i] < stop:
+                return positions[i]
+            raise ValueError('{!r} is not in list'.format(value))
         return self._list.index(value, *va)
 
     def __len__(self):
@@ -128,9 +223,8 @@ class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
         As with list in Python 3.4.3, trimming of strided slices and replacement of strided slices with simultaneous
         insertion are not supported."""
         if isinstance(idx_or_slice, slice):
-            dest_range_tuple = idx_or_slice.indices(len(self._list))
-            dest_idxs = list(range(*dest_range_tuple))
-            if dest_range_tuple[2] == 1:
+            dest_range = range(*idx_or_slice.indices(len(self._list)))
+            if dest_range.step == 1:
                 # With stride size of one:
                 # * An equal number of sources and destinations results in each destination being replaced by the corresponding source.
                 # * An excess of sources as compared to destinations results in replacement of specified destinations with corresponding
@@ -140,46 +234,32 @@ class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
                 #   replaced, with excess destinations being deleted.  If the sources iterable is empty, all specified destinations
                 #   are deleted, making "S[0:10] = S[0:0]" equivalent to "del S[0:10]".
                 srcs_len = len(srcs)
-                dests_len = len(dest_idxs)
+                dests_len = len(dest_range)
                 common_len = min(srcs_len, dests_len)
                 srcs_surplus_len = srcs_len - dests_len
                 if common_len > 0:
-                    replace_slice = slice(dest_idxs[0], dest_idxs[0]+common_len)
-                    replaceds = self._list[replace_slice]
-                    replacements = srcs[:common_len]
-                    self.replacing.emit(dest_idxs[:common_len], replaceds, replacements)
-                    self._list[replace_slice] = srcs[:common_len]
-                    self.replaced.emit(dest_idxs[:common_len], replaceds, replacements)
+                    self._replace(dest_range[:common_len], srcs[:common_len])
                 if srcs_surplus_len > 0:
-                    inserts = srcs[common_len:]
-                    idx = dest_range_tuple[0] + common_len
-                    self.inserting.emit(idx, inserts)
-                    self._list[idx:idx] = inserts
-                    self.inserted.emit(idx, inserts)
+                    self._insert(dest_range.start + common_len, srcs[common_len:])
                 elif srcs_surplus_len < 0:
-                    remove_slice = slice(dest_idxs[common_len], dest_idxs[-1] + 1)
-                    self.__delitem__(remove_slice)
+                    self._remove(dest_range[common_len:])
             else:
                 # Only 1-1 replacement is supported with stride other than one
-                if len(dest_idxs) != len(srcs):
-                    raise ValueError('attempt to assign sequence of size {} to extended slice of size {}'.format(len(srcs), len(idxs)))
-                replaceds = self._list[idx_or_slice]
-                self.replacing.emit(dest_idxs, replaceds, srcs)
-                self._list[idx_or_slice] = srcs
-                self.replaced.emit(dest_idxs, replaceds, srcs)
+                if len(dest_range) != len(srcs):
+                    raise ValueError('attempt to assign sequence of size {} to extended slice of size {}'.format(len(srcs), len(dest_range)))
+                if dest_range:
+                    if dest_range.step < 0:
+                        # Signaled ranges ascend
+                        dest_range, srcs = dest_range[::-1], srcs[::-1]
+                    self._replace(dest_range, list(srcs))
         else:
-            idx = idx_or_slice if idx_or_slice >= 0 else len(self._list) + idx_or_slice
-            replaceds = [self._list[idx]]
-            self._list[idx] = srcs
-            self.replaced.emit([idx], replaceds, [srcs])
+            self._replace(self._index_range(idx_or_slice), [srcs])
 
     def extend(self, srcs):
         'S.extend(iterable) -- extend sequence by appending elements from the iterable'
-        idx = len(self._list)
         srcs = list(srcs)
-        self.inserting.emit(idx, srcs)
-        self._list.extend(srcs)
-        self.inserted.emit(idx, srcs)
+        if srcs:
+            self._insert(len(self._list), srcs)
 
     def insert(self, idx, obj):
         'S.insert(index, value) -- insert value before index'
@@ -189,26 +269,213 @@ class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
             idx = 0
         elif idx > len(self._list):
             idx = len(self._list)
-        objs = [obj]
-        self.inserting.emit(idx, objs)
-        self._list.insert(idx, obj)
-        self.inserted.emit(idx, objs)
+        self._insert(idx, [obj])
 
     def sort(self, key=None, reverse=False):
-        self[:] = sorted(self._list, key=key, reverse=reverse)
+        """Sorts the list in place, stably, as list.sort(..) does, signaling the rearrangement with permuting/permuted."""
+        keys = self._list if key is None else list(map(key, self._list))
+        # Sorting the indexes of the elements by the elements' keys gives the former index of each element in sorted order
+        order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        if order != list(range(len(order))):
+            self._permute(range(len(order)), order)
+
+    def move(self, idxs, dest):
+        """Moves the elements at idxs (a slice, or a sequence of distinct indexes) to before the element at dest (or to
+        the end, if dest is len(self)), in the order of idxs, without removing or inserting them.  Moving one run of
+        ascending indexes is signaled with moving/moved, and anything else with permuting/permuted."""
+        n = len(self._list)
+        if isinstance(idxs, slice):
+            idxs = range(*idxs.indices(n))
+        else:
+            idxs = [idx if idx >= 0 else idx + n for idx in idxs]
+            if any(not 0 <= idx < n for idx in idxs):
+                raise IndexError('list index out of range')
+            if len(set(idxs)) != len(idxs):
+                raise ValueError('idxs contains at least one duplicate.')
+        if not idxs:
+            return
+        if dest < 0:
+            dest = max(dest + n, 0)
+        elif dest > n:
+            dest = n
+        first, last = idxs[0], idxs[-1]
+        if last - first + 1 == len(idxs) and all(idx == first + i for i, idx in enumerate(idxs)):
+            if first <= dest <= last + 1:
+                # Already there
+                return
+            moved = range(first, last + 1)
+            span = range(dest, last + 1) if dest < first else range(first, dest)
+            if self._batch is None:
+                self.moving.emit(moved, dest)
+            lst = self._list
+            replaceds = lst[span.start:span.stop] if self._positions is not None else None
+            if dest < first:
+                lst[span.start:span.stop] = lst[first:last+1] + lst[dest:first]
+            else:
+                lst[span.start:span.stop] = lst[last+1:dest] + lst[first:last+1]
+            self._rearranged(span, replaceds)
+            if self._batch is None:
+                self.moved.emit(moved, dest)
+        else:
+            moving = set(idxs)
+            span = range(min(min(idxs), dest), max(max(idxs) + 1, dest))
+            staying = [idx for idx in span if idx not in moving]
+            split = bisect.bisect_left(staying, dest)
+            self._permute(span, staying[:split] + list(idxs) + staying[split:])
+
+    def _permute(self, idxs, sources):
+        if self._batch is None:
+            self.permuting.emit(idxs, sources)
+        lst = self._list
+        replaceds = lst[idxs.start:idxs.stop] if self._positions is not None else None
+        lst[idxs.start:idxs.stop] = map(lst.__getitem__, sources)
+        self._rearranged(idxs, replaceds)
+        if self._batch is None:
+            self.permuted.emit(idxs, sources)
+
+    def _rearranged(self, idxs, replaceds):
+        if self._positions is not None:
+            if len(idxs) == len(self._list):
+                self._positions.rebuild(self._list)
+            else:
+                self._positions.replace(idxs, replaceds, ElementsView(self._list, idxs))
+        if self._batch is not None:
+            self._batch.record(idxs.start, idxs.stop, len(self._list))
 
     def __delitem__(self, idx_or_slice):
-        objs = self._list[idx_or_slice]
         if isinstance(idx_or_slice, slice):
-            if not objs:
+            idxs = range(*idx_or_slice.indices(len(self._list)))
+            if not idxs:
                 return
-            idxs = list(range(*idx_or_slice.indices(len(self._list))))
+            if idxs.step < 0:
+                idxs = idxs[::-1]
+        else:
+            idxs = self._index_range(idx_or_slice)
+        self._remove(idxs)
+
+    def _index_range(self, idx):
+        """The range of the one element idx, which may be negative."""
+        n = len(self._list)
+        if not -n <= idx < n:
+            raise IndexError('list index out of range')
+        idx %= n
+        return range(idx, idx + 1)
+
+    # The following make every change to the list, signaling it with ascending ranges of the indexes changed.
+    # Objects that will be removed or replaced are signaled as an ElementsView of the list, and objects removed or
+    # replaced as a list of them (or, where they are all of the elements of the list, an ElementsView of the list
+    # they were), so that a change is signaled without copying anything but what the change itself removes.
+
+    def _insert(self, idx, objs):
+        idxs = range(idx, idx + len(objs))
+        if self._batch is None:
+            self.inserting.emit(idxs, objs)
+        self._list[idx:idx] = objs
+        if self._positions is not None:
+            self._positions.insert(idxs, objs, self._list)
+        if self._batch is None:
+            self.inserted.emit(idxs, objs)
         else:
-            idxs = [idx_or_slice]
-            objs = [objs]
-        self.removing.emit(idxs, objs)
-        del self._list[idx_or_slice]
-        self.removed.emit(idxs, objs)
+            self._batch.record(idxs.start, idxs.stop, len(self._list))
+
+    def _remove(self, idxs):
+        key = slice(idxs.start, idxs.stop, idxs.step)
+        if self._batch is None:
+            self.removing.emit(idxs, ElementsView(self._list, idxs))
+        if len(idxs) == len(self._list):
+            objs = ElementsView(self._list, idxs)
+            self._list = []
+            if self._positions is not None:
+                self._positions.rebuild(self._list)
+        else:
+            objs = self._list[key] if self._batch is None or self._positions is not None else None
+            del self._list[key]
+            if self._positions is not None:
+                self._positions.remove(idxs, objs, self._list)
+        if self._batch is None:
+            self.removed.emit(idxs, objs)
+        else:
+            # The elements following the last removed one are untouched, but have moved up by the number removed
+            self._batch.record(idxs.start, idxs[-1] + 1 - len(idxs), len(self._list))
+
+    def _replace(self, idxs, replacements):
+        key = slice(idxs.start, idxs.stop, idxs.step)
+        if self._batch is None:
+            self.replacing.emit(idxs, ElementsView(self._list, idxs), replacements)
+        if len(idxs) == len(self._list):
+            replaceds = ElementsView(self._list, idxs)
+            self._list = list(replacements)
+            if self._positions is not None:
+                self._positions.rebuild(self._list)
+        else:
+            replaceds = self._list[key] if self._batch is None or self._positions is not None else None
+            self._list[key] = replacements
+            if self._positions is not None:
+                self._positions.replace(idxs, replaceds, replacements)
+        if self._batch is None:
+            self.replaced.emit(idxs, replaceds, replacements)
+        else:
+            self._batch.record(idxs.start, idxs[-1] + 1, len(self._list))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Returns a context manager within which changes to the list take effect immediately, but signal nothing until
+        the outermost batch exits, when the span of the list changed by all of them together is signaled at once.  For
+        example, appending rows one at a time within a batch signals one insertion of all of them:
+
+        with sl.batch():
+            for thing in things:
+                sl.append(thing)
+
+        The changed span, from the first element changed to the last, is signaled as the replacement of the elements
+        it held with those it holds (replacing/replaced, and inserting/inserted or removing/removed for any surplus),
+        or, if it holds more than batch_reset_fraction of the list's elements before or after the batch, as a reset
+        (resetting/reset).  Views of the list do not see the changes until then, so the event loop should not be run
+        within a batch."""
+        if self._batch is not None:
+            self._batch.depth += 1
+        else:
+            self._batch = _Batch(self._list)
+        try:
+            yield self
+        finally:
+            batch = self._batch
+            batch.depth -= 1
+            if batch.depth == 0:
+                self._batch = None
+                self._signal_batch(batch)
+
+    def _signal_batch(self, batch):
+        if batch.start is None:
+            return
+        old, new = batch.old, self._list
+        old_stop, new_stop = len(old) - batch.tail, len(new) - batch.tail
+        replaced_idxs = range(batch.start, old_stop)
+        replacements = ElementsView(new, range(batch.start, new_stop))
+        if not replaced_idxs and not replacements:
+            return
+        if max(len(replaced_idxs), len(replacements)) > self.batch_reset_fraction * max(len(old), len(new)):
+            replaceds = ElementsView(old, replaced_idxs)
+            # The list is put back as it was for the pre-change signal, without the position index, which is of the
+            # list as it is
+            self._list = old
+            positions, self._positions = self._positions, None
+            try:
+                self.resetting.emit(replaced_idxs, replaceds, replacements)
+            finally:
+                self._list = new
+                self._positions = positions
+            self.reset.emit(replaced_idxs, replaceds, replacements)
+        else:
+            # Redoing the change as one slice assignment to the list as it was signals it.  SignalingList's own
+            # __setitem__ is used because a subclass's may transform elements, which have been already, and the
+            # position index, which is up to date already, is set aside meanwhile.
+            self._list = old
+            positions, self._positions = self._positions, None
+            try:
+                SignalingList.__setitem__(self, slice(batch.start, old_stop), replacements)
+            finally:
+                self._positions = positions
 
     def __eq__(self, other):
         try:
@@ -269,3 +536,109 @@ class SignalingList(Qt.QObject, MutableSequence, metaclass=_QtAbcMeta):
                         raise RuntimeError('{}.insert({}, {}):\n{} !=\n{}'.format(ol, b, stuff, sl._list, l))
                     if verbose:
                         print('* {}.insert({}, {})'.format(ol, b, stuff))
+
+class _Batch:
+    '''The state of a SignalingList.batch(): the list as it was, and the span of it that has changed since, bounded by
+    start, the number of elements preceding the first changed, and tail, the number following the last changed.'''
+    __slots__ = ('depth', 'old', 'start', 'tail')
+    def __init__(self, old):
+        self.depth = 1
+        self.old = list(old)
+        self.start = None
+        self.tail = len(old)
+
+    def record(self, start, stop, length):
+        """Records a change to the elements that are now start through stop-1 of a list now of length elements."""
+        if self.start is None or start < self.start:
+            self.start = start
+        if length - stop < self.tail:
+            self.tail = length - stop
+
+class _PositionIndex:
+    '''The positions of the elements of a SignalingList, keyed by element identity.  Inserting or removing elements
+    shifts the positions of all that follow, so rather than updating them all, each such shift is logged, and the
+    positions of an element are brought up to date by replaying the shifts logged since they last were when they
+    are next looked up.  The index is rebuilt when the log grows longer than the square root of the list's length,
+    balancing the cost of rebuilding against that of replaying.'''
+    __slots__ = ('entries', 'shifts')
+    MIN_SHIFTS = 64
+
+    def __init__(self, elements):
+        self.rebuild(elements)
+
+    def rebuild(self, elements):
+        # entries[id(element)] is [the number of logged shifts applied to positions, positions]
+        entries = {}
+        for idx, element in enumerate(elements):
+            entry = entries.get(id(element))
+            if entry is None:
+                entries[id(element)] = [0, [idx]]
+            else:
+                entry[1].append(idx)
+        self.entries = entries
+        # (index, delta) pairs, each meaning that the positions at or after index moved by delta
+        self.shifts = []
+
+    def __contains__(self, obj):
+        return id(obj) in self.entries
+
+    def positions(self, obj):
+        entry = self.entries.get(id(obj))
+        if entry is None:
+            return ()
+        return self._current(entry)
+
+    def _current(self, entry):
+        applied, positions = entry
+        if applied < len(self.shifts):
+            for at, delta in self.shifts[applied:]:
+                if positions[-1] >= at:
+                    positions = [p + delta if p >= at else p for p in positions]
+            entry[0] = len(self.shifts)
+            entry[1] = positions
+        return positions
+
+    def _entry(self, obj):
+        entry = self.entries.get(id(obj))
+        if entry is None:
+            entry = self.entries[id(obj)] = [len(self.shifts), []]
+        else:
+            self._current(entry)
+        return entry
+
+    def _log_shifts(self, shifts, elements):
+        if len(self.shifts) + len(shifts) > max(self.MIN_SHIFTS, math.isqrt(len(elements))):
+            self.rebuild(elements)
+            return False
+        self.shifts.extend(shifts)
+        return True
+
+    def insert(self, idxs, objs, elements):
+        """Records the insertion of objs at idxs into what is now elements."""
+        if idxs.stop < len(elements) and not self._log_shifts([(idxs.start, len(idxs))], elements):
+            return
+        for idx, obj in zip(idxs, objs):
+            bisect.insort(self._entry(obj)[1], idx)
+
+    def remove(self, idxs, objs, elements):
+        """Records the removal of objs from idxs, leaving elements."""
+        for idx, obj in zip(idxs, objs):
+            self._discard(obj, idx)
+        if idxs.step == 1:
+            self._log_shifts([(idxs.stop, -len(idxs))], elements)
+        else:
+            # Each removal, from the last index first, leaves the indexes before it as they were
+            self._log_shifts([(idx + 1, -1) for idx in reversed(idxs)], elements)
+
+    def replace(self, idxs, replaceds, replacements):
+        """Records the replacement of replaceds at idxs with replacements."""
+        for idx, replaced, replacement in zip(idxs, replaceds, replacements):
+            self._discard(replaced, idx)
+            bisect.insort(self._entry(replacement)[1], idx)
+
+    def _discard(self, obj, idx):
+        entry = self._entry(obj)
+        positions = entry[1]
+        del positions[bisect.bisect_left(positions, idx)]
+        if not positions:
+            del self.entries[id(obj)]
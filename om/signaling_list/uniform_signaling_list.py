@@ -109,11 +109,11 @@ class UniformSignalingList(SignalingList):
      #
      #   ValueError: could not convert string to float: '?what' '''
 
-    def __init__(self, iterable=None, parent=None):
+    def __init__(self, iterable=None, parent=None, positions_indexed=False):
         if iterable is None:
-            super().__init__(parent=parent)
+            super().__init__(parent=parent, positions_indexed=positions_indexed)
         else:
-            super().__init__(iterable=map(self.take_input_element, iterable), parent=parent)
+            super().__init__(iterable=map(self.take_input_element, iterable), parent=parent, positions_indexed=positions_indexed)
 
     def take_input_element(self, obj):
         raise NotImplementedError()
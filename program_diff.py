@@ -0,0 +1,310 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import bisect
+import collections
+import json
+import sys
+from .cnc_program import CncProgram
+
+# When a stretch of blocks has no block that occurs exactly once in both programs, and more than this many edits would
+# be needed to align it, the stretch is reported as removed and reinserted rather than aligned exactly.  This bounds the
+# worst-case running time of the O((N+M)D) alignment.
+DEFAULT_MAX_COST = 4096
+
+@attr.s
+class ProgramDiff:
+    '''The result of diff_programs(..).  opcodes is a list of (tag, i1, i2, j1, j2) tuples in the style of
+    difflib.SequenceMatcher.get_opcodes(), with tag being one of 'equal', 'delete', 'insert', or 'replace'.  moved is a list
+    of (i, j) pairs, each representing a block removed from position i of a and inserted at position j of b.  Moved
+    blocks are excluded from .removed and .inserted.'''
+    a = attr.ib()
+    b = attr.ib()
+    opcodes = attr.ib()
+    removed = attr.ib()
+    inserted = attr.ib()
+    moved = attr.ib()
+
+    def operations(self):
+        """Returns an ordered dict mapping operation name -> dict with 'removed', 'inserted', and 'moved' lists.  Removed
+        blocks are attributed to their operation in a, inserted blocks to their operation in b, and moved blocks to their
+        operation in b."""
+        a_ops, b_ops = _operation_labels(self.a), _operation_labels(self.b)
+        r = collections.OrderedDict()
+        def get(op):
+            try:
+                return r[op]
+            except KeyError:
+                g = r[op] = {'removed': [], 'inserted': [], 'moved': []}
+                return g
+        for i in self.removed:
+            get(a_ops[i])['removed'].append(i)
+        for j in self.inserted:
+            get(b_ops[j])['inserted'].append(j)
+        for i, j in self.moved:
+            get(b_ops[j])['moved'].append([i, j])
+        return r
+
+    def as_dict(self):
+        return {
+            'counts': {'removed': len(self.removed), 'inserted': len(self.inserted), 'moved': len(self.moved)},
+            'operations': [
+                {'operation': op, 'removed': _ranges(g['removed']), 'inserted': _ranges(g['inserted']), 'moved': g['moved']}
+                for op, g in self.operations().items()]}
+
+    def unified(self, a_name='a', b_name='b', context=3):
+        """Yields the lines of a unified diff of the two programs, without N-numbers.  Moved blocks appear as ordinary
+        removals and insertions."""
+        a_lines = [cmd.mpf_line for cmd in self.a]
+        b_lines = [cmd.mpf_line for cmd in self.b]
+        started = False
+        for group in _group_opcodes(self.opcodes, context):
+            if not started:
+                yield '--- {}'.format(a_name)
+                yield '+++ {}'.format(b_name)
+                started = True
+            i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+            yield '@@ -{},{} +{},{} @@'.format(i1 + 1, i2 - i1, j1 + 1, j2 - j1)
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    for line in a_lines[i1:i2]:
+                        yield ' ' + line
+                    continue
+                for line in a_lines[i1:i2]:
+                    yield '-' + line
+                for line in b_lines[j1:j2]:
+                    yield '+' + line
+
+def diff_programs(a, b, max_cost=DEFAULT_MAX_COST):
+    '''Compares two CncPrograms (or lists of CncCommands) block by block.  N-numbers are ignored, as CncCommand does not
+    retain them.  Each distinct block is interned to an integer, and the block sequences are aligned by first anchoring on
+    blocks that occur exactly once in both (as in patience diff), then aligning the stretches between anchors with
+    Myers' linear-space algorithm.  Like patience diff, the result favors aligning distinctive blocks and is not always
+    a minimal edit script.'''
+    if isinstance(a, CncProgram):
+        a = a.commands
+    if isinstance(b, CncProgram):
+        b = b.commands
+    interned = {}
+    a_ids = [interned.setdefault(cmd.mpf_line, len(interned)) for cmd in a]
+    b_ids = [interned.setdefault(cmd.mpf_line, len(interned)) for cmd in b]
+    opcodes = _opcodes(_matching_blocks(a_ids, b_ids, max_cost), len(a_ids), len(b_ids))
+    removed, inserted = [], []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag in ('delete', 'replace'):
+            removed.extend(range(i1, i2))
+        if tag in ('insert', 'replace'):
+            inserted.extend(range(j1, j2))
+    # Pair blocks removed in one place and inserted elsewhere, first come first served
+    removed_by_id = collections.defaultdict(collections.deque)
+    for i in removed:
+        removed_by_id[a_ids[i]].append(i)
+    moved = []
+    for j in inserted:
+        q = removed_by_id.get(b_ids[j])
+        if q:
+            moved.append((q.popleft(), j))
+    moved_is = {i for i, j in moved}
+    moved_js = {j for i, j in moved}
+    return ProgramDiff(
+        a, b, opcodes,
+        [i for i in removed if i not in moved_is],
+        [j for j in inserted if j not in moved_js],
+        moved)
+
+def _matching_blocks(a, b, max_cost):
+    """Returns a sorted list of (i, j, n) triples, each indicating that a[i:i+n] == b[j:j+n]."""
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        # Common prefix and suffix
+        n = 0
+        while alo + n < ahi and blo + n < bhi and a[alo + n] == b[blo + n]:
+            n += 1
+        if n:
+            matches.append((alo, blo, n))
+            alo += n
+            blo += n
+        n = 0
+        while alo < ahi - n and blo < bhi - n and a[ahi - n - 1] == b[bhi - n - 1]:
+            n += 1
+        if n:
+            ahi -= n
+            bhi -= n
+            matches.append((ahi, bhi, n))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                matches.append((i, j, 1))
+                stack.append((alo, i, blo, j))
+                alo, blo = i + 1, j + 1
+            stack.append((alo, ahi, blo, bhi))
+            continue
+        snake = _middle_snake(a, alo, ahi, b, blo, bhi, max_cost)
+        if snake is None:
+            # Too costly to align; leave the whole stretch unmatched
+            continue
+        x0, y0, x1, y1 = snake
+        if x1 > x0:
+            matches.append((x0, y0, x1 - x0))
+        stack.append((alo, x0, blo, y0))
+        stack.append((x1, ahi, y1, bhi))
+    matches.sort()
+    return matches
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Returns the longest increasing sequence of (i, j) pairs where a[i] == b[j] occurs exactly once in each of
+    a[alo:ahi] and b[blo:bhi]."""
+    counts = collections.Counter(a[alo:ahi])
+    a_unique = {t: i for i, t in enumerate(a[alo:ahi], alo) if counts[t] == 1}
+    counts = collections.Counter(b[blo:bhi])
+    pairs = [(a_unique[t], j) for j, t in enumerate(b[blo:bhi], blo) if counts[t] == 1 and t in a_unique]
+    if not pairs:
+        return pairs
+    pairs.sort()
+    # Patience sorting: longest increasing subsequence of j
+    tails, tail_idxs, prevs = [], [], [None] * len(pairs)
+    for idx, (i, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idxs.append(idx)
+        else:
+            tails[pos] = j
+            tail_idxs[pos] = idx
+        prevs[idx] = tail_idxs[pos - 1] if pos else None
+    r = []
+    idx = tail_idxs[-1]
+    while idx is not None:
+        r.append(pairs[idx])
+        idx = prevs[idx]
+    r.reverse()
+    return r
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, max_cost):
+    """Finds the middle snake of an optimal edit script between a[alo:ahi] and b[blo:bhi], which must differ in both
+    their first and last elements, using the linear-space bidirectional search of Myers (1986).  Returns the snake as
+    (i start, j start, i stop, j stop), or None if the edit distance exceeds 2*max_cost."""
+    N, M = ahi - alo, bhi - blo
+    delta = N - M
+    odd = delta & 1
+    max_d = min((N + M + 1) // 2, max_cost)
+    off = max_d + 1
+    vf = [0] * (2 * off + 1)
+    vb = [0] * (2 * off + 1)
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[off + k - 1] < vf[off + k + 1]):
+                x = vf[off + k + 1]
+            else:
+                x = vf[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < N and y < M and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[off + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1) and x + vb[off + delta - k] >= N:
+                return alo + x0, blo + y0, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[off + k - 1] < vb[off + k + 1]):
+                x = vb[off + k + 1]
+            else:
+                x = vb[off + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < N and y < M and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[off + k] = x
+            if not odd and -d <= delta - k <= d and x + vf[off + delta - k] >= N:
+                return ahi - x, bhi - y, ahi - x0, bhi - y0
+
+def _opcodes(matches, a_len, b_len):
+    opcodes = []
+    i = j = 0
+    for mi, mj, n in matches + [(a_len, b_len, 0)]:
+        if i < mi and j < mj:
+            opcodes.append(('replace', i, mi, j, mj))
+        elif i < mi:
+            opcodes.append(('delete', i, mi, j, mj))
+        elif j < mj:
+            opcodes.append(('insert', i, mi, j, mj))
+        if n:
+            if opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], mi + n, opcodes[-1][3], mj + n)
+            else:
+                opcodes.append(('equal', mi, mi + n, mj, mj + n))
+        i, j = mi + n, mj + n
+    return opcodes
+
+def _group_opcodes(opcodes, context):
+    """Like difflib.SequenceMatcher.get_grouped_opcodes(..)"""
+    group = []
+    last = len(opcodes) - 1
+    for idx, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == 'equal':
+            if idx == 0:
+                i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+                if i1 < i2:
+                    group.append((tag, i1, i2, j1, j2))
+                continue
+            if idx == last:
+                i2, j2 = min(i2, i1 + context), min(j2, j1 + context)
+                if i1 < i2:
+                    group.append((tag, i1, i2, j1, j2))
+                continue
+            if i2 - i1 > 2 * context:
+                group.append((tag, i1, i1 + context, j1, j1 + context))
+                yield group
+                group = []
+                i1, j1 = i2 - context, j2 - context
+            group.append((tag, i1, i2, j1, j2))
+            continue
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def _operation_labels(commands):
+    """Returns a list containing, for each block, the name of the operation it belongs to, taken from the most recent
+    ';Operation : NAME' comment."""
+    labels = []
+    label = '(program start)'
+    for cmd in commands:
+        if not cmd.words and cmd.comment.startswith(';Operation'):
+            label = cmd.comment.partition(':')[2].strip() or label
+        labels.append(label)
+    return labels
+
+def _ranges(idxs):
+    """Compacts a sorted list of integers into a list of [start, stop) pairs."""
+    r = []
+    for idx in idxs:
+        if r and r[-1][1] == idx:
+            r[-1][1] = idx + 1
+        else:
+            r.append([idx, idx + 1])
+    return r
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Structural MPF program diff commandline interface.')
+    parser.add_argument('a', type=str)
+    parser.add_argument('b', type=str)
+    parser.add_argument('--json', action='store_true', help='write the machine-readable form rather than a unified diff')
+    parser.add_argument('--context', type=int, default=3)
+    parser.add_argument('--max-cost', type=int, default=DEFAULT_MAX_COST)
+    args = parser.parse_args()
+    a, b = CncProgram(), CncProgram()
+    a.import_mpf(args.a)
+    b.import_mpf(args.b)
+    d = diff_programs(a, b, args.max_cost)
+    if args.json:
+        json.dump(d.as_dict(), sys.stdout, indent=1)
+        print()
+    else:
+        for line in d.unified(args.a, args.b, args.context):
+            print(line)
@@ -0,0 +1,403 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import numpy
+import re
+from .instrumentation import Instrumentation
+from .program_store import _UPPER, MAX_WORD_LEN, ProgramStore, decimal_values
+
+class PostingLists:
+    '''Lists of ascending (or non-descending) block numbers, compressed into one array of one byte deltas: each
+    element is stored as its difference from the element before it in its list (the first, from 0), and differences
+    of 255 or more as 255 with the difference itself kept among a few exceptions.  A list of blocks a few apart costs
+    about one byte per block, and decoding a list is a few vectorized operations.'''
+    def __init__(self, deltas, exception_positions, exception_values, offsets):
+        self.deltas = deltas
+        self.exception_positions = exception_positions
+        self.exception_values = exception_values
+        # List i is held in deltas[offsets[i]:offsets[i+1]]
+        self.offsets = offsets
+
+    @classmethod
+    def pack(cls, values, offsets):
+        """Packs the lists held in values[offsets[i]:offsets[i+1]] (for int array values and int64 array offsets)."""
+        values = numpy.asarray(values, dtype=numpy.int64)
+        deltas = numpy.empty(len(values), dtype=numpy.int64)
+        if len(values):
+            deltas[0] = values[0]
+            numpy.subtract(values[1:], values[:-1], out=deltas[1:])
+            firsts = offsets[:-1][offsets[:-1] < offsets[1:]]
+            deltas[firsts] = values[firsts]
+        exception_positions = numpy.flatnonzero(deltas >= 255)
+        exception_values = deltas[exception_positions]
+        return cls(numpy.minimum(deltas, 255).astype(numpy.uint8), exception_positions, exception_values,
+                   numpy.asarray(offsets, dtype=numpy.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.lists(idx, idx + 1)
+
+    def lists(self, start, stop):
+        """Returns lists start through stop-1, concatenated."""
+        a, b = self.offsets[start], self.offsets[stop]
+        deltas = self.deltas[a:b].astype(numpy.int64)
+        e0, e1 = numpy.searchsorted(self.exception_positions, (a, b))
+        deltas[self.exception_positions[e0:e1] - a] = self.exception_values[e0:e1]
+        values = numpy.cumsum(deltas)
+        if stop - start > 1:
+            # Restart the running sum at the first element of each list
+            starts = self.offsets[start:stop] - a
+            lengths = numpy.diff(self.offsets[start:stop+1])
+            starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+            before = numpy.concatenate(([0], values[starts[1:] - 1]))
+            values -= numpy.repeat(before, lengths)
+        return values
+
+    @property
+    def nbytes(self):
+        return self.deltas.nbytes + self.exception_positions.nbytes + self.exception_values.nbytes + self.offsets.nbytes
+
+class ProgramIndex:
+    '''An inverted index of the blocks of a program, for finding the blocks matching a query (see search(..)) in
+    milliseconds, without scanning the program's text.
+
+    Each word of a block (as split by ProgramStore.words(..), uppercased) is either an address, with a name and a
+    plain decimal value (a letter followed by the value, as X-1.5 or G0, or a name, '=', and the value, as A3=0.25 or
+    _CAMTOLERANCE=0.002), or a token (any other word, as SUPA, T="CAPS32", or ORIRESET(0,0)).  Tokens are kept in a
+    sorted vocabulary, tokens, with the blocks containing each in token_blocks, a PostingLists.  For each address
+    name, address_blocks[name] (a single PostingLists list) holds the block of each of the name's words, in program
+    order, and address_values[name] the words' values, so that a range of values is found by comparing them at once.
+    Where each of a name's values has at most address_scales[name] decimal places, and the values scaled to integers
+    fit, they are held as int32 multiples of 10**-address_scales[name], and otherwise as float64, with a scale of
+    None.
+
+    ProgramStore.words(..) truncates words to MAX_WORD_LEN bytes, so the few words longer than that are read again
+    from the text of their blocks.  Those that are tokens are kept whole in long_tokens, a dict mapping each to the
+    ascending blocks containing it, rather than in tokens.'''
+    _MAX_SCALE = 9
+
+    def __init__(self, block_count, tokens, token_blocks, address_blocks, address_values, address_scales, long_tokens):
+        self.block_count = block_count
+        self.tokens = tokens
+        self.token_blocks = token_blocks
+        self.long_tokens = long_tokens
+        self.address_blocks = address_blocks
+        self.address_values = address_values
+        self.address_scales = address_scales
+
+    @classmethod
+    def build(cls, store, instrumentation=None, chunk_blocks=100000):
+        """Indexes the blocks of store (a ProgramStore), chunk_blocks at a time."""
+        instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        with instrumentation.stage('ProgramIndex.build', blocks_in=len(store), blocks_out=len(store)) as stage:
+            # Per chunk (vocabulary, ids of the tokens of the postings, blocks of the postings), with postings sorted
+            # by token, then block
+            token_chunks = []
+            address_chunks = {}
+            long_tokens = {}
+            for start in range(0, len(store), chunk_blocks):
+                stage.progress(start / len(store))
+                blocks, words = store.words(start, start + chunk_blocks)
+                words = _UPPER[words.view(numpy.uint8)].view(words.dtype)
+                blocks, words, long_blocks, long_words = _split_long_words(store, blocks, words)
+                long_names, long_values = parse_addresses(long_words)
+                is_long_address = ~numpy.isnan(long_values)
+                for name in numpy.unique(long_names[is_long_address]).tolist():
+                    m = is_long_address & (long_names == name)
+                    address_chunks.setdefault(str(name, 'ascii', 'replace'), []).append((long_blocks[m], long_values[m]))
+                for block, word in zip(long_blocks[~is_long_address].tolist(), long_words[~is_long_address].tolist()):
+                    long_tokens.setdefault(word, []).append(block)
+                names, values = parse_addresses(words)
+                is_address = ~numpy.isnan(values)
+                # Most names are single letters, which are told apart by their first byte alone
+                is_letter = is_address & (numpy.strings.str_len(names) == 1)
+                firsts = names.astype('S1').view(numpy.uint8)
+                groups = [(bytes([letter]), is_letter & (firsts == letter))
+                          for letter in numpy.flatnonzero(numpy.bincount(firsts[is_letter], minlength=256)).tolist()]
+                groups += [(name, is_address & ~is_letter & (names == name))
+                           for name in numpy.unique(names[is_address & ~is_letter]).tolist()]
+                for name, m in groups:
+                    address_chunks.setdefault(str(name, 'ascii', 'replace'), []).append((blocks[m], values[m]))
+                is_token = ~is_address
+                vocabulary, ids = numpy.unique(words[is_token], return_inverse=True)
+                # Each token is posted once per block containing it
+                keys = numpy.unique(ids.ravel() * numpy.int64(chunk_blocks) + (blocks[is_token] - start))
+                token_chunks.append((vocabulary, keys // chunk_blocks, keys % chunk_blocks + start))
+                stage.checkpoint()
+            if token_chunks:
+                tokens = numpy.unique(numpy.concatenate([vocabulary for vocabulary, ids, blocks in token_chunks]))
+            else:
+                tokens = numpy.zeros(0, dtype='S1')
+            ids = numpy.concatenate([numpy.searchsorted(tokens, vocabulary)[ids] for vocabulary, ids, blocks in token_chunks]
+                                    + [numpy.zeros(0, dtype=numpy.int64)])
+            blocks = numpy.concatenate([blocks for vocabulary, ids, blocks in token_chunks] + [numpy.zeros(0, dtype=numpy.int64)])
+            # Chunks are in program order, so that a stable sort by token leaves each token's blocks ascending
+            order = numpy.argsort(ids, kind='stable')
+            offsets = numpy.searchsorted(ids[order], numpy.arange(len(tokens) + 1))
+            token_blocks = PostingLists.pack(blocks[order], offsets)
+            address_blocks = {}
+            address_values = {}
+            address_scales = {}
+            for name, chunks in address_chunks.items():
+                blocks = numpy.concatenate([blocks for blocks, values in chunks])
+                values = numpy.concatenate([values for blocks, values in chunks])
+                if len(chunks) > 1:
+                    # A chunk's long words follow its others, so a name's blocks are ascending only within each
+                    order = numpy.argsort(blocks, kind='stable')
+                    blocks, values = blocks[order], values[order]
+                address_blocks[name] = PostingLists.pack(blocks, numpy.array([0, len(blocks)]))
+                address_values[name], address_scales[name] = cls._compact_values(values)
+            long_tokens = {token: numpy.unique(blocks) for token, blocks in long_tokens.items()}
+        return cls(len(store), tokens, token_blocks, address_blocks, address_values, address_scales, long_tokens)
+
+    @classmethod
+    def _compact_values(cls, values):
+        """Returns (values as int32 multiples of 10**-scale, scale) for the least scale that represents every value,
+        or (values, None) if there is none."""
+        for scale in range(cls._MAX_SCALE + 1):
+            scaled = values * 10.0**scale
+            if numpy.abs(scaled).max(initial=0) >= 2**31:
+                break
+            integers = numpy.rint(scaled)
+            if numpy.abs(scaled - integers).max(initial=0) <= _SCALE_TOLERANCE:
+                return integers.astype(numpy.int32), scale
+        return values, None
+
+    @classmethod
+    def load(cls, fpath, instrumentation=None):
+        """Indexes the program file at fpath."""
+        with ProgramStore.load(fpath, instrumentation) as store:
+            return cls.build(store, instrumentation)
+
+    @property
+    def nbytes(self):
+        return self.tokens.nbytes + self.token_blocks.nbytes + sum(
+            self.address_blocks[name].nbytes + self.address_values[name].nbytes for name in self.address_blocks) + sum(
+            len(token) + blocks.nbytes for token, blocks in self.long_tokens.items())
+
+    def token(self, token, prefix=False):
+        """Returns the ascending block numbers of the blocks containing token (str or bytes, compared uppercased), or a
+        token starting with it if prefix is True."""
+        token = _encode(token)
+        if len(token) > MAX_WORD_LEN and not prefix:
+            return self.long_tokens.get(token, numpy.zeros(0, dtype=numpy.int64))
+        start = numpy.searchsorted(self.tokens, token, side='left')
+        if prefix:
+            stop = start + int(numpy.sum(numpy.strings.startswith(self.tokens[start:], token).cumprod()))
+            blocks = numpy.concatenate([self.token_blocks.lists(start, stop)] + [
+                blocks for long_token, blocks in self.long_tokens.items() if long_token.startswith(token)])
+            blocks.sort()
+            return blocks[numpy.concatenate(([True], blocks[1:] != blocks[:-1]))] if len(blocks) else blocks
+        if start < len(self.tokens) and self.tokens[start] == token:
+            return self.token_blocks[start]
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    def address(self, name, low=-numpy.inf, high=numpy.inf, low_inclusive=True, high_inclusive=True):
+        """Returns the ascending block numbers of the blocks with a name (str or bytes, compared uppercased) address
+        with a value from low to high."""
+        name = str(_encode(name), 'ascii', 'replace')
+        if name not in self.address_blocks:
+            return numpy.zeros(0, dtype=numpy.int64)
+        values, scale = self.address_values[name], self.address_scales[name]
+        if scale is not None:
+            low, high = (_scale_bound(bound, scale) for bound in (low, high))
+        m = numpy.greater_equal(values, low) if low_inclusive else numpy.greater(values, low)
+        m &= numpy.less_equal(values, high) if high_inclusive else numpy.less(values, high)
+        blocks = self.address_blocks[name][0][m]
+        # A block may hold more than one of the name's words
+        return blocks[numpy.concatenate(([True], blocks[1:] != blocks[:-1]))] if len(blocks) else blocks
+
+    def search(self, query):
+        """Returns the ascending block numbers of the blocks matching query, a boolean expression of terms, combined by
+        AND (or by juxtaposition), OR, and NOT, and grouped by parentheses set off by whitespace or at the ends of
+        terms.  Comparison is case insensitive.  A term is any of:
+
+            SUPA, T="CAPS32"       blocks containing the token
+            ORIRESET(*             blocks containing a token starting with ORIRESET(
+            G0, X-1.5, A3=0.25     blocks with the address at the value (G0 and G00 are the same)
+            Z                      blocks with a Z address, or containing the token Z
+            Z<0, X>=10, F==500     blocks with the address compared to the value by <, <=, >, >=, or ==
+
+        Raises ValueError for a malformed query."""
+        parser = _QueryParser(self, _query_tokens(query))
+        mask = parser.parse_or()
+        if parser.pos != len(parser.tokens):
+            raise ValueError('Unexpected {!r} in query.'.format(parser.tokens[parser.pos]))
+        return numpy.flatnonzero(mask)
+
+    def term_blocks(self, term):
+        """Returns the ascending block numbers of the blocks matching one search(..) term."""
+        match = _RANGE_TERM_RE.fullmatch(term)
+        if match is not None:
+            name, op, value = match.groups()
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError('Bad value in query term {!r}.'.format(term))
+            if op == '==':
+                return self.address(name, value, value)
+            if op[0] == '<':
+                return self.address(name, high=value, high_inclusive=op == '<=')
+            return self.address(name, low=value, low_inclusive=op == '>=')
+        if term.endswith('*'):
+            return self.token(term[:-1], prefix=True)
+        word = numpy.array([_encode(term)])
+        names, values = parse_addresses(word)
+        if not numpy.isnan(values[0]):
+            return self.address(names[0], values[0], values[0])
+        blocks = self.token(term)
+        if _NAME_RE.fullmatch(term):
+            address_blocks = self.address(term)
+            if not len(blocks):
+                return address_blocks
+            mask = numpy.zeros(self.block_count, dtype=bool)
+            mask[blocks] = True
+            mask[address_blocks] = True
+            blocks = numpy.flatnonzero(mask)
+        return blocks
+
+def _split_long_words(store, blocks, words):
+    """Separates the words of words (uppercased, as from ProgramStore.words(..)) that were truncated to MAX_WORD_LEN
+    bytes, returning (blocks, words, long_blocks, long_words): blocks and words without them, and the blocks and
+    uppercased full text of the words, read again from their blocks."""
+    empty = (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype='S1'))
+    if words.dtype.itemsize < MAX_WORD_LEN:
+        return (blocks, words) + empty
+    # Words that fill MAX_WORD_LEN bytes may or may not have been truncated
+    full = numpy.flatnonzero(numpy.strings.str_len(words) == MAX_WORD_LEN)
+    if not len(full):
+        return (blocks, words) + empty
+    truncated = []
+    long_blocks = []
+    long_words = []
+    full_idxs = iter(full.tolist())
+    for block in dict.fromkeys(blocks[full].tolist()):
+        # The words of the block as ProgramStore.words(..) splits them, before truncation
+        text = bytes(store.data[store.starts[block]:store.starts[block+1]]).split(b';', 1)[0]
+        for word in text.upper().split():
+            if len(word) >= MAX_WORD_LEN:
+                idx = next(full_idxs)
+                if len(word) > MAX_WORD_LEN:
+                    truncated.append(idx)
+                    long_blocks.append(block)
+                    long_words.append(word)
+    if not truncated:
+        return (blocks, words) + empty
+    keep = numpy.ones(len(words), dtype=bool)
+    keep[truncated] = False
+    return blocks[keep], words[keep], numpy.array(long_blocks, dtype=numpy.int64), numpy.array(long_words)
+
+def parse_addresses(words):
+    """Parses words (an uppercased numpy bytes array) as addresses, returning (names, values): names holds the
+    address name of each word (bytes), the part before the first '=', or else the first byte, and values the plain
+    decimal value following it (see decimal_values(..)), or NaN where a word is not an address."""
+    n = len(words)
+    equals = numpy.strings.find(words, b'=')
+    has_equals = equals > 0
+    name_stops = numpy.where(has_equals, equals, 1)
+    values = decimal_values(numpy.strings.slice(words, name_stops + has_equals, None))
+    first = words.astype('S1').view(numpy.uint8)
+    values[~has_equals & ((first < ord('A')) | (first > ord('Z')))] = numpy.nan
+    names = numpy.strings.slice(words, 0, name_stops) if n else numpy.zeros(0, dtype='S1')
+    return names, values
+
+_RANGE_TERM_RE = re.compile(r'([A-Za-z_][A-Za-z0-9_]*)(<=|>=|==|<|>)(.+)')
+_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_OPERATORS = {'AND', 'OR', 'NOT'}
+# Scaled values within this of an integer are taken to be the integer, decimal fractions not being exact in binary
+_SCALE_TOLERANCE = 1e-6
+
+def _scale_bound(bound, scale):
+    if not numpy.isfinite(bound):
+        return bound
+    scaled = bound * 10.0**scale
+    integer = numpy.rint(scaled)
+    return integer if abs(scaled - integer) <= _SCALE_TOLERANCE else scaled
+
+def _encode(s):
+    return (s.encode() if isinstance(s, str) else s).upper()
+
+def _query_tokens(query):
+    """Splits query at whitespace, separating grouping parentheses from the start of words and unbalanced closing
+    parentheses from their ends."""
+    tokens = []
+    for word in query.split():
+        while word.startswith('('):
+            tokens.append('(')
+            word = word[1:]
+        closing = 0
+        while word.endswith(')') and word.count(')') > word.count('('):
+            word = word[:-1]
+            closing += 1
+        if word:
+            tokens.append(word)
+        tokens.extend(')' * closing)
+    return tokens
+
+class _QueryParser:
+    '''Recursive descent parser of search(..) queries, evaluating each term to a mask of the index's blocks.'''
+    def __init__(self, index, tokens):
+        self.index = index
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError('Query ends unexpectedly.')
+        self.pos += 1
+        return token
+
+    def parse_or(self):
+        mask = self.parse_and()
+        while self.peek() is not None and self.peek().upper() == 'OR':
+            self.take()
+            mask |= self.parse_and()
+        return mask
+
+    def parse_and(self):
+        mask = self.parse_not()
+        while self.peek() is not None and self.peek() != ')' and self.peek().upper() != 'OR':
+            if self.peek().upper() == 'AND':
+                self.take()
+            mask &= self.parse_not()
+        return mask
+
+    def parse_not(self):
+        if self.peek() is not None and self.peek().upper() == 'NOT':
+            self.take()
+            return ~self.parse_not()
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.take()
+        if token == '(':
+            mask = self.parse_or()
+            if self.take() != ')':
+                raise ValueError('Unbalanced parentheses in query.')
+            return mask
+        if token == ')' or token.upper() in _OPERATORS:
+            raise ValueError('Unexpected {!r} in query.'.format(token))
+        mask = numpy.zeros(self.index.block_count, dtype=bool)
+        mask[self.index.term_blocks(token)] = True
+        return mask
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Program block search commandline interface.')
+    parser.add_argument('input', type=str)
+    parser.add_argument('query', type=str, help='see ProgramIndex.search(..), eg \'ORIRESET(* OR (G0 AND Z<0)\'')
+    parser.add_argument('--count', action='store_true', help='print only the number of matching blocks')
+    args = parser.parse_args()
+    with ProgramStore.load(args.input) as store:
+        index = ProgramIndex.build(store)
+        blocks = index.search(args.query)
+        if args.count:
+            print(len(blocks))
+        else:
+            for block in blocks.tolist():
+                print('{}: {}'.format(block, store[block]))
@@ -0,0 +1,187 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import mmap
+import numpy
+import os
+from pathlib import Path
+from .flinereader import _BOM, _OPENERS, open_binary
+from .instrumentation import Instrumentation
+
+# Words longer than this are truncated by ProgramStore.words(..)
+MAX_WORD_LEN = 32
+# Bytes separating words: whitespace, and ';', which starts a comment
+_SEPARATORS = numpy.zeros(256, dtype=bool)
+_SEPARATORS[list(b' \t\n\r\x0b\x0c;')] = True
+_UPPER = numpy.arange(256, dtype=numpy.uint8)
+_UPPER[ord('a'):ord('z')+1] -= ord('a') - ord('A')
+# Weights of the characters of numeric address values, in separate 6 bit fields (wide enough to count every byte of
+# a word): digits, '.', signs, and any other character; NUL (padding) has none
+_SIGN_WEIGHT = 1 << 12
+_CHAR_WEIGHTS = numpy.full(256, 1 << 18, dtype=numpy.int32)
+_CHAR_WEIGHTS[0] = 0
+_CHAR_WEIGHTS[ord('0'):ord('9')+1] = 1
+_CHAR_WEIGHTS[ord('.')] = 1 << 6
+_CHAR_WEIGHTS[[ord('-'), ord('+')]] = _SIGN_WEIGHT
+
+class ProgramStore:
+    '''A read-only, line-addressable store of a program's blocks, holding the program file's bytes and the offset at
+    which each block starts rather than a Python object per block, so that multi-million block programs take little
+    more memory than their text.  Uncompressed files are memory mapped, and must not be modified in place while the
+    store is open (replacing the file, as post_file(..) does, is fine); compressed files are read into memory.
+
+    Blocks are the file's lines, without line endings (CRLF or LF), numbered from 0.'''
+    _SCAN_CHUNK_SIZE = 1 << 24
+
+    def __init__(self, data, starts, fpath=None, encoding='utf-8', close=None):
+        self.data = data
+        # starts[n] is the offset of block n, and starts[-1] the length of data
+        self.starts = starts
+        self.fpath = fpath
+        self.encoding = encoding
+        self._close = close
+
+    @classmethod
+    def load(cls, fpath, instrumentation=None, encoding='utf-8'):
+        fpath = Path(fpath)
+        instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        with instrumentation.stage('ProgramStore.load', bytes_read=os.path.getsize(str(fpath))) as stage:
+            close = None
+            if fpath.suffix.lower() in _OPENERS:
+                with open_binary(fpath) as f:
+                    data = f.read()
+            elif stage.bytes_read == 0:
+                data = b''
+            else:
+                with open(str(fpath), 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                close = data.close
+            try:
+                starts = cls._block_starts(data, stage)
+            except BaseException:
+                if close is not None:
+                    close()
+                raise
+            stage.blocks_out = len(starts) - 1
+        return cls(data, starts, fpath, encoding, close)
+
+    @classmethod
+    def _block_starts(cls, data, stage):
+        size = len(data)
+        first = len(_BOM) if data[:len(_BOM)] == _BOM else 0
+        starts = [numpy.array([first], dtype=numpy.int64)]
+        for chunk_start in range(first, size, cls._SCAN_CHUNK_SIZE):
+            stage.progress(chunk_start / size)
+            # Slicing copies the chunk, leaving no buffer exported from a memory map that would prevent closing it
+            chunk = numpy.frombuffer(data[chunk_start:chunk_start+cls._SCAN_CHUNK_SIZE], dtype=numpy.uint8)
+            starts.append(numpy.flatnonzero(chunk == ord('\n')) + (chunk_start + 1))
+        starts = numpy.concatenate(starts)
+        if starts[-1] != size:
+            # The final block lacks a line ending
+            starts = numpy.append(starts, size)
+        return starts
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return self.blocks(start, stop)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('block index out of range')
+        return _strip_line_ending(str(self.data[self.starts[idx]:self.starts[idx+1]], self.encoding, 'replace'))
+
+    def blocks(self, start, stop):
+        """Returns the list of blocks start through stop-1, decoded in bulk."""
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return []
+        text = str(self.data[self.starts[start]:self.starts[stop]], self.encoding, 'replace')
+        lines = text.split('\n')
+        if len(lines) > stop - start:
+            # The empty string following the last block's line ending
+            lines.pop()
+        return [line[:-1] if line.endswith('\r') else line for line in lines]
+
+    def words(self, start, stop):
+        """Splits blocks start through stop-1 into words in bulk, returning (blocks, words): words is a numpy bytes
+        array of the whitespace separated words of the blocks, in order, excluding comments (from ';' to the end of a
+        block) and truncated to MAX_WORD_LEN bytes, and blocks holds the number of the block each word is in.  Quoted
+        strings containing whitespace are split like anything else."""
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype='S1')
+        offset = int(self.starts[start])
+        block_starts = self.starts[start:stop+1] - offset
+        # Padded so that the last word's bytes can be gathered as a full width row
+        buf = numpy.frombuffer(self.data[offset:self.starts[stop]] + bytes(MAX_WORD_LEN), dtype=numpy.uint8)
+        size = len(buf) - MAX_WORD_LEN
+        is_word = numpy.zeros(size + 2, dtype=bool)
+        numpy.logical_not(_SEPARATORS[buf[:size]], out=is_word[1:-1])
+        edges = numpy.flatnonzero(is_word[1:] != is_word[:-1])
+        word_starts, word_ends = edges[::2], edges[1::2]
+        blocks = numpy.searchsorted(block_starts, word_starts, side='right') - 1
+        # Drop the words following the first ';' of each block
+        semis = numpy.flatnonzero(buf[:size] == ord(';'))
+        if len(semis):
+            semi_blocks, first = numpy.unique(numpy.searchsorted(block_starts, semis, side='right') - 1, return_index=True)
+            comment_starts = numpy.full(stop - start, size, dtype=numpy.int64)
+            comment_starts[semi_blocks] = semis[first]
+            keep = word_starts < comment_starts[blocks]
+            word_starts, word_ends, blocks = word_starts[keep], word_ends[keep], blocks[keep]
+        lengths = word_ends - word_starts
+        width = max(min(int(lengths.max(initial=1)), MAX_WORD_LEN), 1)
+        chars = numpy.lib.stride_tricks.sliding_window_view(buf, width)[word_starts]
+        chars[numpy.arange(width) >= lengths[:, numpy.newaxis]] = 0
+        words = chars.view('S{}'.format(width)).ravel()
+        blocks += start
+        return blocks, words
+
+def address_values(words):
+    """Parses words (a numpy bytes array, as from ProgramStore.words(..)) as addresses, returning (letters, values):
+    letters holds the uppercased first byte of each word, and values its numeric value, or NaN where the rest of the
+    word, after an optional '=', is not a plain decimal number (eg X=_X_HOME, A3=.5, or CYCLE800())."""
+    n = len(words)
+    chars = words.astype('S{}'.format(max(words.dtype.itemsize, 2))).view(numpy.uint8).reshape(n, -1)
+    letters = _UPPER[chars[:, 0]]
+    values = decimal_values(numpy.strings.slice(words, numpy.where(chars[:, 1] == ord('='), 2, 1), None))
+    values[(letters < ord('A')) | (letters > ord('Z'))] = numpy.nan
+    return letters, values
+
+def decimal_values(strings):
+    """Parses strings (a numpy bytes array) as plain decimal numbers, of 1 through 15 digits with at most one '.' and
+    an optional leading sign, returning a float64 array holding NaN where an element is not one."""
+    n = len(strings)
+    width = max(strings.dtype.itemsize, 1)
+    chars = numpy.ascontiguousarray(strings.astype('S{}'.format(width)))
+    chars = chars.view(numpy.uint8).reshape(n, width)
+    # Summing the character class weights of each string's bytes counts each class at once
+    sums = _CHAR_WEIGHTS[chars].sum(axis=1, dtype=numpy.int32)
+    digits = sums & 0x3f
+    valid = (digits > 0) & (digits <= 15) & ((sums >> 6) & 0x3f <= 1) & (sums >> 18 == 0) & \
+            ((sums >> 12) & 0x3f == (_CHAR_WEIGHTS[chars[:, 0]] == _SIGN_WEIGHT))
+    values = numpy.full(n, numpy.nan)
+    values[valid] = strings[valid].astype(numpy.float64)
+    return values
+
+def _strip_line_ending(line):
+    if line.endswith('\n'):
+        line = line[:-1]
+    if line.endswith('\r'):
+        line = line[:-1]
+    return line
@@ -0,0 +1,300 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import numpy
+from pathlib import Path
+from PyQt5 import Qt
+import sys
+from .program_index import ProgramIndex
+from .progress import ProgressTask
+from .program_store import ProgramStore
+from .toolpath_preview import COLOR_BY, PROJECTIONS, ToolpathPreview, store_toolpath
+
+class ProgramModel(Qt.QAbstractTableModel):
+    '''A read-only table model of the blocks of a ProgramStore, one row per block, with columns for the block number
+    and the block's text.
+
+    Rows are not held by the model: data(..) decodes them from the store on demand, cache_rows at a time around the
+    row asked for, and only the most recently decoded window is kept, so that memory use does not grow with the
+    program's length.  A view asks for the rows it paints, in order, so that scrolling decodes a window of rows at a
+    time.  Rows are made known to views fetch_rows at a time as they scroll towards the end (see
+    QAbstractItemModel.canFetchMore(..) and fetchMore(..)), or up to a particular row by fetch_to(..).'''
+    COLUMNS = ('Block', 'Text')
+
+    def __init__(self, store=None, parent=None, cache_rows=4096, fetch_rows=100000):
+        super().__init__(parent)
+        self.cache_rows = cache_rows
+        self.fetch_rows = fetch_rows
+        self._store = None
+        self._fetched = 0
+        self._cache_start = 0
+        self._cache = []
+        self.store = store
+
+    @property
+    def store(self):
+        return self._store
+
+    @store.setter
+    def store(self, v):
+        if v is not self._store:
+            self.beginResetModel()
+            try:
+                self._store = v
+                self._fetched = 0 if v is None else min(len(v), self.fetch_rows)
+                self._cache_start = 0
+                self._cache = []
+            finally:
+                self.endResetModel()
+
+    def rowCount(self, parent=Qt.QModelIndex()):
+        return 0 if parent.isValid() else self._fetched
+
+    def columnCount(self, parent=Qt.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def canFetchMore(self, parent=Qt.QModelIndex()):
+        return not parent.isValid() and self._store is not None and self._fetched < len(self._store)
+
+    def fetchMore(self, parent=Qt.QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetch_to(self._fetched + self.fetch_rows - 1)
+
+    def fetch_to(self, row):
+        """Makes rows through row (or through the last row, if row is past it) known to views."""
+        if self._store is None:
+            return
+        row = min(row, len(self._store) - 1)
+        if row >= self._fetched:
+            self.beginInsertRows(Qt.QModelIndex(), self._fetched, row)
+            self._fetched = row + 1
+            self.endInsertRows()
+
+    def flags(self, midx):
+        f = Qt.Qt.ItemIsSelectable | Qt.Qt.ItemNeverHasChildren
+        if midx.isValid():
+            f |= Qt.Qt.ItemIsEnabled
+        return f
+
+    def get_row(self, row):
+        """The text of block row, decoded along with the rows around it if it is not in the cached window."""
+        idx = row - self._cache_start
+        if not 0 <= idx < len(self._cache):
+            # Most rows asked for follow the one asked for before, as a view paints top to bottom, but a margin is kept
+            # before row for scrolling up
+            self._cache_start = max(0, row - self.cache_rows // 4)
+            self._cache = self._store.blocks(self._cache_start, self._cache_start + self.cache_rows)
+            idx = row - self._cache_start
+        return self._cache[idx]
+
+    def data(self, midx, role=Qt.Qt.DisplayRole):
+        if midx.isValid() and role == Qt.Qt.DisplayRole:
+            return Qt.QVariant(midx.row() if midx.column() == 0 else self.get_row(midx.row()))
+        return Qt.QVariant()
+
+    def headerData(self, section, orientation, role=Qt.Qt.DisplayRole):
+        if orientation == Qt.Qt.Horizontal and role == Qt.Qt.DisplayRole and 0 <= section < len(self.COLUMNS):
+            return Qt.QVariant(self.COLUMNS[section])
+        return Qt.QVariant()
+
+class ProgramView(Qt.QTableView):
+    '''A QTableView of a ProgramModel with fixed height rows and no vertical header, so that the view does no
+    per-row work for rows it does not paint.'''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFont(Qt.QFontDatabase.systemFont(Qt.QFontDatabase.FixedFont))
+        self.setModel(ProgramModel(parent=self))
+        self.setSelectionBehavior(Qt.QAbstractItemView.SelectRows)
+        self.setWordWrap(False)
+        self.setShowGrid(False)
+        vh = self.verticalHeader()
+        vh.setSectionResizeMode(Qt.QHeaderView.Fixed)
+        vh.setDefaultSectionSize(self.fontMetrics().height() + 2)
+        vh.hide()
+        self.horizontalHeader().setStretchLastSection(True)
+
+    @property
+    def store(self):
+        return self.model().store
+
+    @store.setter
+    def store(self, v):
+        self.model().store = v
+        if v is not None:
+            # Wide enough for the greatest block number
+            self.setColumnWidth(0, self.fontMetrics().horizontalAdvance('0' * (len(str(len(v))) + 2)))
+
+    def go_to_block(self, idx):
+        model = self.model()
+        model.fetch_to(idx)
+        midx = model.index(idx, 1)
+        self.scrollTo(midx, Qt.QAbstractItemView.PositionAtCenter)
+        self.selectRow(idx)
+
+class ProgramViewer(Qt.QWidget):
+    '''A window showing a program file (see ProgramStore), with fields for jumping to a block and for finding the blocks
+    matching a query (see ProgramIndex.search(..)), beside a preview of its toolpath (see ToolpathPreview).  The
+    program's index, and then its toolpath and level of detail pyramids, are built on a background thread; clicking
+    the preview goes to the block of the position clicked.'''
+    def __init__(self, fpath=None, parent=None):
+        super().__init__(parent)
+        self.setAttribute(Qt.Qt.WA_DeleteOnClose)
+        self._task = None
+        self.index = None
+        self._matches = None
+        layout = Qt.QVBoxLayout()
+        self.setLayout(layout)
+        bar = Qt.QHBoxLayout()
+        layout.addLayout(bar)
+        bar.addWidget(Qt.QLabel('Go to block:'))
+        self._block_edit = Qt.QSpinBox()
+        self._block_edit.setRange(0, 0)
+        self._block_edit.editingFinished.connect(lambda: self.view.go_to_block(self._block_edit.value()))
+        bar.addWidget(self._block_edit)
+        self._count_label = Qt.QLabel()
+        bar.addWidget(self._count_label)
+        bar.addWidget(Qt.QLabel('Find:'))
+        self._find_edit = Qt.QLineEdit()
+        self._find_edit.setPlaceholderText('eg ORIRESET(* OR (G0 AND Z<0)')
+        self._find_edit.setEnabled(False)
+        self._find_edit.returnPressed.connect(self.find)
+        self._find_edit.textChanged.connect(lambda text: setattr(self, '_matches', None))
+        bar.addWidget(self._find_edit, 1)
+        for text, step, shortcut in (('Previous', -1, 'Shift+F3'), ('Next', 1, 'F3')):
+            button = Qt.QPushButton(text)
+            button.clicked.connect(lambda checked, step=step: self.find(step))
+            bar.addWidget(button)
+            Qt.QShortcut(Qt.QKeySequence(shortcut), self, lambda step=step: self.find(step))
+        self._find_label = Qt.QLabel()
+        bar.addWidget(self._find_label)
+        bar.addStretch()
+        bar.addWidget(Qt.QLabel('Preview:'))
+        self._projection_combo = Qt.QComboBox()
+        self._projection_combo.addItems(list(PROJECTIONS))
+        self._projection_combo.currentTextChanged.connect(self._on_projection_chosen)
+        bar.addWidget(self._projection_combo)
+        self._color_by_combo = Qt.QComboBox()
+        self._color_by_combo.addItems(['Color by ' + color_by for color_by in COLOR_BY])
+        self._color_by_combo.currentIndexChanged.connect(lambda idx: setattr(self.preview, 'color_by', COLOR_BY[idx]))
+        bar.addWidget(self._color_by_combo)
+        self._task_label = Qt.QLabel()
+        bar.addWidget(self._task_label)
+        splitter = Qt.QSplitter()
+        layout.addWidget(splitter)
+        self.view = ProgramView()
+        splitter.addWidget(self.view)
+        self.preview = ToolpathPreview()
+        self.preview.block_clicked.connect(self._on_block_clicked)
+        splitter.addWidget(self.preview)
+        self.resize(1500, 800)
+        splitter.setSizes([700, 800])
+        if fpath is not None:
+            self.open(fpath)
+
+    def open(self, fpath):
+        fpath = Path(fpath)
+        store = ProgramStore.load(fpath)
+        self.close_store()
+        self.view.store = store
+        self._block_edit.setRange(0, max(len(store) - 1, 0))
+        self._count_label.setText('of {:,} blocks'.format(len(store)))
+        self.setWindowTitle(str(fpath))
+        projection = self._projection_combo.currentText()
+        def build_toolpath(instrumentation):
+            path = store_toolpath(store, instrumentation)
+            path.pyramid(projection, instrumentation)
+            return path
+        def on_index_built(index):
+            self.index = index
+            self._find_edit.setEnabled(True)
+            self._run_task(build_toolpath, lambda path: setattr(self.preview, 'path', path))
+        self._run_task(lambda instrumentation: ProgramIndex.build(store, instrumentation), on_index_built)
+
+    def close_store(self):
+        self._cancel_task()
+        self.preview.path = None
+        self.index = None
+        self._matches = None
+        self._find_edit.setEnabled(False)
+        self._find_label.setText('')
+        store = self.view.store
+        if store is not None:
+            self.view.store = None
+            store.close()
+
+    def find(self, step=1):
+        """Goes to the next (or, for step -1, the previous) block matching the find field's query after (or before)
+        the current block, searching the index if the query has changed."""
+        if self.index is None:
+            return
+        if self._matches is None:
+            try:
+                self._matches = self.index.search(self._find_edit.text())
+            except ValueError as e:
+                self._find_label.setText(str(e))
+                return
+        matches = self._matches
+        if not len(matches):
+            self._find_label.setText('No matches')
+            return
+        current = self.view.currentIndex().row()
+        if step > 0:
+            idx = numpy.searchsorted(matches, current, side='right') % len(matches)
+        else:
+            idx = (numpy.searchsorted(matches, current, side='left') - 1) % len(matches)
+        block = int(matches[idx])
+        self._find_label.setText('{:,} of {:,}'.format(idx + 1, len(matches)))
+        self._block_edit.setValue(block)
+        self.view.go_to_block(block)
+
+    def _run_task(self, func, on_succeeded):
+        """Runs func(instrumentation) on a background thread, in place of any task running already, calling
+        on_succeeded with its result."""
+        self._cancel_task()
+        self._task = task = ProgressTask(func, parent=self)
+        # Signals queued before the task was canceled or replaced are ignored
+        def current(slot):
+            return lambda *args: slot(*args) if task is self._task else None
+        def succeeded(result):
+            self._task_label.setText('')
+            on_succeeded(result)
+        task.progressed.connect(current(lambda stage, completion, eta: self._task_label.setText(
+            '{} {:.0%}'.format(stage, completion))))
+        task.succeeded.connect(current(succeeded))
+        task.failed.connect(current(lambda e: self._task_label.setText('Failed: {}'.format(e))))
+        task.start()
+
+    def _cancel_task(self):
+        """Stops the background task, if any, so that it no longer reads the store."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            task.wait()
+            task.deleteLater()
+
+    def _on_projection_chosen(self, projection):
+        path = self.preview.path
+        if path is not None:
+            # The projection's pyramid is built in the background if it has not been already
+            self._run_task(
+                lambda instrumentation: path.pyramid(projection, instrumentation),
+                lambda pyramid: setattr(self.preview, 'projection', projection))
+        else:
+            self.preview.projection = projection
+
+    def _on_block_clicked(self, block):
+        self._block_edit.setValue(block)
+        self.view.go_to_block(block)
+
+    def closeEvent(self, event):
+        self.close_store()
+        super().closeEvent(event)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Program viewer commandline interface.')
+    parser.add_argument('input', type=str)
+    args = parser.parse_args()
+    app = Qt.QApplication(sys.argv)
+    viewer = ProgramViewer(args.input)
+    viewer.show()
+    app.exec_()
@@ -0,0 +1,123 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import collections
+from PyQt5 import Qt
+import threading
+import time
+from .instrumentation import Canceled, Instrumentation
+
+class EtaEstimator:
+    '''Estimates the time remaining for a stage from its throughput, the rate its completion has increased over the
+    most recent window seconds, so that the estimate follows changes in speed through the stage.'''
+    def __init__(self, window=5.0):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Forgets the samples recorded, as when a new stage starts."""
+        self._samples = collections.deque()
+
+    def update(self, completion, now=None):
+        """Records completion at time now (time.monotonic() by default), returning the estimated seconds remaining, or
+        None until completion has increased."""
+        now = time.monotonic() if now is None else now
+        samples = self._samples
+        samples.append((now, completion))
+        # Retain one sample at least window seconds old, if there is one, so that the rate is measured over the window
+        while len(samples) > 2 and now - samples[1][0] >= self.window:
+            samples.popleft()
+        t0, c0 = samples[0]
+        if completion <= c0 or now <= t0:
+            return None
+        return (1 - completion) * (now - t0) / (completion - c0)
+
+class _Runnable(Qt.QRunnable):
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+        self.setAutoDelete(False)
+
+    def run(self):
+        self.task._run()
+
+class ProgressTask(Qt.QObject):
+    '''Runs func(instrumentation) on a thread of pool (the global QThreadPool by default), reporting progress through
+    Qt signals received on the thread that owns the ProgressTask.  func must run its pipeline stages through
+    instrumentation (a new Instrumentation if None), which ProgressTask uses to follow and cancel it.
+
+    progressed(stage name, completion, estimated seconds remaining or None) is emitted as each stage starts and then at
+    most every Instrumentation.progress_interval seconds.  cancel() stops the stage running at its next checkpoint (see
+    Instrumentation.cancel()), within a few tens of milliseconds.  Exactly one of succeeded(result), failed(exception),
+    and canceled() is emitted when func returns or raises, followed by finished().'''
+    progressed = Qt.pyqtSignal(str, float, object)
+    succeeded = Qt.pyqtSignal(object)
+    failed = Qt.pyqtSignal(object)
+    canceled = Qt.pyqtSignal()
+    finished = Qt.pyqtSignal()
+
+    def __init__(self, func, instrumentation=None, parent=None, pool=None, eta_window=5.0):
+        super().__init__(parent)
+        self.func = func
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.pool = Qt.QThreadPool.globalInstance() if pool is None else pool
+        self.result = None
+        self.error = None
+        self.was_canceled = False
+        self._eta = EtaEstimator(eta_window)
+        self._done = threading.Event()
+        self._runnable = None
+
+    def start(self):
+        if self._runnable is not None:
+            raise RuntimeError('A ProgressTask can be started only once.')
+        self._runnable = _Runnable(self)
+        self.pool.start(self._runnable)
+
+    def cancel(self):
+        """May be called from any thread, including before start()."""
+        self.instrumentation.cancel()
+
+    @property
+    def running(self):
+        return self._runnable is not None and not self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Blocks until func has returned or raised, returning False if timeout seconds pass first."""
+        return self._done.wait(timeout)
+
+    def _run(self):
+        self.instrumentation.listeners.append(self._on_stage_event)
+        try:
+            self.result = self.func(self.instrumentation)
+        except Canceled:
+            self.was_canceled = True
+        except Exception as e:
+            self.error = e
+        finally:
+            self.instrumentation.listeners.remove(self._on_stage_event)
+        try:
+            if self.was_canceled:
+                self.canceled.emit()
+            elif self.error is not None:
+                self.failed.emit(self.error)
+            else:
+                self.succeeded.emit(self.result)
+            self.finished.emit()
+        finally:
+            # Set last, so that the ProgressTask may be deleted once wait() returns
+            self._done.set()
+
+    def _on_stage_event(self, event, record):
+        if event == 'started':
+            self._eta.reset()
+            self.progressed.emit(record.name, record.completion, None)
+        elif event == 'progress':
+            self.progressed.emit(record.name, record.completion, self._eta.update(record.completion))
+
+def format_eta(eta):
+    """Formats estimated seconds remaining as h:mm:ss or m:ss, or '' for None."""
+    if eta is None:
+        return ''
+    minutes, seconds = divmod(int(round(eta)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02}:{:02}'.format(hours, minutes, seconds) if hours else '{}:{:02}'.format(minutes, seconds)
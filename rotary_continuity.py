@@ -0,0 +1,237 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import math
+import sys
+from .confine_traori_hemisphere import _parse_block
+from .flinereader import LineReader
+from .instrumentation import CHECKPOINT_BLOCKS, Instrumentation, stream_bytes, text_bytes
+from .machine_model import MachineModel
+
+@attr.s
+class RotaryTravelReport:
+    '''Total rotary travel (|dtilt| + |drotary| summed over consecutive motion blocks, in degrees) with the rotary axis
+    positions chosen by ConfineTraoriHemisphere's fixed rule and by RotaryContinuityOptimizer.'''
+    motion_blocks = attr.ib(default=0)
+    runs = attr.ib(default=0)
+    fixed_travel = attr.ib(default=0.0)
+    optimized_travel = attr.ib(default=0.0)
+
+    @property
+    def saved_travel(self):
+        return self.fixed_travel - self.optimized_travel
+
+    def as_dict(self):
+        d = attr.asdict(self)
+        d['saved_travel'] = self.saved_travel
+        return d
+
+class RotaryContinuityOptimizer:
+    '''Converts I,J,K tool vector format output (as written by DMU65UL_Post) to rotary axis format (eg A,C), as
+    ConfineTraoriHemisphere does, but rather than applying a fixed rule to each block in isolation, chooses the tilt
+    and rotary axis positions to minimize total rotary travel over each run of consecutive motion blocks.
+
+    Every tool vector not within the machine model's singularity_tolerance of vertical is reached by two solutions
+    (see MachineModel.solutions(..)), and by any number of rotary axis windings, rotary+360n.  The candidates for each
+    block are those solutions, and, where the rotary axis is not endless, each winding, within the travel limits of
+    the machine model's profile.  A vertical tool vector leaves the rotary axis position indeterminate, and it is
+    held.  The cheapest path through the candidates is found by dynamic programming in time linear in the number of
+    blocks, with ties, as between mirror image paths, broken in favour of the profile's preferred_tilt_sign.  Each run
+    starts from the axis positions at the end of the previous run.'''
+
+    def __init__(self, machine_model=None, instrumentation=None):
+        self.machine_model = MachineModel() if machine_model is None else machine_model
+        self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        self.report = None
+
+    def run(self, inputf, outputf):
+        with self.instrumentation.stage('RotaryContinuityOptimizer.run', blocks_in=0, blocks_out=0, bytes_read=0, bytes_written=0) as stage, \
+                stream_bytes(stage, inputf, outputf):
+            self._run(inputf, outputf, stage)
+        return self.report
+
+    def _run(self, inputf, outputf, stage):
+        self.report = report = RotaryTravelReport()
+        # Each element of blocks is either the output text of a non-motion block or a [Gx, x, y, z, i, j, k] list for a
+        # motion block, which has its tilt and rotary appended once its run is optimized
+        blocks = []
+        run = []
+        xyz_ijk = dict(i=0,j=0,k=1)
+        fixed = _FixedRule(self.machine_model)
+        entry = None
+        for line in inputf:
+            if len(blocks) % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            stage.bytes_read += text_bytes(line, inputf)
+            line, in_Gx, updates, is_motion = _parse_block(line)
+            xyz_ijk.update(updates)
+            if is_motion:
+                block = [in_Gx] + [xyz_ijk[k] for k in 'xyzijk']
+                report.fixed_travel += fixed.travel(*block[4:])
+                run.append(block)
+            else:
+                if run:
+                    entry = self._optimize_run(run, entry, len(blocks) - len(run), stage)
+                    report.runs += 1
+                    run = []
+            blocks.append(block if is_motion else line)
+        if run:
+            self._optimize_run(run, entry, len(blocks) - len(run), stage)
+            report.runs += 1
+        motion_format = 'N{:06} G{} X{} Y{} Z{} ' + self.machine_model.tilt_name + '={} ' + self.machine_model.rotary_name + '={}'
+        prev_axes = None
+        for line_num, block in enumerate(blocks):
+            if line_num % CHECKPOINT_BLOCKS == 0:
+                stage.progress(line_num / len(blocks))
+            if isinstance(block, str):
+                out_line = 'N{:06} {}'.format(line_num, block)
+            else:
+                in_Gx, x, y, z, i, j, k, tilt, rotary = block
+                out_line = motion_format.format(line_num, in_Gx, x, y, z, tilt, rotary)
+                if prev_axes is not None:
+                    report.optimized_travel += abs(tilt - prev_axes[0]) + abs(rotary - prev_axes[1])
+                prev_axes = tilt, rotary
+                report.motion_blocks += 1
+            print(out_line, file=outputf)
+            stage.bytes_written += text_bytes(out_line, outputf) + 1
+        stage.blocks_in = stage.blocks_out = len(blocks)
+
+    def _optimize_run(self, run, entry, first_line_num, stage):
+        """Appends the chosen tilt and rotary to each block in run, returning the final (tilt, rotary).  entry is the
+        (tilt, rotary) in effect before the run, or None if there is none."""
+        model = self.machine_model
+        tilt_min, tilt_max = model.profile.travel_limits('tilt') or (-math.inf, math.inf)
+        endless = model.profile.travel_limits('rotary') is None
+        preferred_sign = model.profile.preferred_tilt_sign
+        if endless:
+            def c_cost(c0, c1):
+                d = (c1 - c0) % 360
+                return min(d, 360 - d)
+        else:
+            def c_cost(c0, c1):
+                return abs(c1 - c0)
+        # prev_cands is a list of (tilt, rotary) and prev_costs the cost of the cheapest path to each.  backs[n][m] is the index
+        # of the candidate of block n-1 preceding candidate m of block n on the cheapest path to it.
+        if entry is None:
+            prev_cands, prev_costs = None, None
+        else:
+            prev_cands, prev_costs = [entry], [0.0]
+        cands_per_block = []
+        backs = []
+        for block_idx, (in_Gx, x, y, z, i, j, k) in enumerate(run):
+            if block_idx % CHECKPOINT_BLOCKS == 0:
+                stage.checkpoint()
+            if abs(k) > 1:
+                raise ValueError('math domain error')
+            solutions = model.solutions(i, j, k)
+            if solutions is not None:
+                cands = [
+                    (a_, c_)
+                    for a_, c_base in solutions
+                    if tilt_min <= a_ <= tilt_max
+                    for c_ in self._windings(c_base)]
+                if prev_cands is None:
+                    costs = [0.0] * len(cands)
+                    back = [None] * len(cands)
+                else:
+                    costs = []
+                    back = []
+                    prev_tilts = [pa for pa, pc in prev_cands]
+                    for a_, c_ in cands:
+                        path_costs = [
+                            cost + abs(a_ - pa) + c_cost(pc, c_) for (pa, pc), cost in zip(prev_cands, prev_costs)]
+                        best_idx = _cheapest(path_costs, prev_tilts, preferred_sign)
+                        costs.append(path_costs[best_idx])
+                        back.append(best_idx)
+            else:
+                # The rotary axis position is indeterminate and held; each candidate follows the same candidate of the
+                # preceding block, keeping its tilt sign where limits allow
+                a = math.degrees(math.acos(k))
+                if prev_cands is None:
+                    prev_cands, prev_costs = [(0.0, model.reference_rotary)], [0.0]
+                cands = []
+                costs = []
+                back = []
+                for idx, ((pa, pc), cost) in enumerate(zip(prev_cands, prev_costs)):
+                    for a_ in ((a, -a) if pa >= 0 else (-a, a)):
+                        if tilt_min <= a_ <= tilt_max:
+                            cands.append((a_, pc))
+                            costs.append(cost + abs(a_ - pa))
+                            back.append(idx)
+                            break
+                if block_idx == 0 and entry is None:
+                    back = [None] * len(cands)
+            if not cands:
+                raise RuntimeError('block N{:06}: no {},{} solution within rotary axis limits'.format(
+                    first_line_num + block_idx, model.tilt_name, model.rotary_name))
+            cands_per_block.append(cands)
+            backs.append(back)
+            prev_cands, prev_costs = cands, costs
+        idx = _cheapest(prev_costs, [a_ for a_, c_ in prev_cands], preferred_sign)
+        chosen = []
+        for cands, back in zip(reversed(cands_per_block), reversed(backs)):
+            chosen.append(cands[idx])
+            idx = back[idx]
+        chosen.reverse()
+        prev_c = None if entry is None else entry[1]
+        for block, (a, c) in zip(run, chosen):
+            if endless and prev_c is not None:
+                # Unwind the rotary axis along the path
+                d = (c - prev_c) % 360
+                c = prev_c + (d if d <= 180 else d - 360)
+            block.extend((a, c))
+            prev_c = c
+        return chosen[-1][0], prev_c
+
+    def _windings(self, c):
+        limits = self.machine_model.profile.travel_limits('rotary')
+        if limits is None:
+            return c,
+        c_min, c_max = limits
+        return tuple(c + 360*n for n in range(math.ceil((c_min - c) / 360), math.floor((c_max - c) / 360) + 1))
+
+# Path costs within this fraction of the least are taken to be tied.  The mirror image solutions of a run of blocks
+# cost exactly the same but for rounding.
+_TIE_TOLERANCE = 1e-9
+
+def _cheapest(costs, tilts, preferred_tilt_sign):
+    """Returns the index of the least of costs, breaking ties in favour of the cheapest with a tilt (the
+    corresponding element of tilts) of preferred_tilt_sign, and then of the lowest index."""
+    least = min(costs)
+    limit = least + _TIE_TOLERANCE * max(1.0, abs(least))
+    tied = [idx for idx, cost in enumerate(costs) if cost <= limit]
+    if len(tied) == 1:
+        return tied[0]
+    preferred = [idx for idx in tied if tilts[idx] * preferred_tilt_sign > 0]
+    return min(preferred or tied, key=costs.__getitem__)
+
+class _FixedRule:
+    '''Tracks rotary travel with the rotary axis positions chosen as by ConfineTraoriHemisphere.'''
+    def __init__(self, machine_model):
+        self.machine_model = machine_model
+        self.rotary = machine_model.reference_rotary
+        self.prev_axes = None
+
+    def travel(self, i, j, k):
+        tilt, self.rotary = self.machine_model.inverse_one(i, j, k, self.rotary)
+        prev_axes, self.prev_axes = self.prev_axes, (tilt, self.rotary)
+        return 0.0 if prev_axes is None else abs(tilt - prev_axes[0]) + abs(self.rotary - prev_axes[1])
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser('Rotary continuity optimizing I,J,K tool vector to A,C conversion commandline interface.')
+    parser.add_argument('--input', type=str, default='-')
+    parser.add_argument('--output', type=str, default='-')
+    parser.add_argument('--machine-profile', type=str, default=None, help='JSON machine profile, including rotary axis limits')
+    parser.add_argument('--report', type=str, default=None, help='write a JSON instrumentation report to this path')
+    args = parser.parse_args()
+    input = LineReader(sys.stdin.buffer) if args.input == '-' else LineReader.open(args.input)
+    output = sys.stdout if args.output == '-' else open(args.output, mode='w', newline='\r\n')
+    instrumentation = Instrumentation()
+    machine_model = None if args.machine_profile is None else MachineModel.load(args.machine_profile)
+    optimizer = RotaryContinuityOptimizer(machine_model, instrumentation)
+    report = optimizer.run(input, output)
+    print(json.dumps(report.as_dict()), file=sys.stderr)
+    if args.report is not None:
+        instrumentation.write_report(args.report, args.input)
@@ -0,0 +1,61 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import os
+from pathlib import Path
+import pytest
+from .cnc_program import CncProgram
+
+PROGRAM = '''G0 X0 Y0 Z10
+G1 X10 Y10 F1000 ;first long feed move with a long comment
+G1 X20 Y20 ;second long feed move with a long comment
+G0 Z10
+G1 X30 Y30 ;third long feed move with a long comment
+G1 X40 Y40 ;fourth long feed move with a long comment
+G0 Z10
+G1 X50 Y50 ;fifth long feed move with a long comment
+M30
+'''
+
+def load_program(tmp_path):
+    mpf_fpath = tmp_path / 'in.mpf'
+    mpf_fpath.write_text(PROGRAM)
+    program = CncProgram()
+    program.import_mpf(mpf_fpath)
+    return program
+
+def strip_n(line):
+    return line.split(' ', 1)[1]
+
+@pytest.mark.parametrize('max_bytes, part_count', [(140, 4), (200, 2), (1000, 1)])
+def test_split_parts_fit_budget(tmp_path, max_bytes, part_count):
+    program = load_program(tmp_path)
+    fpaths = program.export_mpf_split(tmp_path / 'm.mpf', max_bytes=max_bytes)
+    mpf_fpath, part_fpaths = fpaths[0], fpaths[1:]
+    assert len(part_fpaths) == part_count
+    assert [strip_n(line) for line in mpf_fpath.read_text().splitlines()] == \
+        [fpath.stem for fpath in part_fpaths] + ['M30']
+    blocks = []
+    for fpath in part_fpaths:
+        assert os.path.getsize(str(fpath)) <= max_bytes
+        data = fpath.read_bytes()
+        assert data.endswith(b'M17\r\n')
+        blocks.extend(strip_n(line) for line in data.decode().splitlines()[:-1])
+    assert blocks == PROGRAM.splitlines()[:-1]
+
+def test_split_over_budget_raises(tmp_path):
+    program = load_program(tmp_path)
+    with pytest.raises(RuntimeError):
+        program.export_mpf_split(tmp_path / 'm.mpf', max_bytes=120)
+
+def test_parallel_transform_matches_serial():
+    program = CncProgram()
+    program.import_mpf(Path(__file__).parent / 'test_prt.mpf')
+    commands = program.commands * 3
+    program.commands = commands
+    for _ in program.transform_for_dmu65ul():
+        pass
+    serial_lines = [cmd.mpf_line for cmd in program.commands]
+    program.commands = commands
+    for _ in program.transform_for_dmu65ul_parallel(max_workers=2, min_segment_len=100):
+        pass
+    assert [cmd.mpf_line for cmd in program.commands] == serial_lines
@@ -0,0 +1,20 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import io
+import pytest
+from .confine_traori_hemisphere import ChunkedConfineTraoriHemisphere, ConfineTraoriHemisphere
+
+LINES = [
+    'T1', 'G0 X0 Y0 Z100 A3=0 B3=0 C3=1', 'G1 X10 A3=.5 B3=.5 C3=.7071', 'G1 Y10', 'M8', 'G1 A3=0 B3=0 C3=1',
+    'G1 X-10 A3=-.6 B3=0 C3=.8', 'G0 Z100', 'N10 G1 X0 Y0 Z5 A3=0 B3=-.6 C3=.8 ;comment', 'M30']
+
+def confine(c, lines):
+    output = io.StringIO()
+    c.run(lines, output)
+    return output.getvalue()
+
+@pytest.mark.parametrize('chunk_lines', [1, 3, len(LINES), 1000])
+def test_chunked_matches_scalar(chunk_lines):
+    lines = LINES * 5
+    assert confine(ChunkedConfineTraoriHemisphere(chunk_lines=chunk_lines), lines) == \
+        confine(ConfineTraoriHemisphere(), lines)
@@ -0,0 +1,23 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import io
+from .inverse_time_feed import InverseTimeFeed
+
+def run_lines(lines):
+    output = io.StringIO()
+    InverseTimeFeed().run(lines, output)
+    return output.getvalue().splitlines()
+
+def test_comment_follows_inverse_time_feed():
+    out = run_lines(['G1 X0 C=0 F100', 'G1 X10 C=10 ;cut'])
+    assert out[0] == 'G93'
+    assert out[-1] == 'G94 F100.0'
+    words, comment = out[2].split(';')
+    assert comment == 'cut'
+    assert words.split()[:3] == ['G1', 'X10', 'C=10']
+    assert words.split()[3].startswith('F')
+
+def test_comment_without_whitespace():
+    out = run_lines(['G1 X0 C=0 F100', 'G1 X10 C=10;cut'])
+    assert out[2].endswith(' ;cut')
+    assert out[2].split()[3].startswith('F')
@@ -0,0 +1,20 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import json
+import pytest
+from .machine_profile import MachineProfile
+
+def test_load_renamed_attributes(tmp_path):
+    fpath = tmp_path / 'profile.json'
+    fpath.write_text(json.dumps({'a_max_velocity': 100.0, 'c_min': -10.0, 'c_max': 10.0, 'a_pivot': [1.0, 2.0]}))
+    with pytest.warns(FutureWarning):
+        profile = MachineProfile.load(fpath)
+    assert profile.tilt_max_velocity == 100.0
+    assert profile.travel_limits('rotary') == (-10.0, 10.0)
+    assert profile.tilt_pivot == (1.0, 2.0)
+
+def test_load_conflicting_attributes(tmp_path):
+    fpath = tmp_path / 'profile.json'
+    fpath.write_text(json.dumps({'a_min': -90.0, 'tilt_min': -120.0}))
+    with pytest.raises(ValueError):
+        MachineProfile.load(fpath)
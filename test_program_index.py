@@ -0,0 +1,26 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+from .program_index import ProgramIndex
+from .program_store import MAX_WORD_LEN, ProgramStore
+
+LINES = [
+    'G0 X1',
+    'CYCLE832(_CAMTOLERANCE,_SEMIFIN,1)',
+    'CYCLE832(_CAMTOLERANCE,_SEMIFIN,2) ;finish',
+    'T' * MAX_WORD_LEN,
+    'T' * (MAX_WORD_LEN + 1),
+    '_A_VERY_LONG_PARAMETER_NAME_XYZ=0.0025',
+]
+
+def test_long_words(tmp_path):
+    mpf_fpath = tmp_path / 'p.mpf'
+    mpf_fpath.write_text('\n'.join(LINES) + '\n')
+    with ProgramStore.load(mpf_fpath) as store:
+        for chunk_blocks in (100000, 1):
+            index = ProgramIndex.build(store, chunk_blocks=chunk_blocks)
+            assert index.search('cycle832(_camtolerance,_semifin,1)').tolist() == [1]
+            assert index.search('CYCLE832(_CAMTOLERANCE,_SEMIFIN,*').tolist() == [1, 2]
+            assert index.search('T' * MAX_WORD_LEN).tolist() == [3]
+            assert index.search('T' * (MAX_WORD_LEN + 1)).tolist() == [4]
+            assert index.search('T' * MAX_WORD_LEN + '*').tolist() == [3, 4]
+            assert index.search('_A_VERY_LONG_PARAMETER_NAME_XYZ>0.002').tolist() == [5]
@@ -0,0 +1,27 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import io
+import math
+import pytest
+from .machine_model import MachineModel
+from .machine_profile import MachineProfile
+from .rotary_continuity import RotaryContinuityOptimizer
+
+def tool_vector_lines(tilt, rotaries):
+    a = math.radians(tilt)
+    lines = []
+    for x, c in enumerate(map(math.radians, rotaries)):
+        lines.append('G1 X{} Y0 Z0 A3={!r} B3={!r} C3={!r}'.format(
+            x, math.sin(a) * math.sin(c), -math.sin(a) * math.cos(c), math.cos(a)))
+    return lines
+
+@pytest.mark.parametrize('preferred_tilt_sign', [1, -1])
+def test_mirror_image_tie_takes_preferred_tilt(preferred_tilt_sign):
+    # Both solutions of every block cost the same travel; rounding made the optimizer pick A=-30 for this input
+    lines = tool_vector_lines(30, [-82, -65, -48, -31])
+    machine_model = MachineModel(MachineProfile(preferred_tilt_sign=preferred_tilt_sign))
+    output = io.StringIO()
+    RotaryContinuityOptimizer(machine_model).run(lines, output)
+    tilts = [float(line.split('A=')[1].split()[0]) for line in output.getvalue().splitlines()]
+    assert len(tilts) == 4
+    assert all(tilt * preferred_tilt_sign > 0 for tilt in tilts)
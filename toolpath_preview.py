@@ -0,0 +1,390 @@
+# Copyright (c) 2019 by Erik Hvatum
+
+import attr
+import numpy
+from PyQt5 import Qt
+import re
+import sys
+from .instrumentation import Instrumentation
+from .program_store import _UPPER, ProgramStore, address_values
+
+PROJECTIONS = {'XY': (0, 1), 'XZ': (0, 2), 'YZ': (1, 2)}
+COLOR_BY = ('operation', 'motion')
+
+_OPERATION_RE = re.compile(rb';Operation([^\r\n]*)')
+_AXES = tuple(map(ord, 'XYZ'))
+
+@attr.s
+class PreviewPath:
+    '''Programmed positions for drawing, as arrays with one element per position: block holds the index of the block
+    the position comes from, xyz the Nx3 float32 positions, rapid whether the position is reached by G0, and
+    operations an array of indexes into operation_names.  Level of detail pyramids of the path's projections (see
+    LodPyramid) are built on first use by pyramid(..) and kept.'''
+    block = attr.ib()
+    xyz = attr.ib()
+    rapid = attr.ib()
+    operations = attr.ib()
+    operation_names = attr.ib()
+    _pyramids = attr.ib(default=attr.Factory(dict), repr=False)
+
+    def __len__(self):
+        return len(self.block)
+
+    def pyramid(self, projection, instrumentation=None):
+        pyramid = self._pyramids.get(projection)
+        if pyramid is None:
+            cols = list(PROJECTIONS[projection])
+            # Decimation keeps every change of operation and of motion, so that either may be drawn as color
+            attributes = self.operations.astype(numpy.int64) * 2 + self.rapid
+            pyramid = self._pyramids[projection] = LodPyramid.build(self.xyz[:, cols], attributes, instrumentation)
+        return pyramid
+
+def store_toolpath(store, instrumentation=None, chunk_blocks=100000):
+    """Returns the PreviewPath of the programmed end positions of the blocks of store (a ProgramStore) with X, Y, or Z
+    words.  Positions are included once X, Y, and Z are all known.  Blocks are parsed chunk_blocks at a time, with
+    ProgramStore.words(..) and address_values(..), so that a position costs no Python object.  The positions of SUPA
+    (machine coordinate) blocks, symbolic axis values, and incremental (G91) positioning are disregarded, and arcs are
+    drawn as chords.  Motion is modal, G0 (rapid) until G1, G2, or G3 is programmed, including by a SUPA block.
+    Operations are named by ';Operation : NAME' comments."""
+    instrumentation = Instrumentation() if instrumentation is None else instrumentation
+    with instrumentation.stage('store_toolpath', blocks_in=len(store), blocks_out=0) as stage:
+        # The modal state carried from chunk to chunk: X, Y, Z (NaN until programmed), motion G code, and operation
+        carry = numpy.array([numpy.nan, numpy.nan, numpy.nan, 0.0])
+        operation = 0
+        operation_names = ['(program start)']
+        parts = []
+        for start in range(0, len(store), chunk_blocks):
+            stage.progress(start / len(store))
+            stop = min(start + chunk_blocks, len(store))
+            op_offsets = []
+            data = store.data[store.starts[start]:store.starts[stop]]
+            for match in _OPERATION_RE.finditer(data):
+                op_offsets.append(match.start())
+                operation_names.append(str(match.group(1), store.encoding, 'replace').partition(':')[2].strip()
+                                       or operation_names[-1])
+            part, carry = _chunk_toolpath(store, start, stop, carry)
+            ops = numpy.zeros(stop - start, dtype=numpy.int32)
+            if op_offsets:
+                op_blocks = numpy.searchsorted(store.starts[start:stop] - store.starts[start], op_offsets, side='right') - 1
+                ops[op_blocks] = numpy.arange(operation + 1, operation + 1 + len(op_offsets))
+            ops[0] = max(ops[0], operation)
+            numpy.maximum.accumulate(ops, out=ops)
+            operation = int(ops[-1])
+            local, xyz, rapid = part
+            parts.append((local + start, xyz, rapid, ops[local]))
+            stage.checkpoint()
+        if parts:
+            block, xyz, rapid, operations = (numpy.concatenate(arrays) for arrays in zip(*parts))
+        else:
+            block, xyz, rapid, operations = (
+                numpy.zeros(0, dtype=numpy.int64), numpy.zeros((0, 3), dtype=numpy.float32),
+                numpy.zeros(0, dtype=bool), numpy.zeros(0, dtype=numpy.int32))
+        stage.blocks_out = len(block)
+    return PreviewPath(block, xyz, rapid, operations, operation_names)
+
+def _chunk_toolpath(store, start, stop, carry):
+    """Returns ((indexes of the blocks from start with positions, their xyz, and whether they are rapid), the modal
+    state following block stop-1) for blocks start through stop-1, given the modal state carry preceding them."""
+    n = stop - start
+    blocks, words = store.words(start, stop)
+    blocks -= start
+    initials = _UPPER[words.view(numpy.uint8).reshape(len(words), words.dtype.itemsize)[:, 0]]
+    is_supa = numpy.zeros(n, dtype=bool)
+    is_supa[blocks[words == b'SUPA']] = True
+    # SUPA blocks move in machine coordinates, so their X, Y, and Z are skipped, but their motion G code is modal
+    relevant = (initials == ord('G')) | (numpy.isin(initials, _AXES) & ~is_supa[blocks])
+    blocks = blocks[relevant]
+    letters, values = address_values(words[relevant])
+    # updates[i, c] is the value programmed in block start+i for column c (X, Y, Z, and motion G code), or NaN
+    updates = numpy.full((n, 4), numpy.nan)
+    for col, letter in enumerate(_AXES):
+        m = (letters == letter) & ~numpy.isnan(values)
+        updates[blocks[m], col] = values[m]
+    m = (letters == ord('G')) & numpy.isin(values, (0, 1, 2, 3))
+    updates[blocks[m], 3] = values[m]
+    has_position = ~numpy.isnan(updates[:, :3]).all(axis=1)
+    # Carry each column forward from the most recent block that set it, and from carry before that
+    last_set = numpy.where(numpy.isnan(updates), -1, numpy.arange(n)[:, numpy.newaxis])
+    numpy.maximum.accumulate(last_set, axis=0, out=last_set)
+    modal = numpy.where(last_set >= 0, updates[numpy.maximum(last_set, 0), numpy.arange(4)], carry)
+    selected = numpy.flatnonzero(has_position & ~numpy.isnan(modal[:, :3]).any(axis=1))
+    return (selected, modal[selected, :3].astype(numpy.float32), modal[selected, 3] == 0), modal[-1] if n else carry
+
+@attr.s
+class LodLevel:
+    '''One level of a LodPyramid: the points of a 2D path decimated to a grid of cell sized cells (points holding
+    every point, with cell 0, for the finest level), index holding the index of each point in the full path.  The
+    bounding box of every chunk_size points, and of the first point of the following chunk, is held in chunk_mins and
+    chunk_maxs, so that segments outside a view are culled a chunk at a time.'''
+    cell = attr.ib()
+    index = attr.ib()
+    points = attr.ib()
+    chunk_size = attr.ib()
+    chunk_mins = attr.ib()
+    chunk_maxs = attr.ib()
+
+    @classmethod
+    def make(cls, cell, index, points, chunk_size):
+        starts = numpy.arange(0, len(points), chunk_size)
+        mins = numpy.minimum.reduceat(points, starts) if len(points) else numpy.zeros((0, 2), dtype=points.dtype)
+        maxs = numpy.maximum.reduceat(points, starts) if len(points) else numpy.zeros((0, 2), dtype=points.dtype)
+        # The segment leading from the last point of a chunk belongs to the chunk
+        numpy.minimum(mins[:-1], points[starts[1:]], out=mins[:-1])
+        numpy.maximum(maxs[:-1], points[starts[1:]], out=maxs[:-1])
+        return cls(cell, index, points, chunk_size, mins, maxs)
+
+    def visible_ranges(self, lo, hi):
+        """Returns a list of (start, stop) point ranges, such that every segment between consecutive points with a
+        part in the rectangle from lo to hi (each an (x, y) pair) has both ends in one of the ranges."""
+        visible = ((self.chunk_maxs >= lo) & (self.chunk_mins <= hi)).all(axis=1)
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], visible, [False])).astype(numpy.int8)))
+        size = self.chunk_size
+        return [(first * size, min(stop * size + 1, len(self.points))) for first, stop in edges.reshape(-1, 2).tolist()]
+
+class LodPyramid:
+    '''Multi-resolution levels of detail of a 2D path with per-point attributes (eg colors), so that drawing at any
+    scale costs about as many segments as there are pixels along the path.  Level k > 0 snaps the points of level
+    k-1 to a square grid of cells twice the size of level k-1's, keeping a point only where the path enters a new cell,
+    and keeping both points where the attribute changes, so that every segment of a level has the attribute of its
+    end point throughout.  The path drawn by a level is within a cell of the full path.  Levels are kept only where
+    they at least halve the points of the previous level.'''
+    FINEST_CELLS = 1 << 16
+
+    def __init__(self, levels, lo, hi):
+        self.levels = levels
+        self.lo = lo
+        self.hi = hi
+
+    @classmethod
+    def build(cls, points, attributes, instrumentation=None, chunk_size=1024, min_points=4096):
+        instrumentation = Instrumentation() if instrumentation is None else instrumentation
+        n = len(points)
+        with instrumentation.stage('LodPyramid.build', blocks_in=n, blocks_out=n) as stage:
+            points = numpy.ascontiguousarray(points, dtype=numpy.float32)
+            lo = points.min(axis=0).astype(numpy.float64) if n else numpy.zeros(2)
+            hi = points.max(axis=0).astype(numpy.float64) if n else numpy.zeros(2)
+            extent = float((hi - lo).max()) or 1.0
+            index = numpy.arange(n, dtype=numpy.int32 if n < 2**31 else numpy.int64)
+            levels = [LodLevel.make(0.0, index, points, chunk_size)]
+            cell = extent / cls.FINEST_CELLS
+            while len(points) > min_points and cell < extent:
+                stage.progress(numpy.log2(cell * cls.FINEST_CELLS / extent) / numpy.log2(cls.FINEST_CELLS))
+                # Each point's pair of cell coordinates, viewed as one int64 to be compared at once
+                cells = ((points - lo) / cell).astype(numpy.int32).view(numpy.int64).ravel()
+                attribute_changes = attributes[1:] != attributes[:-1]
+                keep = numpy.ones(len(points), dtype=bool)
+                keep[1:] = (cells[1:] != cells[:-1]) | attribute_changes
+                keep[:-1] |= attribute_changes
+                keep[-1] = True
+                index, points, attributes = index[keep], points[keep], attributes[keep]
+                if len(points) * 2 <= len(levels[-1].points):
+                    levels.append(LodLevel.make(cell, index, points, chunk_size))
+                cell *= 2
+            stage.blocks_out = len(levels[-1].points)
+        return cls(levels, lo, hi)
+
+    def level_for(self, max_cell):
+        """The coarsest level with cells no larger than max_cell."""
+        for level in reversed(self.levels):
+            if level.cell <= max_cell:
+                return level
+        return self.levels[0]
+
+def _polygon(points):
+    """A QPolygonF of the Nx2 array points, filled in place through its buffer."""
+    n = len(points)
+    polygon = Qt.QPolygonF(n)
+    if n:
+        ptr = polygon.data()
+        ptr.setsize(n * 16)
+        numpy.frombuffer(ptr, dtype=numpy.float64).reshape(n, 2)[:] = points
+    return polygon
+
+class ToolpathPreview(Qt.QWidget):
+    '''A 2D (XY, XZ, or YZ) view of a PreviewPath, colored by operation or by motion (rapid or feed), drawn with
+    QPainter from the level of the path's LodPyramid matching the zoom.  The mouse wheel zooms about the cursor,
+    dragging pans, double-clicking fits the path to the view, and clicking emits block_clicked with the block of the
+    position drawn nearest the cursor.  The level drawn is the coarsest with cells of at most pixel_tolerance pixels.'''
+    block_clicked = Qt.pyqtSignal(int)
+    FEED_COLOR = Qt.QColor(30, 110, 220)
+    RAPID_COLOR = Qt.QColor(230, 120, 0)
+    _CLICK_RADIUS = 6
+    pixel_tolerance = 2
+    _ZOOM_STEP = 1.25
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumSize(200, 200)
+        self.setMouseTracking(False)
+        self._path = None
+        self._projection = 'XY'
+        self._color_by = 'operation'
+        self._center = numpy.zeros(2)
+        self._scale = 1.0
+        self._press_pos = None
+        self._drag_last = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, v):
+        self._path = v
+        self.fit()
+
+    @property
+    def projection(self):
+        return self._projection
+
+    @projection.setter
+    def projection(self, v):
+        if v not in PROJECTIONS:
+            raise ValueError('projection must be one of {}.'.format(', '.join(PROJECTIONS)))
+        self._projection = v
+        self.fit()
+
+    @property
+    def color_by(self):
+        return self._color_by
+
+    @color_by.setter
+    def color_by(self, v):
+        if v not in COLOR_BY:
+            raise ValueError('color_by must be one of {}.'.format(', '.join(COLOR_BY)))
+        self._color_by = v
+        self.update()
+
+    def pyramid(self):
+        return None if self._path is None else self._path.pyramid(self._projection)
+
+    def fit(self):
+        pyramid = self.pyramid()
+        if pyramid is not None:
+            self._center = (pyramid.lo + pyramid.hi) / 2
+            extent = numpy.maximum(pyramid.hi - pyramid.lo, 1e-6)
+            self._scale = 0.95 * min(max(self.width(), 1) / extent[0], max(self.height(), 1) / extent[1])
+        self.update()
+
+    def to_screen(self, points):
+        """Transforms Nx2 path coordinates to widget coordinates, with y up."""
+        screen = numpy.empty((len(points), 2))
+        numpy.subtract(points, self._center, out=screen)
+        screen *= (self._scale, -self._scale)
+        screen += (self.width() / 2, self.height() / 2)
+        return screen
+
+    def to_path(self, x, y):
+        """Transforms a widget position to path coordinates."""
+        return self._center + (numpy.array([x, y]) - (self.width() / 2, self.height() / 2)) * (1, -1) / self._scale
+
+    def _visible(self):
+        """Returns the level drawn at the current zoom and its visible point ranges."""
+        level = self.pyramid().level_for(self.pixel_tolerance / self._scale)
+        lo, hi = self.to_path(0, self.height()), self.to_path(self.width(), 0)
+        return level, level.visible_ranges(lo, hi)
+
+    def _colors(self, index):
+        """Returns (color code of each of the path's points in index, {color code: QColor})."""
+        if self._color_by == 'motion':
+            return self._path.rapid[index], {False: self.FEED_COLOR, True: self.RAPID_COLOR}
+        operations = self._path.operations[index]
+        # Successive operations are a golden angle apart in hue
+        return operations, {op: Qt.QColor.fromHsv(int(op * 137.5) % 360, 200, 210) for op in numpy.unique(operations).tolist()}
+
+    def paintEvent(self, event):
+        painter = Qt.QPainter(self)
+        try:
+            painter.fillRect(self.rect(), Qt.Qt.white)
+            if self._path is None or not len(self._path):
+                return
+            level, ranges = self._visible()
+            runs = {}
+            polygons = []
+            for start, stop in ranges:
+                codes, colors = self._colors(level.index[start:stop])
+                polygon = _polygon(self.to_screen(level.points[start:stop]))
+                polygons.append(polygon)
+                # Segment i-1 to i takes the color of point i; a run of points of one color is drawn with the
+                # segment leading to it
+                run_starts = numpy.concatenate(([0], numpy.flatnonzero(codes[1:] != codes[:-1]) + 1))
+                run_stops = numpy.append(run_starts[1:], len(codes))
+                for code, run_start, run_stop in zip(codes[run_starts].tolist(), run_starts.tolist(), run_stops.tolist()):
+                    runs.setdefault(code, (colors[code], []))[1].append((polygon, max(run_start - 1, 0), run_stop))
+            for color, color_runs in runs.values():
+                painter.setPen(Qt.QPen(color, 0))
+                for polygon, run_start, run_stop in color_runs:
+                    painter.drawPolyline(polygon.mid(run_start, run_stop - run_start))
+        finally:
+            painter.end()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if event.oldSize().width() <= 0:
+            self.fit()
+
+    def wheelEvent(self, event):
+        if self._path is None:
+            return
+        pos = event.pos()
+        anchor = self.to_path(pos.x(), pos.y())
+        self._scale *= self._ZOOM_STEP ** (event.angleDelta().y() / 120)
+        # Keep the point under the cursor under the cursor
+        self._center += anchor - self.to_path(pos.x(), pos.y())
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.Qt.LeftButton:
+            self._press_pos = self._drag_last = event.pos()
+
+    def mouseMoveEvent(self, event):
+        if self._drag_last is not None:
+            delta = event.pos() - self._drag_last
+            self._drag_last = event.pos()
+            self._center -= numpy.array([delta.x(), -delta.y()]) / self._scale
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        if event.button() == Qt.Qt.LeftButton and self._press_pos is not None:
+            if (event.pos() - self._press_pos).manhattanLength() < 3:
+                block = self.block_at(event.pos().x(), event.pos().y())
+                if block is not None:
+                    self.block_clicked.emit(block)
+            self._press_pos = self._drag_last = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.fit()
+
+    def block_at(self, x, y):
+        """The block of the drawn position nearest widget position x, y, if one is within a few pixels."""
+        if self._path is None or not len(self._path):
+            return
+        level = self.pyramid().level_for(self.pixel_tolerance / self._scale)
+        radius = self._CLICK_RADIUS / self._scale
+        center = self.to_path(x, y)
+        best = None
+        for start, stop in level.visible_ranges(center - radius, center + radius):
+            distances = numpy.square(level.points[start:stop] - center.astype(numpy.float32)).sum(axis=1)
+            idx = int(distances.argmin())
+            if distances[idx] <= radius**2 and (best is None or distances[idx] < best[0]):
+                best = distances[idx], level.index[start + idx]
+        return None if best is None else int(self._path.block[best[1]])
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser('Toolpath preview commandline interface.')
+    parser.add_argument('input', type=str)
+    parser.add_argument('--projection', choices=tuple(PROJECTIONS), default='XY')
+    parser.add_argument('--color-by', choices=COLOR_BY, default='operation')
+    args = parser.parse_args()
+    app = Qt.QApplication(sys.argv)
+    with ProgramStore.load(args.input) as store:
+        path = store_toolpath(store)
+    preview = ToolpathPreview()
+    preview.block_clicked.connect(lambda block: print('block', block))
+    preview.color_by = args.color_by
+    preview.resize(800, 800)
+    preview.path = path
+    preview.projection = args.projection
+    preview.show()
+    app.exec_()